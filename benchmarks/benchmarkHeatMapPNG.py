@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Time the matplotlib and direct (rasterImages) PNG paths for heatmap thumbnails.
+
+Usage:
+  %s [--count=<count>] [--heatmapresolution=<heatmapresolution>] [--outputDir=<outputDir>]
+  %s (-h | --help)
+
+Options:
+  -h --help                                 Show this screen.
+  --count=<count>                           Number of heatmaps of each kind to write [default: 20].
+  --heatmapresolution=<heatmapresolution>   ATLAS heatmap resolution [default: 128].
+  --outputDir=<outputDir>                   Where to write the images [default: /tmp/gkplot_benchmark].
+"""
+import sys
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0])
+import os
+import time
+from docopt import docopt
+import numpy as n
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gkplot', 'scripts'))
+from gkutils.commonutils import Struct, cleanOptions
+from plotATLASHeatMap import plotHeatMap
+from plotLSSTDetectorHeatMap import draw_grid_heatmap, write_grid_heatmap_png
+from rasterImages import heatMapPNG
+
+
+def timeit(label, count, f):
+    start = time.perf_counter()
+    for i in range(count):
+        f(i)
+    elapsed = time.perf_counter() - start
+    print ("%-40s %8.2f ms per image" % (label, elapsed / count * 1000.0))
+    return elapsed
+
+
+def drawLSST(values, path):
+    fig, ax = draw_grid_heatmap(values, cmap = 'warm', show_detector_ids = False)
+    fig.savefig(path, dpi=200, bbox_inches="tight")
+
+
+def main():
+    opts = docopt(__doc__)
+    options = Struct(**cleanOptions(opts))
+    count = int(options.count)
+    resolution = int(options.heatmapresolution)
+    os.makedirs(options.outputDir, exist_ok = True)
+
+    rng = n.random.default_rng(42)
+    matrices = rng.poisson(100, size = (count, resolution, resolution))
+    medians = n.median(matrices, axis = (1, 2))
+    detectors = rng.poisson(2000, size = (count, 189)).astype(float)
+
+    path = lambda name, i: os.path.join(options.outputDir, '%s_%d.png' % (name, i))
+
+    slow = timeit('ATLAS plotHeatMap (dpi=600)', count, lambda i: plotHeatMap('bench', matrices[i], None, None, outputFile = path('atlas_mpl', i), heatMapResolution = resolution, colorBarSpan = 1.6 * medians[i], median = medians[i]))
+    fast = timeit('ATLAS heatMapPNG', count, lambda i: heatMapPNG(path('atlas_raw', i), matrices[i], 1.6 * medians[i]))
+    print ("%-40s %8.1fx" % ('speedup', slow / fast))
+
+    slow = timeit('LSST draw_grid_heatmap + savefig', count, lambda i: drawLSST(detectors[i], path('lsst_mpl', i)))
+    fast = timeit('LSST write_grid_heatmap_png', count, lambda i: write_grid_heatmap_png(detectors[i], path('lsst_raw', i), cmap = 'warm'))
+    print ("%-40s %8.1fx" % ('speedup', slow / fast))
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""Time the plot scripts on synthetic inputs of 10^3 to 10^7 rows, and compare the results between commits.
+
+Each benchmark makes its input file with a seeded generator (see syntheticData.py),
+keeps it in the data directory for the next run, and runs the script on it with
+--profile in a new process. The time of the script's load (read, parse, filter),
+compute (aggregate) and render (draw, layout, save, write) stages, the whole run
+including start up, and the peak memory of the process are written to a results
+file, along with the commit they were measured at.
+
+    %s --sizes=1e3,1e5,1e7 --results=/tmp/before.json
+    (check out or make a change)
+    %s --sizes=1e3,1e5,1e7 --baseline=/tmp/before.json
+
+compares as it goes, or compare two results files afterwards with
+
+    %s compare /tmp/before.json /tmp/after.json
+
+Comparing exits with status 1 if anything is slower, or needs more memory, by more
+than the threshold.
+
+Usage:
+  %s compare <before> <after> [--threshold=<threshold>]
+  %s [<benchmark>...] [--sizes=<sizes>] [--repeat=<repeat>] [--seed=<seed>] [--dataDir=<dataDir>] [--results=<results>] [--baseline=<baseline>] [--threshold=<threshold>] [--timeout=<timeout>]
+  %s --list
+  %s (-h | --help)
+
+Options:
+  -h --help                         Show this screen.
+  --list                            List the benchmarks.
+  --sizes=<sizes>                   Numbers of input rows, comma separated [default: 1e3,1e4,1e5].
+  --repeat=<repeat>                 Number of runs of each benchmark; the run with the median time is kept [default: 3].
+  --seed=<seed>                     Random seed for the input files [default: 42].
+  --dataDir=<dataDir>               Where to keep the input files and write the plots [default: /tmp/gkplot_benchmark].
+  --results=<results>               Results file. Default is results_<commit>.json in the data directory.
+  --baseline=<baseline>             Compare the results with this earlier results file.
+  --threshold=<threshold>           Fractional change counted as a regression [default: 0.1].
+  --timeout=<timeout>               Give up on a run after this many seconds [default: 1800].
+"""
+import sys
+__doc__ = __doc__ % ((sys.argv[0],) * 7)
+import os
+import json
+import time
+import platform
+import subprocess
+import tempfile
+from docopt import docopt
+import numpy as n
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+CLI = os.path.join(REPO_DIR, 'gkplot', 'scripts', 'cli.py')
+sys.path.insert(0, os.path.dirname(CLI))
+from gkutils.commonutils import Struct, cleanOptions
+from syntheticData import writeSkyExposures, writeDophotLightCurve, writeSpectrum, writeHistogramColumns, writeDetectorDetections, writeDiaSources
+
+# dataset -> (generator, file extension)
+DATASETS = {
+    'sky':          (writeSkyExposures, 'txt'),
+    'lightcurve':   (writeDophotLightCurve, 'txt'),
+    'spectrum':     (writeSpectrum, 'txt'),
+    'mags':         (writeHistogramColumns, 'csv'),
+    'detections':   (writeDetectorDetections, 'tsv'),
+    'diasources':   (writeDiaSources, 'csv'),
+}
+
+# benchmark -> (dataset, gkplot command, arguments). {output} is the plot file name
+# and {prefix} the start of it, for scripts that write several files.
+BENCHMARKS = {
+    'sky':                  ('sky', 'sky', ['--outfile={output}', '--tight']),
+    'lightcurve':           ('lightcurve', 'scatter', ['--x=mjd', '--y=m', '--yerror=dminst', '--error', '--invert', '--delimiter= ', '--tight', '--outputFile={output}']),
+    'spectrum':             ('spectrum', 'scatter', ['--x=wavelength', '--y=flux', '--header=wavelength flux', '--line', '--linewidth=0.25', '--colour=black', '--alpha=1.0', '--delimiter= ', '--outputFile={output}']),
+    'histogram':            ('mags', 'histogram', ['--column=mag', '--binwidth=0.1', '--binlower=12', '--binupper=21', '--outputFile={output}']),
+    'histogram-grouped':    ('mags', 'histogram', ['--column=mag', '--groupby=telescope', '--binwidth=0.1', '--binlower=12', '--binupper=21', '--outputFile={output}']),
+    'heatmap':              ('detections', 'heatmap', ['--colorbar', '--outputFile={output}']),
+    'lsst-cuts':            ('diasources', 'lsst-cuts', ['--cuts=all:;objects:diaObjectId!=0;ddf:field==DDF', '--outputPrefix={prefix}']),
+    'bar':                  ('diasources', 'bar', ['--x=detector', '--aggregate=count', '--outputFile={output}']),
+}
+
+# Profile stages making up each part of a run
+LOAD_STAGES = ('read', 'parse', 'filter')
+COMPUTE_STAGES = ('aggregate',)
+RENDER_STAGES = ('draw', 'layout', 'save', 'write')
+
+METRICS = ('load', 'compute', 'render', 'wall', 'peakRSS')
+
+# Changes smaller than these are noise, whatever the fraction
+MIN_SECONDS = 0.02
+MIN_BYTES = 5e6
+
+
+def gitCommit():
+    """(commit, whether the tree has uncommitted changes), or (None, None) outside git."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd = REPO_DIR, capture_output = True, text = True, check = True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd = REPO_DIR, capture_output = True, text = True, check = True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def dataFile(dataDir, dataset, rows, seed):
+    """The input file for a dataset, made if it isn't already there."""
+    generator, extension = DATASETS[dataset]
+    filename = os.path.join(dataDir, 'data', '%s_%d_%d.%s' % (dataset, rows, seed, extension))
+    if not os.path.exists(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok = True)
+        start = time.perf_counter()
+        # Write to a temporary file first, so that an interrupted run doesn't leave half a file
+        temp = filename + '.tmp'
+        generator(temp, rows, seed = seed)
+        os.replace(temp, filename)
+        print ("Made %s in %.1fs" % (filename, time.perf_counter() - start))
+    return filename
+
+
+def stageTimes(profile):
+    """Load, compute and render times from a --profile JSON file, using each stage's self time."""
+    selfTimes = {s['stage']: s['self'] for s in profile['stages']}
+    total = lambda stages: sum(selfTimes.get(s, 0.0) for s in stages)
+    return {'load': total(LOAD_STAGES), 'compute': total(COMPUTE_STAGES), 'render': total(RENDER_STAGES)}
+
+
+def runOnce(benchmark, filename, outputDir, timeout):
+    """Run a benchmark's script once. Returns its result, with status ok, failed or timeout."""
+    dataset, command, args = BENCHMARKS[benchmark]
+    prefix = os.path.join(outputDir, benchmark)
+    args = [a.format(output = prefix + '.png', prefix = prefix) for a in args]
+
+    fd, profileFile = tempfile.mkstemp(suffix = '.json')
+    os.close(fd)
+    env = dict(os.environ, MPLBACKEND = 'Agg')
+    result = {'status': 'ok'}
+    start = time.perf_counter()
+    try:
+        subprocess.run([sys.executable, CLI, command, filename] + args + ['--profile=' + profileFile], env = env, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True, timeout = timeout, check = True)
+        result['wall'] = time.perf_counter() - start
+        with open(profileFile) as f:
+            profile = json.load(f)
+        result.update(stageTimes(profile))
+        result['peakRSS'] = profile['total']['peakRSS']
+        result['stages'] = profile['stages']
+    except subprocess.TimeoutExpired:
+        result['status'] = 'timeout'
+    except subprocess.CalledProcessError as e:
+        result['status'] = 'failed'
+        result['error'] = e.stderr.strip().splitlines()[-1] if e.stderr.strip() else 'exit status %d' % e.returncode
+    finally:
+        os.remove(profileFile)
+    return result
+
+
+def runBenchmark(benchmark, rows, options):
+    filename = dataFile(options.dataDir, BENCHMARKS[benchmark][0], rows, int(options.seed))
+    outputDir = os.path.join(options.dataDir, 'output')
+    os.makedirs(outputDir, exist_ok = True)
+
+    runs = []
+    for i in range(int(options.repeat)):
+        run = runOnce(benchmark, filename, outputDir, float(options.timeout))
+        if run['status'] != 'ok':
+            # No point trying again
+            runs = [run]
+            break
+        runs.append(run)
+
+    runs.sort(key = lambda r: r.get('wall', 0.0))
+    result = {'benchmark': benchmark, 'command': BENCHMARKS[benchmark][1], 'rows': rows}
+    result.update(runs[len(runs) // 2])
+    return result
+
+
+def printResult(r):
+    if r['status'] != 'ok':
+        print ("%-18s %9d  %s %s" % (r['benchmark'], r['rows'], r['status'].upper(), r.get('error', '')))
+        return
+    print ("%-18s %9d %9.3f %9.3f %9.3f %9.3f %10.1f" % (r['benchmark'], r['rows'], r['load'], r['compute'], r['render'], r['wall'], r['peakRSS'] / 1e6))
+
+
+def compareResults(baseline, results, threshold):
+    """Print the change in each metric from the baseline. Returns the number of regressions."""
+    before = {(r['benchmark'], r['rows']): r for r in baseline['results']}
+    print ("Comparing %s with %s (regression if more than %.0f%% worse)" % ((results.get('commit') or '?')[:10], (baseline.get('commit') or '?')[:10], threshold * 100))
+    print ("%-18s %9s %-8s %10s %10s %8s" % ('benchmark', 'rows', 'metric', 'before', 'after', 'change'))
+
+    regressions = 0
+    for r in results['results']:
+        b = before.get((r['benchmark'], r['rows']))
+        if b is None:
+            continue
+        if b['status'] != 'ok' or r['status'] != 'ok':
+            if b['status'] != r['status']:
+                print ("%-18s %9d %-8s %10s %10s" % (r['benchmark'], r['rows'], 'status', b['status'], r['status']))
+                if r['status'] != 'ok':
+                    regressions += 1
+            continue
+        for metric in METRICS:
+            old, new = b[metric], r[metric]
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            floor = MIN_BYTES if metric == 'peakRSS' else MIN_SECONDS
+            worse = change > threshold and new - old > floor
+            scale, unit = (1e6, 'MB') if metric == 'peakRSS' else (1.0, 's')
+            print ("%-18s %9d %-8s %9.3f%-1s %9.3f%-1s %+7.1f%%%s" % (r['benchmark'], r['rows'], metric, old / scale, unit[0], new / scale, unit[0], change * 100, '  <-- worse' if worse else ''))
+            regressions += worse
+    print ("%d regressions" % regressions)
+    return regressions
+
+
+def readResults(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def doBenchmarks(options):
+    benchmarks = options.benchmark or list(BENCHMARKS)
+    for benchmark in benchmarks:
+        if benchmark not in BENCHMARKS:
+            sys.exit("Unknown benchmark %s. Use one of: %s" % (benchmark, ', '.join(BENCHMARKS)))
+    sizes = [int(float(s)) for s in options.sizes.split(',')]
+
+    import matplotlib
+    commit, dirty = gitCommit()
+    results = {'commit': commit,
+               'dirty': dirty,
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'numpy': n.__version__,
+               'matplotlib': matplotlib.__version__,
+               'platform': platform.platform(),
+               'cpus': os.cpu_count(),
+               'seed': int(options.seed),
+               'repeat': int(options.repeat),
+               'results': []}
+
+    print ("%-18s %9s %9s %9s %9s %9s %10s" % ('benchmark', 'rows', 'load (s)', 'compute', 'render', 'wall', 'peak (MB)'))
+    for benchmark in benchmarks:
+        for rows in sizes:
+            result = runBenchmark(benchmark, rows, options)
+            printResult(result)
+            results['results'].append(result)
+
+    resultsFile = options.results or os.path.join(options.dataDir, 'results_%s.json' % ((commit or 'unknown')[:10] + ('-dirty' if dirty else '')))
+    with open(resultsFile, 'w') as f:
+        json.dump(results, f, indent = 2)
+    print ("Results in %s" % resultsFile)
+    return results
+
+
+def main():
+    opts = docopt(__doc__)
+    options = Struct(**cleanOptions(opts))
+
+    if options.list:
+        for name, (dataset, command, args) in BENCHMARKS.items():
+            print ("%-20s gkplot %s <%s> %s" % (name, command, dataset, ' '.join(args)))
+        return
+
+    if options.compare:
+        regressions = compareResults(readResults(options.before), readResults(options.after), float(options.threshold))
+    else:
+        results = doBenchmarks(options)
+        regressions = compareResults(readResults(options.baseline), results, float(options.threshold)) if options.baseline else 0
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__=='__main__':
+    main()
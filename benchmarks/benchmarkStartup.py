@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Time how long each gkplot command takes to start, i.e. to print its --help.
+
+For small plots run from cron or a pipeline, start up (mostly imports) is most
+of the run time. With --importtime, also list the slowest imports of each command,
+from python -X importtime.
+
+Usage:
+  %s [--repeat=<repeat>] [--importtime] [--top=<top>] [<command>...]
+  %s (-h | --help)
+
+Options:
+  -h --help                         Show this screen.
+  --repeat=<repeat>                 Number of runs of each command; the median is reported [default: 5].
+  --importtime                      Also show the slowest imports of each command.
+  --top=<top>                       Number of imports to show with --importtime [default: 10].
+"""
+import sys
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0])
+import os
+import subprocess
+import time
+from docopt import docopt
+import numpy as n
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gkplot', 'scripts', 'cli.py')
+sys.path.insert(0, os.path.dirname(CLI))
+from cli import COMMANDS
+
+
+def startupTime(args, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, CLI] + args, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True)
+        times.append(time.perf_counter() - start)
+    return n.median(times)
+
+
+def slowestImports(args, top):
+    """(cumulative microseconds, module) for the slowest top level imports."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', CLI] + args, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        selfTime, cumulative, module = line[len('import time:'):].split('|')
+        # Only the imports made by the script itself, not their dependencies
+        if module.startswith(' ') and not module.startswith('  '):
+            imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse = True)[:top]
+
+
+def main():
+    options = docopt(__doc__)
+    repeat = int(options['--repeat'])
+    commands = options['<command>'] or list(COMMANDS)
+
+    print ("%-20s %10s" % ('command', 'start (s)'))
+    print ("%-20s %10.3f" % ('(gkplot --help)', startupTime(['--help'], repeat)))
+    for command in commands:
+        print ("%-20s %10.3f" % (command, startupTime([command, '--help'], repeat)))
+        if options['--importtime']:
+            for cumulative, module in slowestImports([command, '--help'], int(options['--top'])):
+                print ("    %-30s %8.3f" % (module, cumulative / 1e6))
+
+
+if __name__=='__main__':
+    main()
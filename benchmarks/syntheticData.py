@@ -0,0 +1,147 @@
+"""Deterministic synthetic input files for the plot benchmarks.
+
+Each generator writes a file of the given number of rows in the format the script
+reads, from a numpy random generator seeded with seed, so the same arguments always
+give the same file. The rows are made and written a chunk at a time, so that files
+of 10^7 rows don't need all of their rows in memory.
+
+    writeSkyExposures('/tmp/sky_1000.txt', 1000)
+"""
+import numpy as n
+
+CHUNK_SIZE = 1000000
+
+ATLAS_CHIP_SIZE = 10560
+ATLAS_TELESCOPES = ['01a', '02a', '03a', '04a', '05r']
+LSST_DETECTORS = 189
+
+
+def _writeRows(f, columns, formats, delimiter):
+    """Write columns (lists of equal length) of one chunk, each with its % format."""
+    formatted = [list(map(fmt.__mod__, column)) for column, fmt in zip(columns, formats)]
+    f.write('\n'.join(delimiter.join(row) for row in zip(*formatted)))
+    f.write('\n')
+
+
+def _chunks(rows):
+    """(start, size) of each chunk of rows."""
+    for start in range(0, rows, CHUNK_SIZE):
+        yield start, min(CHUNK_SIZE, rows - start)
+
+
+def _exposureNames(rng, telescopes, mjds, size):
+    """ATLAS style exposure names, e.g. 02a59123o0123, for the given whole MJDs."""
+    telescope = n.array(telescopes)[rng.integers(0, len(telescopes), size)]
+    number = rng.integers(0, 1000, size)
+    return ['%s%05do%04d' % t for t in zip(telescope.tolist(), mjds.tolist(), number.tolist())]
+
+
+def writeSkyExposures(filename, rows, seed = 42):
+    """Exposure centres for skyplot: ra dec mjd filter expname, space separated.
+
+    Positions cover the ATLAS sky (dec above -50), uniformly per unit area.
+    """
+    rng = n.random.default_rng(seed)
+    with open(filename, 'w') as f:
+        f.write('ra dec mjd filter expname\n')
+        for start, size in _chunks(rows):
+            ra = rng.uniform(0.0, 360.0, size)
+            dec = n.degrees(n.arcsin(rng.uniform(-0.766, 1.0, size)))
+            mjd = rng.uniform(59000.0, 59365.0, size)
+            filters = n.where(rng.random(size) < 0.7, 'o', 'c')
+            names = _exposureNames(rng, ATLAS_TELESCOPES[:4], mjd.astype(int), size)
+            _writeRows(f, [ra.tolist(), dec.tolist(), mjd.tolist(), filters.tolist(), names], ['%.5f', '%.5f', '%.5f', '%s', '%s'], ' ')
+
+
+def writeDophotLightCurve(filename, rows, seed = 42):
+    """A dophot light curve for scatterplot: mjd m dminst mag5sig F obs, space separated.
+
+    A slowly varying source at about 17th magnitude, observed over ten years, with
+    errors that grow with the magnitude.
+    """
+    rng = n.random.default_rng(seed)
+    with open(filename, 'w') as f:
+        f.write('mjd m dminst mag5sig F obs\n')
+        for start, size in _chunks(rows):
+            mjd = n.sort(rng.uniform(57000.0, 60650.0, size))
+            dminst = 0.01 + 0.1 * rng.random(size)
+            m = 17.0 + 0.8 * n.sin(2.0 * n.pi * mjd / 431.0) + rng.normal(0.0, 1.0, size) * dminst
+            mag5sig = rng.normal(19.5, 0.5, size)
+            filters = n.where(rng.random(size) < 0.7, 'o', 'c')
+            names = _exposureNames(rng, ATLAS_TELESCOPES, mjd.astype(int), size)
+            _writeRows(f, [mjd.tolist(), m.tolist(), dminst.tolist(), mag5sig.tolist(), filters.tolist(), names], ['%.6f', '%.3f', '%.3f', '%.2f', '%s', '%s'], ' ')
+
+
+def writeSpectrum(filename, rows, seed = 42):
+    """A spectrum for scatterplot --line: wavelength flux, space separated, with no header.
+
+    A sloping continuum from 3500 to 9500 Angstroms with a few broad emission lines and noise.
+    """
+    rng = n.random.default_rng(seed)
+    lines = [(4861.0, 0.4, 60.0), (5876.0, 0.2, 80.0), (6563.0, 1.0, 70.0), (8600.0, 0.3, 150.0)]
+    with open(filename, 'w') as f:
+        for start, size in _chunks(rows):
+            wavelength = 3500.0 + 6000.0 * (start + n.arange(size)) / max(rows - 1, 1)
+            flux = 0.5 - 0.2 * (wavelength - 3500.0) / 6000.0
+            for centre, height, width in lines:
+                flux += height * n.exp(-0.5 * ((wavelength - centre) / width) ** 2)
+            flux += rng.normal(0.0, 0.02, size)
+            _writeRows(f, [wavelength.tolist(), flux.tolist()], ['%.4f', '%.6e'], ' ')
+
+
+def writeHistogramColumns(filename, rows, seed = 42):
+    """Discovery magnitudes for histogramplot: mag,telescope, comma separated."""
+    rng = n.random.default_rng(seed)
+    with open(filename, 'w') as f:
+        f.write('mag,telescope\n')
+        for start, size in _chunks(rows):
+            telescope = rng.integers(0, len(ATLAS_TELESCOPES), size)
+            # Each telescope a little deeper than the last
+            mag = n.clip(rng.gumbel(18.5 + 0.2 * telescope, 0.8, size), 12.0, 21.0)
+            _writeRows(f, [mag.tolist(), n.array(ATLAS_TELESCOPES)[telescope].tolist()], ['%.6f', '%s'], ',')
+
+
+def writeDetectorDetections(filename, rows, seed = 42):
+    """ATLAS detections for plotATLASHeatMap: x y obs, tab separated.
+
+    Detections are spread over the chip, with a few hot spots and a hot column,
+    in exposures of about 1000 detections each.
+    """
+    rng = n.random.default_rng(seed)
+    hotSpots = rng.uniform(0, ATLAS_CHIP_SIZE, (5, 2))
+    with open(filename, 'w') as f:
+        f.write('x\ty\tobs\n')
+        for start, size in _chunks(rows):
+            x = rng.uniform(0, ATLAS_CHIP_SIZE, size)
+            y = rng.uniform(0, ATLAS_CHIP_SIZE, size)
+            hot = rng.random(size)
+            spots = hot < 0.1
+            spot = rng.integers(0, len(hotSpots), spots.sum())
+            x[spots] = n.clip(rng.normal(hotSpots[spot, 0], 50.0), 0, ATLAS_CHIP_SIZE - 1)
+            y[spots] = n.clip(rng.normal(hotSpots[spot, 1], 50.0), 0, ATLAS_CHIP_SIZE - 1)
+            column = (hot >= 0.1) & (hot < 0.12)
+            x[column] = rng.normal(ATLAS_CHIP_SIZE / 3.0, 2.0, column.sum())
+            exposures = (start + n.arange(size)) // 1000
+            names = ['02a%05do%04d' % (59000 + e // 1000, e % 1000) for e in exposures.tolist()]
+            _writeRows(f, [x.tolist(), y.tolist(), names], ['%.2f', '%.2f', '%s'], '\t')
+
+
+def writeDiaSources(filename, rows, seed = 42):
+    """LSST DIA sources for plotLSSTDetectorCuts and barplot --aggregate:
+    diaSourceId,detector,diaObjectId,reliability,field, comma separated.
+
+    Some detectors are busier than others, a few are dead, and about a third of
+    the sources have no object (diaObjectId 0).
+    """
+    rng = n.random.default_rng(seed)
+    weights = rng.gamma(4.0, 1.0, LSST_DETECTORS)
+    weights[rng.choice(LSST_DETECTORS, 3, replace = False)] = 0.0
+    weights /= weights.sum()
+    with open(filename, 'w') as f:
+        f.write('diaSourceId,detector,diaObjectId,reliability,field\n')
+        for start, size in _chunks(rows):
+            detector = rng.choice(LSST_DETECTORS, size, p = weights)
+            objectId = n.where(rng.random(size) < 0.33, 0, rng.integers(1, max(rows // 3, 2), size))
+            reliability = rng.random(size)
+            field = n.where(rng.random(size) < 0.9, 'WFD', 'DDF')
+            _writeRows(f, [(start + n.arange(size)).tolist(), detector.tolist(), objectId.tolist(), reliability.tolist(), field.tolist()], ['%d', '%d', '%d', '%.4f', '%s'], ',')
@@ -2,7 +2,7 @@
 """Plot generic bar chart.
 
 Usage:
-  %s <filename> [--outputFile=<file>] [--title=<title>] [--x=<x>] [--y=<y>] [--xlabel=<xlabel>] [--ylabel=<ylabel>] [--xlower=<xlower>] [--xupper=<xupper>] [--ylower=<ylower>] [--yupper=<yupper>] [--delimiter=<delimiter]
+  %s <filename> [--outputFile=<file>] [--title=<title>] [--x=<x>] [--y=<y>] [--xlabel=<xlabel>] [--ylabel=<ylabel>] [--xlower=<xlower>] [--xupper=<xupper>] [--ylower=<ylower>] [--yupper=<yupper>] [--delimiter=<delimiter] [--aggregate=<aggregate>] [--chunksize=<chunksize>] [--steps] [--skipunchanged] [--profile=<profile>] [--cprofile=<cprofile>]
   %s (-h | --help)
   %s --version
 
@@ -20,67 +20,211 @@ Options:
   --ylower=<ylower>                 ylower limit
   --yupper=<yupper>                 yupper limit
   --delimiter=<delimiter>           Delimiter to use [default: ,].
+  --aggregate=<aggregate>           Input is raw rows (e.g. one per detection): plot the count of rows, or the sum of the y column, per x value. Either count or sum.
+  --chunksize=<chunksize>           Number of rows to read at a time with --aggregate [default: 1000000].
+  --steps                           Draw the bars as one filled step outline (always done for more than 2000 bars).
+  --skipunchanged                   Don't make the plot if the output files were made from the same input files, with the same options.
+  --profile=<profile>               Report the wall time, CPU time, peak memory and number of artists of each stage (read, parse, aggregate, draw, save): to stderr if -, otherwise to this JSON file.
+  --cprofile=<cprofile>             Also dump cProfile statistics for the whole run to this file.
+
+E.g.:
+  %s ~/lasair/lsst/run_20251009/diasources.csv --aggregate=count --x=detector --outputFile=/tmp/detectors.png
 """
 import sys
-__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0])
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
-import os, MySQLdb, shutil, re, csv, subprocess
-from gkutils.commonutils import Struct, cleanOptions, readGenericDataFile
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MultipleLocator
+import os, shutil, re, csv, subprocess
+from gkutils.commonutils import Struct, cleanOptions
+from dataReader import readColumnChunks, readDataFile
+from outputCache import OutputCache, outputFiles
+from profiling import profiled, stage
 import numpy as n
 
 SMALL_SIZE = 14
 MEDIUM_SIZE = 18
 BIGGER_SIZE = 25
 TINY_SIZE = 6
-plt.rc('font', size=SMALL_SIZE)                   # controls default text sizes
-plt.rc('axes', titlesize=BIGGER_SIZE)            # fontsize of the axes title
-plt.rc('axes', labelsize=BIGGER_SIZE)           # fontsize of the x and y labels
-plt.rc('xtick', labelsize=SMALL_SIZE)            # fontsize of the tick labels
-plt.rc('ytick', labelsize=SMALL_SIZE)            # fontsize of the tick labels
-plt.rc('legend', fontsize=SMALL_SIZE - 1)               # legend fontsize
-plt.rc('figure', titlesize=BIGGER_SIZE)   # fontsize of the figure title
-plt.rcParams["font.family"] = "serif"
-plt.rcParams['mathtext.fontset'] = 'dejavuserif'
 
-
-def plotBarChart(options, data):
-    # Build a dictionary of detector index → count
-    dataBars = {int(row[options.x]): int(row[options.y]) for row in data}
-
-    max_det = max(dataBars.keys())
-    detectors = list(range(max_det + 3))
-    counts = [dataBars.get(i, 0) for i in detectors]
+def setStyle():
+    """Set this script's matplotlib rc style."""
+    import matplotlib
+    matplotlib.rc('font', size=SMALL_SIZE)                   # controls default text sizes
+    matplotlib.rc('axes', titlesize=BIGGER_SIZE)            # fontsize of the axes title
+    matplotlib.rc('axes', labelsize=BIGGER_SIZE)           # fontsize of the x and y labels
+    matplotlib.rc('xtick', labelsize=SMALL_SIZE)            # fontsize of the tick labels
+    matplotlib.rc('ytick', labelsize=SMALL_SIZE)            # fontsize of the tick labels
+    matplotlib.rc('legend', fontsize=SMALL_SIZE - 1)               # legend fontsize
+    matplotlib.rc('figure', titlesize=BIGGER_SIZE)   # fontsize of the figure title
+    matplotlib.rcParams["font.family"] = "serif"
+    matplotlib.rcParams['mathtext.fontset'] = 'dejavuserif'
+
+# Draw more bars than this as a single filled step outline
+STEP_THRESHOLD = 2000
+# Maximum number of x tick labels
+MAX_TICKS = 20
+
+
+def categoryColumn(values, column, firstRow = 1):
+    """The values of the x column as integers >= 0.
+
+    Args:
+        values: array of the column's values, as read.
+        column: name of the column, for the error message.
+        firstRow: row number of the first value (counting from 1 after the header).
+
+    Raises:
+        ValueError: naming the first row whose value is blank, negative or not an integer.
+    """
+    def isCategory(value):
+        try:
+            return int(value) >= 0
+        except ValueError:
+            return False
+
+    try:
+        with n.errstate(invalid = 'ignore'):
+            categories = values.astype(n.int64)
+        bad = categories < 0
+        if values.dtype.kind == 'f':
+            # NaN, or a fraction
+            bad |= categories != values
+    except ValueError:
+        bad = ~n.fromiter((isCategory(v) for v in values), dtype = bool, count = len(values))
+    if bad.any():
+        i = int(n.argmax(bad))
+        raise ValueError("Row %d: %s should be an integer >= 0, not '%s'" % (firstRow + i, column, values[i]))
+    return categories
+
+
+def aggregateBars(filename, x, y = None, method = 'count', delimiter = ',', chunkSize = 1000000):
+    """Count rows (or sum the y column) per integer x value, reading the file in chunks.
+
+    Args:
+        filename:
+        x: column holding the category, e.g. detector. Values must be integers >= 0.
+        y: column to sum (method sum only).
+        method: count or sum.
+        delimiter:
+        chunkSize: number of rows to hold in memory at once.
+
+    Returns:
+        Array of totals indexed by x value.
+
+    Raises:
+        ValueError: for an unknown method, or an x value that isn't an integer >= 0.
+    """
+    if method not in ('count', 'sum'):
+        raise ValueError("Aggregate method must be count or sum, not %s" % method)
+
+    columns = [x] if method == 'count' else [x, y]
+    totals = n.zeros(0, dtype = int if method == 'count' else float)
+    rows = 0
+
+    # The read stage's self time is the time spent reading the chunks
+    with stage('read'):
+        for chunk in readColumnChunks(filename, columns = columns, delimiter = delimiter, chunkSize = chunkSize):
+            with stage('aggregate'):
+                categories = categoryColumn(chunk[x], x, firstRow = rows + 1)
+                rows += len(categories)
+                weights = chunk[y].astype(float) if method == 'sum' else None
+                binned = n.bincount(categories, weights = weights)
+                if len(binned) > len(totals):
+                    totals = n.concatenate([totals, n.zeros(len(binned) - len(totals), dtype = totals.dtype)])
+                totals[:len(binned)] += binned.astype(totals.dtype)
+
+    return totals
+
+
+def plotBars(options, categories, values):
+    """Draw the bar chart.
+
+    Up to STEP_THRESHOLD bars are drawn as individual rectangles. Beyond that (or with
+    --steps) they are drawn as one filled step outline, which is far quicker to draw and
+    gives a much smaller vector file, but looks the same at any sensible resolution.
+
+    Args:
+        options:
+        categories: integer x values (e.g. detector index).
+        values: bar heights.
+    """
+    from figures import newSubplots, finishFigure
+    from matplotlib.ticker import MaxNLocator
+
+    categories = n.asarray(categories, dtype = int)
+    max_det = int(categories.max()) if len(categories) else 0
+    detectors = n.arange(max_det + 3)
+    counts = n.zeros(len(detectors), dtype = n.asarray(values).dtype)
+    counts[categories] = values
+
+    xlower = float(options.xlower) if getattr(options, 'xlower', None) is not None else -1
+    xupper = float(options.xupper) if getattr(options, 'xupper', None) is not None else max_det + 3
+
+    # Only draw the bars that are (at least partly) visible
+    visible = slice(max(int(n.floor(xlower + 0.5)), 0), max(int(n.ceil(xupper + 0.5)), 0))
+    detectors = detectors[visible]
+    counts = counts[visible]
 
     # Set the figure size for 16:9 aspect ratio
-    fig, ax1 = plt.subplots(figsize=(23, 9))
+    fig, ax1 = newSubplots(figsize=(23, 9))
 
-    ax1.bar(detectors, counts, color="SkyBlue", edgecolor='black', linewidth=0.0, align="center")
+    if len(detectors) > STEP_THRESHOLD or getattr(options, 'steps', False):
+        if len(detectors):
+            ax1.stairs(counts, n.append(detectors, detectors[-1] + 1) - 0.5, fill=True, color="SkyBlue", linewidth=0.0)
+    else:
+        ax1.bar(detectors, counts, color="SkyBlue", edgecolor='black', linewidth=0.0, align="center")
 
-    # Label every 10th detector
+    # Label every 10th detector, unless that would be too many labels to read
     tick_step = 10
-    ax1.set_xticks(n.arange(0, max_det + 3, tick_step))
-    ax1.set_xlim(-1, max_det + 3)
+    if (xupper - xlower) / tick_step > MAX_TICKS:
+        ax1.xaxis.set_major_locator(MaxNLocator(nbins=MAX_TICKS, integer=True))
+    else:
+        ax1.set_xticks(n.arange(max(0, int(n.ceil(xlower / tick_step)) * tick_step), xupper, tick_step))
+    ax1.set_xlim(xlower, xupper)
+
+    if getattr(options, 'ylower', None) is not None:
+        ax1.set_ylim(bottom=float(options.ylower))
+    if getattr(options, 'yupper', None) is not None:
+        ax1.set_ylim(top=float(options.yupper))
 
     ax1.set_ylabel(options.ylabel)
     ax1.set_xlabel(options.xlabel)
     if hasattr(options, "title") and options.title is not None:
         ax1.set_title(options.title)
 
-    plt.tight_layout()
+    with stage('layout'):
+        fig.tight_layout()
 
-    if options.outputFile is not None:
-        plt.savefig(options.outputFile, dpi=75)
-    else:
-        plt.show()
+    return finishFigure(fig, options.outputFile, dpi=75)
+
+
+def plotBarChart(options, data):
+    # Detector index and count columns. Later rows for the same detector replace earlier ones.
+    with stage('parse'):
+        try:
+            categories = categoryColumn(n.array([row[options.x] for row in data]), options.x)
+        except ValueError as e:
+            sys.exit(str(e))
+        values = n.fromiter((int(row[options.y]) for row in data), dtype = int, count = len(data))
+
+    with stage('draw'):
+        plotBars(options, categories, values)
 
 
 def doPlots(options):
+    if options.aggregate:
+        try:
+            totals = aggregateBars(options.filename, options.x, y = options.y, method = options.aggregate, delimiter = options.delimiter, chunkSize = int(options.chunksize))
+        except ValueError as e:
+            sys.exit(str(e))
+        with stage('draw'):
+            plotBars(options, n.arange(len(totals)), totals)
+        return
+
     data = []
-    dataRows = readGenericDataFile(options.filename, delimiter=options.delimiter)
-    for row in dataRows:
-        data.append(row)
+    with stage('read'):
+        dataRows = readDataFile(options.filename, delimiter=options.delimiter, columns=[options.x, options.y])
+        for row in dataRows:
+            data.append(row)
 
     plotBarChart(options, data)
 
@@ -90,7 +234,16 @@ def main():
     opts = cleanOptions(opts)
     options = Struct(**opts)
 
-    doPlots(options)
+    cache, upToDate = OutputCache.skip(options, options.filename, outputFiles(options.outputFile))
+    if upToDate:
+        return
+
+    setStyle()
+
+    with profiled(options.profile, options.cprofile):
+        doPlots(options)
+    if cache:
+        cache.record()
 
 
 if __name__=='__main__':
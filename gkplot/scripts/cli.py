@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Run one of the gkplot scripts.
+
+Usage:
+  %s <command> [<args>...]
+  %s (-h | --help)
+  %s --version
+
+Commands:
+%s
+
+Options:
+  -h --help                         Show this screen.
+  --version                         Show version.
+
+Use "%s <command> --help" for the options of each command.
+
+E.g.:
+  %s bar ~/lasair/lsst/run_20251009/diasources.csv --aggregate=count --x=detector --outputFile=/tmp/detectors.png
+"""
+import sys
+import os
+import importlib
+
+# command -> (script module, description). The modules are only imported when their
+# command is run, so that e.g. "gkplot heatmap-batch --rawpng" never loads pyplot
+# and "gkplot --help" loads nothing at all. The scripts themselves only import
+# matplotlib, and set their styles, once their options have been parsed, so that
+# "gkplot <command> --help" and usage errors don't load it either.
+COMMANDS = {
+    'bar':              ('barplot', 'Bar chart, from pre-counted or raw rows.'),
+    'histogram':        ('histogramplot', 'Histograms, optionally grouped by a column.'),
+    'scatter':          ('scatterplot', 'Scatter plots.'),
+    'sky':              ('skyplot', 'Sky positions on an Aitoff map.'),
+    'heatmap':          ('plotATLASHeatMap', 'ATLAS detector heatmap.'),
+    'heatmap-batch':    ('plotATLASHeatMapBatch', 'ATLAS detector heatmaps for a directory of nightly files.'),
+    'lsst-cuts':        ('plotLSSTDetectorCuts', 'LSST focal plane heatmaps for several cuts.'),
+    'batch':            ('plotBatch', 'Scatter, sky and histogram plots from a JSON or YAML manifest, using a pool of processes.'),
+    'server':           ('plotServer', 'Resident plot server for scatter, sky and histogram plots (use gkplot-client).'),
+}
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The scripts import each other by module name, so they (and this module) need their
+# directory on the path, however gkplot was started.
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from version import getVersion
+import outputCache
+
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0],
+                     '\n'.join('  %-18s%s' % (name, description) for name, (module, description) in COMMANDS.items()),
+                     sys.argv[0], sys.argv[0])
+
+
+def runCommand(command, args):
+    """Import the command's script and run its main() with args as its command line."""
+    module, description = COMMANDS[command]
+
+    # The scripts fill in their usage text from sys.argv[0] when they are imported, so
+    # set that up first. The usage becomes "gkplot <command> <filename>...", and docopt
+    # then matches the command as an extra argument, so it stays on the command line
+    # too. It also ends up in the options (e.g. 'bar': True), so leave it out of those
+    # that --skipunchanged compares: "gkplot bar ..." then makes the same record as
+    # "barplot.py ..." or the plot server.
+    sys.argv = [os.path.basename(sys.argv[0]) + ' ' + command, command] + list(args)
+    outputCache.IGNORED_OPTIONS += (command,)
+
+    return importlib.import_module(module).main()
+
+
+def main(argv = None):
+    # Parse by hand rather than with docopt, so that everything after the command is
+    # passed through untouched to the command's own option parser.
+    argv = sys.argv[1:] if argv is None else argv
+
+    if not argv or argv[0] in ('-h', '--help'):
+        print (__doc__.strip())
+        return
+    if argv[0] == '--version':
+        print (getVersion())
+        return
+
+    command, args = argv[0], argv[1:]
+    if command not in COMMANDS:
+        sys.exit("Unknown command %s. Use one of: %s" % (command, ', '.join(COMMANDS)))
+
+    return runCommand(command, args)
+
+
+if __name__=='__main__':
+    main()
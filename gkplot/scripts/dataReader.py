@@ -0,0 +1,353 @@
+"""Column oriented, chunked reading of delimited data files.
+
+readGenericDataFile returns every row as a dict, which is fine for small files
+but far too slow and memory hungry for tens of millions of detections. The
+functions here read only the requested columns and hand them back as NumPy
+arrays, a chunk of rows at a time, so that callers can aggregate with
+vectorized operations and keep peak memory bounded.
+
+The header conventions are the same as readGenericDataFile: the first line is
+the header (an initial # is ignored), and a space delimiter means split on any
+whitespace.
+
+FITS binary tables (.fits, .fit, .fts), Parquet (.parquet, .pq) and Arrow or
+Feather (.arrow, .feather) files are read too, recognised by their extension.
+Only the requested columns are read from them, memory mapped where the format
+allows, and numeric columns come back as numeric arrays rather than strings.
+FITS needs astropy, and Parquet and Arrow need pyarrow.
+
+Text files compressed with gzip (.gz), bzip2 (.bz2), xz (.xz) or Zstandard
+(.zst, which needs zstandard) are decompressed as they are read, so that they
+take no more memory or disk than uncompressed ones. A file name of - reads
+standard input, which can only be read once.
+"""
+import os
+import io
+import sys
+import csv
+import bz2
+import gzip
+import lzma
+import zlib
+import numpy as n
+from gkutils.commonutils import readGenericDataFile
+
+DEFAULT_CHUNK_SIZE = 1000000
+
+STDIN = '-'
+
+# Decompressed bytes to look at when estimating the rows of a compressed file
+COMPRESSED_SAMPLE_BYTES = 1 << 20
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading .zst files needs zstandard (pip install zstandard)")
+    return zstandard
+
+
+def _openZstd(filename, mode, **kwargs):
+    return _zstandard().open(filename, mode, **kwargs)
+
+
+# Opener, and incremental decompressor, for each compressed file extension
+COMPRESSIONS = {
+    '.gz': (gzip.open, lambda: zlib.decompressobj(wbits = zlib.MAX_WBITS | 16)),
+    '.bz2': (bz2.open, bz2.BZ2Decompressor),
+    '.xz': (lzma.open, lzma.LZMADecompressor),
+    '.zst': (_openZstd, lambda: _zstandard().ZstdDecompressor().decompressobj()),
+}
+
+TABLE_FORMATS = {
+    '.fits': 'fits',
+    '.fit': 'fits',
+    '.fts': 'fits',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+}
+
+
+def readHeader(f, delimiter):
+    """Read the header line from an open file and return the stripped field names.
+
+    Args:
+        f: open file object, positioned at the header line.
+        delimiter: column delimiter.
+    """
+    header = f.readline().strip()
+    if header and header[0] == '#':
+        header = header[1:]
+    if delimiter == ' ':
+        fieldnames = header.strip().split()
+    else:
+        fieldnames = header.strip().split(delimiter)
+    return [x.strip() for x in fieldnames]
+
+
+def compressionType(filename):
+    """The extension (.gz, .bz2, .xz or .zst) of a compressed file, otherwise None."""
+    extension = os.path.splitext(filename)[1].lower()
+    return extension if extension in COMPRESSIONS else None
+
+
+def openDataFile(filename):
+    """Open a text file for reading, decompressing it as it is read if it is compressed.
+
+    Args:
+        filename: file to open, or - for standard input.
+    """
+    if filename == STDIN:
+        # Leave stdin open when this is closed
+        return open(sys.stdin.fileno(), newline = '', closefd = False)
+    compression = compressionType(filename)
+    if compression:
+        return COMPRESSIONS[compression][0](filename, 'rt', newline = '')
+    return open(filename, newline = '')
+
+
+def tableFormat(filename):
+    """'fits', 'parquet' or 'arrow' if filename is a binary table, from its extension, otherwise None.
+
+    A compressed FITS file (e.g. .fits.gz) is a table too.
+    """
+    base, extension = os.path.splitext(filename.lower())
+    if extension in COMPRESSIONS:
+        extension = os.path.splitext(base)[1]
+    return TABLE_FORMATS.get(extension)
+
+
+def _fitsTable(filename):
+    """The first table HDU of a FITS file, opened memory mapped, and the open HDU list."""
+    try:
+        from astropy.io import fits
+    except ImportError:
+        raise ImportError("Reading FITS tables needs astropy (pip install astropy)")
+    # Compressed files are decompressed into memory by astropy, so can't be memory mapped
+    hdus = fits.open(filename, memmap = not compressionType(filename))
+    for hdu in hdus:
+        if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU)):
+            return hdu, hdus
+    hdus.close()
+    raise ValueError("No table found in %s" % filename)
+
+
+def _arrowTable(filename, tableType):
+    """A pyarrow reader for a Parquet file, or a memory mapped table for an Arrow/Feather file."""
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Reading %s files needs pyarrow (pip install pyarrow)" % tableType.capitalize())
+    if compressionType(filename):
+        raise ValueError("Can't read %s: %s files compress their own columns, so must not be compressed as a whole" % (filename, tableType.capitalize()))
+    if tableType == 'parquet':
+        return pyarrow.parquet.ParquetFile(filename, memory_map = True)
+    return pyarrow.feather.read_table(filename, memory_map = True)
+
+
+def _tableColumns(filename, tableType):
+    """(column names, number of rows) of a binary table, from its metadata."""
+    if tableType == 'fits':
+        hdu, hdus = _fitsTable(filename)
+        with hdus:
+            return list(hdu.columns.names), hdu.header['NAXIS2']
+    table = _arrowTable(filename, tableType)
+    if tableType == 'parquet':
+        return list(table.schema_arrow.names), table.metadata.num_rows
+    return list(table.column_names), table.num_rows
+
+
+def _plainArray(values):
+    """A column as an ordinary native NumPy array: text as str, numbers in native byte order."""
+    values = n.asarray(values)
+    if values.dtype.kind in 'SOU':
+        return values.astype(str)
+    return values.astype(values.dtype.newbyteorder('='))
+
+
+def _tableChunks(filename, tableType, columns, chunkSize):
+    """readColumnChunks for binary tables, reading only the requested columns."""
+    names, rows = _tableColumns(filename, tableType)
+    if columns is None:
+        columns = names
+
+    missing = [c for c in columns if c not in names]
+    if missing:
+        raise KeyError("Column(s) %s not found in %s" % (', '.join(missing), filename))
+
+    if tableType == 'fits':
+        # The table is memory mapped, so only the rows of each chunk are read, and copied
+        hdu, hdus = _fitsTable(filename)
+        with hdus:
+            data = hdu.data
+            for start in range(0, rows, chunkSize):
+                yield {c: _plainArray(data.field(c)[start:start + chunkSize]) for c in columns}
+            del data
+    elif tableType == 'parquet':
+        for batch in _arrowTable(filename, tableType).iter_batches(batch_size = chunkSize, columns = list(columns)):
+            yield {c: _plainArray(batch.column(c).to_numpy(zero_copy_only = False)) for c in columns}
+    else:
+        table = _arrowTable(filename, tableType).select(list(columns))
+        for start in range(0, rows, chunkSize):
+            chunk = table.slice(start, chunkSize)
+            yield {c: _plainArray(chunk.column(c).to_numpy()) for c in columns}
+
+
+def columnNames(filename, delimiter = ' ', fieldnames = None):
+    """The column names of a file: its header, or fieldnames if given, or a binary table's columns.
+
+    This reads the header of stdin, so stdin can't be read again afterwards.
+    """
+    tableType = tableFormat(filename)
+    if tableType:
+        return _tableColumns(filename, tableType)[0]
+    if fieldnames:
+        return [x.strip() for x in fieldnames]
+    with openDataFile(filename) as f:
+        return readHeader(f, delimiter)
+
+
+def estimateRows(filename, sampleLines = 1000):
+    """Roughly how many rows a file has, from its size and the length of its first lines.
+
+    The number of rows of a binary table is exact, from its metadata. The size of
+    a compressed file is scaled by how much the start of it decompresses to. The
+    size of stdin can't be known, so it has None rows.
+
+    Args:
+        filename: file to look at.
+        sampleLines: number of lines (after the header) to average over.
+    """
+    if filename == STDIN:
+        return None
+    tableType = tableFormat(filename)
+    if tableType:
+        return _tableColumns(filename, tableType)[1]
+    size = os.path.getsize(filename)
+    compression = compressionType(filename)
+    with open(filename, 'rb') as f:
+        lines = f
+        if compression:
+            decompressor = COMPRESSIONS[compression][1]()
+            compressed = 0
+            sample = []
+            sampleBytes = 0
+            while sampleBytes < COMPRESSED_SAMPLE_BYTES:
+                block = f.read(1 << 16)
+                if not block:
+                    break
+                compressed += len(block)
+                sample.append(decompressor.decompress(block))
+                sampleBytes += len(sample[-1])
+            if not sampleBytes:
+                return 0
+            size = size * sampleBytes / compressed
+            lines = io.BytesIO(b''.join(sample))
+        header = len(lines.readline())
+        lengths = [len(line) for line, i in zip(lines, range(sampleLines))]
+    if not lengths:
+        return 0
+    return int(round((size - header) / (sum(lengths) / len(lengths))))
+
+
+def readColumnChunks(filename, columns = None, delimiter = ' ', fieldnames = None, chunkSize = DEFAULT_CHUNK_SIZE):
+    """Generator yielding the requested columns, chunkSize rows at a time.
+
+    Args:
+        filename: file to read, or - for standard input.
+        columns: list of column names to return. If None, return all of them.
+        delimiter: column delimiter.
+        fieldnames: column names if the file has no header line.
+        chunkSize: maximum number of rows per chunk.
+
+    Yields:
+        dict of column name -> NumPy string array. Convert with e.g. .astype(float).
+        Numeric columns of binary tables are numeric arrays.
+    """
+    tableType = tableFormat(filename)
+    if tableType:
+        yield from _tableChunks(filename, tableType, columns, chunkSize)
+        return
+
+    with openDataFile(filename) as f:
+        if not fieldnames:
+            fieldnames = readHeader(f, delimiter)
+        else:
+            fieldnames = [x.strip() for x in fieldnames]
+
+        if columns is None:
+            columns = fieldnames
+
+        missing = [c for c in columns if c not in fieldnames]
+        if missing:
+            raise KeyError("Column(s) %s not found in %s" % (', '.join(missing), filename))
+
+        indices = [fieldnames.index(c) for c in columns]
+        ncols = max(indices) + 1
+
+        reader = csv.reader(f, delimiter=delimiter, skipinitialspace = True)
+        buffers = [[] for c in columns]
+        nrows = 0
+        for row in reader:
+            if not row:
+                continue
+            if len(row) < ncols:
+                row = row + [''] * (ncols - len(row))
+            for buf, i in zip(buffers, indices):
+                buf.append(row[i])
+            nrows += 1
+            if nrows == chunkSize:
+                yield {c: n.array(buf) for c, buf in zip(columns, buffers)}
+                buffers = [[] for c in columns]
+                nrows = 0
+
+        if nrows:
+            yield {c: n.array(buf) for c, buf in zip(columns, buffers)}
+
+
+def readColumns(filename, columns = None, delimiter = ' ', fieldnames = None):
+    """Read the requested columns of the whole file into NumPy string arrays.
+
+    Args:
+        filename: file to read.
+        columns: list of column names to return. If None, return all of them.
+        delimiter: column delimiter.
+        fieldnames: column names if the file has no header line.
+    """
+    data = None
+    for chunk in readColumnChunks(filename, columns = columns, delimiter = delimiter, fieldnames = fieldnames):
+        if data is None:
+            data = {c: [v] for c, v in chunk.items()}
+        else:
+            for c, v in chunk.items():
+                data[c].append(v)
+
+    if data is None:
+        return {c: n.array([], dtype=str) for c in (columns or [])}
+
+    return {c: n.concatenate(v) for c, v in data.items()}
+
+
+def readDataFile(filename, delimiter = ' ', fieldnames = None, columns = None):
+    """Drop in replacement for readGenericDataFile that also reads binary tables.
+
+    Delimited text is read with readGenericDataFile, decompressing it as it is
+    read if it is compressed. From a binary table only the requested columns are
+    read, and each row is a dict of those columns.
+
+    Args:
+        filename: file to read, or - for standard input.
+        delimiter: column delimiter of a text file.
+        fieldnames: column names if a text file has no header line.
+        columns: the columns needed. If None, all of them.
+    """
+    if not tableFormat(filename):
+        return readGenericDataFile(openDataFile(filename), delimiter = delimiter, fieldnames = fieldnames)
+
+    data = readColumns(filename, columns = list(columns) if columns else None)
+    names = list(data)
+    return [dict(zip(names, values)) for values in zip(*[data[c].tolist() for c in names])]
@@ -0,0 +1,319 @@
+"""Figures that don't use pyplot.
+
+pyplot keeps every figure in a global registry, which leaks figures in long running
+processes and is not safe to use from more than one thread. The plot functions make
+their figures here instead: a Figure on its own Agg canvas, which belongs only to the
+caller and goes away with it. Only showing a plot interactively goes through pyplot.
+
+    fig = newFigure(figsize=(8, 4))
+    ax = fig.add_subplot(111)
+    ...
+    finishFigure(fig, '/tmp/plot.png', dpi=600)
+
+A plot can also be written to several files at once (e.g. --outputs in the scripts),
+each at its own dpi: the figure is drawn once at the highest raster dpi, the raster
+files and thumbnails are cut from that one image, and they are compressed and
+written on background threads. Vector files (pdf, svg, eps) still need their own
+pass through savefig. Call waitForOutputs() before relying on the files.
+
+    finishFigure(fig, outputs='/tmp/plot.png,/tmp/plot.pdf,/tmp/thumb.png@50', dpi=600)
+    waitForOutputs()
+
+Plots of hundreds of thousands of points or patches make enormous vector files. With
+a raster threshold, the data layers of any axes with more points than that are drawn
+as one embedded image at the raster dpi, while the axes, text and anything marked
+with keepVector() stay vector.
+"""
+import os
+import time
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as n
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import Collection
+from matplotlib.lines import Line2D
+from matplotlib.patches import Patch
+from profiling import stage, formatSize
+
+# Formats that are cut from the Agg image. Anything else goes through savefig.
+RASTER_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'tif': 'TIFF', 'tiff': 'TIFF', 'webp': 'WEBP', 'bmp': 'BMP', 'gif': 'GIF'}
+# ...and those of them that can't store transparency
+OPAQUE_FORMATS = ('JPEG', 'BMP')
+
+VECTOR_FORMATS = ('pdf', 'svg', 'svgz', 'eps', 'ps')
+
+OUTPUT_THREADS = 4
+
+_keepVector = weakref.WeakSet()
+
+_outputWriter = None
+_pendingOutputs = {}
+_pendingLock = threading.Lock()
+
+
+def newFigure(figsize = None, **kwargs):
+    """A new Figure on an Agg canvas. kwargs are as for matplotlib.figure.Figure."""
+    fig = Figure(figsize = figsize, **kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def newSubplots(nrows = 1, ncols = 1, figsize = None, **kwargs):
+    """As pyplot.subplots, but without pyplot. Returns (fig, axes)."""
+    fig = newFigure(figsize = figsize)
+    return fig, fig.subplots(nrows, ncols, **kwargs)
+
+
+def pyplotFigure(fig):
+    """Give the figure a pyplot figure manager (and so a GUI canvas), for interactive use.
+
+    Returns:
+        the pyplot module
+    """
+    import matplotlib.pyplot as plt
+    manager = plt.figure().canvas.manager
+    manager.canvas.figure = fig
+    fig.set_canvas(manager.canvas)
+    return plt
+
+
+def showFigure(*figs):
+    """Show the figures in pyplot windows (e.g. when there's no output file)."""
+    if not figs:
+        return
+    for fig in figs:
+        plt = pyplotFigure(fig)
+    plt.show()
+    plt.close('all')
+
+
+def keepVector(*artists):
+    """Never rasterize these artists (e.g. reference curves drawn with many points)."""
+    for artist in artists:
+        _keepVector.add(artist)
+    return artists
+
+
+def artistPoints(artist):
+    """The number of points (or shapes) an artist draws."""
+    if isinstance(artist, Collection):
+        return max(len(artist.get_offsets()), len(artist.get_paths()))
+    if isinstance(artist, Line2D):
+        return len(artist.get_xdata())
+    return 1
+
+
+def rasterizeHeavyArtists(fig, threshold):
+    """Rasterize the data layers of every axes that draws more than threshold points and patches.
+
+    Only the collections, lines and patches of more than two points are rasterized -
+    not straight reference lines, text, the axes or anything marked with keepVector().
+    Consecutive rasterized artists are merged into one image in vector files. It makes
+    no difference to raster files.
+
+    Returns:
+        (number of artists, number of points) rasterized
+    """
+    artists = points = 0
+    for ax in fig.axes:
+        layers = [a for a in ax.collections + ax.lines + ax.patches if a not in _keepVector]
+        counts = [artistPoints(a) for a in layers]
+        if sum(counts) <= threshold:
+            continue
+        for artist, count in zip(layers, counts):
+            if count > 2 or isinstance(artist, Patch):
+                artist.set_rasterized(True)
+                artists += 1
+                points += count
+    return artists, points
+
+
+def rasterOptions(options):
+    """finishFigure's rasterThreshold and rasterDpi from a script's --rasterthreshold and --rasterdpi options."""
+    if getattr(options, 'rasterthreshold', None) is None:
+        return {}
+    return {'rasterThreshold': int(options.rasterthreshold), 'rasterDpi': float(options.rasterdpi)}
+
+
+def parseOutputs(outputs, dpi = 600):
+    """Parse a list of output files, e.g. "lc.png,lc.pdf,lc_thumb.png@50".
+
+    Args:
+        outputs: comma separated file names, each optionally followed by @<dpi>.
+        dpi: the dpi of the files that don't have one.
+
+    Returns:
+        list of (filename, format, dpi)
+    """
+    targets = []
+    for output in outputs.split(','):
+        output = output.strip()
+        if not output:
+            continue
+        filename, _, outputDpi = output.partition('@')
+        fmt = os.path.splitext(filename)[1][1:].lower()
+        if not fmt:
+            raise ValueError("Cannot tell the format of output file %s" % filename)
+        targets.append((filename, fmt, float(outputDpi) if outputDpi else float(dpi)))
+    return targets
+
+
+def outputWriter():
+    """The thread pool that compresses and writes the raster output files."""
+    global _outputWriter
+    if _outputWriter is None:
+        _outputWriter = ThreadPoolExecutor(max_workers = OUTPUT_THREADS, thread_name_prefix = 'gkplot-output')
+    return _outputWriter
+
+
+def _saveRaster(image, dpi, targets, background):
+    """Background job: scale the image to each target's dpi and write it."""
+    from PIL import Image
+
+    height, width = image.shape[:2]
+    full = Image.fromarray(image, 'RGBA')
+    for filename, fmt, targetDpi in targets:
+        out = full
+        if targetDpi != dpi:
+            out = full.resize((max(1, round(width * targetDpi / dpi)), max(1, round(height * targetDpi / dpi))), Image.LANCZOS)
+        pilFormat = RASTER_FORMATS[fmt]
+        if pilFormat in OPAQUE_FORMATS:
+            flat = Image.new('RGB', out.size, background[:3])
+            flat.paste(out, mask = out.getchannel('A'))
+            out = flat
+        out.save(filename, format = pilFormat, dpi = (targetDpi, targetDpi))
+
+
+def renderImage(fig, dpi, bbox_inches = None, pad_inches = 0.1):
+    """Draw the figure once at dpi and return it as an RGBA array (a copy, so the figure can be reused).
+
+    bbox_inches can be None (the whole figure) or 'tight', as for savefig.
+    """
+    originalDpi = fig.dpi
+    try:
+        fig.dpi = dpi
+        canvas = fig.canvas
+        canvas.draw()
+        image = n.asarray(canvas.buffer_rgba())
+        if bbox_inches != 'tight':
+            return image.copy()
+
+        # Cut the tight bounding box (in inches) out of the image, padding it with the
+        # figure background where it spills over the edge
+        bbox = fig.get_tightbbox(canvas.get_renderer()).padded(pad_inches)
+        height, width = image.shape[:2]
+        x0, x1 = int(round(bbox.x0 * dpi)), int(round(bbox.x1 * dpi))
+        y0, y1 = height - int(round(bbox.y1 * dpi)), height - int(round(bbox.y0 * dpi))
+        out = n.empty((y1 - y0, x1 - x0, 4), dtype = n.uint8)
+        out[:] = (n.array(fig.get_facecolor()) * 255).round().astype(n.uint8)
+        sx0, sy0, sx1, sy1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+        if sx1 > sx0 and sy1 > sy0:
+            out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = image[sy0:sy1, sx0:sx1]
+        return out
+    finally:
+        fig.dpi = originalDpi
+
+
+def _waitForPath(filename):
+    # Don't let two background jobs write the same file at once
+    with _pendingLock:
+        future = _pendingOutputs.get(os.path.abspath(filename))
+    if future is not None:
+        future.result()
+
+
+def saveOutputs(fig, targets, bbox_inches = None, pad_inches = 0.1, background = True, vectorDpi = None):
+    """Save the figure to several files, drawing it only once for all the raster ones.
+
+    Args:
+        fig:
+        targets: list of (filename, format, dpi), as from parseOutputs.
+        bbox_inches: None or 'tight', as for savefig.
+        pad_inches: padding around a tight bounding box.
+        background: write the raster files on background threads (see waitForOutputs).
+        vectorDpi: if set, the dpi of the vector files (i.e. of any rasterized layers in them).
+
+    Returns:
+        the Future of the background job, or None.
+    """
+    raster = [t for t in targets if t[1] in RASTER_FORMATS]
+    vector = [t for t in targets if t[1] not in RASTER_FORMATS]
+
+    future = None
+    if raster:
+        dpi = max(t[2] for t in raster)
+        image = renderImage(fig, dpi, bbox_inches = bbox_inches, pad_inches = pad_inches)
+        facecolor = tuple(int(round(c * 255)) for c in fig.get_facecolor())
+        for filename, fmt, targetDpi in raster:
+            _waitForPath(filename)
+        if background:
+            future = outputWriter().submit(_saveRaster, image, dpi, raster, facecolor)
+            with _pendingLock:
+                for filename, fmt, targetDpi in raster:
+                    _pendingOutputs[os.path.abspath(filename)] = future
+        else:
+            _saveRaster(image, dpi, raster, facecolor)
+
+    # The vector formats are drawn from the figure itself, so write them now,
+    # while the raster files are being compressed
+    for filename, fmt, targetDpi in vector:
+        fig.savefig(filename, format = fmt, dpi = vectorDpi or targetDpi, bbox_inches = bbox_inches, pad_inches = pad_inches)
+
+    return future
+
+
+def waitForOutputs():
+    """Wait for all the background writes to finish. Raises the first error any of them had."""
+    with _pendingLock:
+        futures = set(_pendingOutputs.values())
+        _pendingOutputs.clear()
+    for future in futures:
+        future.result()
+
+
+def finishFigure(fig, outputFile = None, outputs = None, rasterThreshold = None, rasterDpi = None, **kwargs):
+    """Save the figure to outputFile, or show it if there isn't one. kwargs are as for Figure.savefig.
+
+    If outputs (as for parseOutputs) are given, save the figure to those, and to
+    outputFile if that is set too, at the dpi in kwargs unless they have their own.
+
+    If rasterThreshold is set, rasterize heavy data layers (see rasterizeHeavyArtists)
+    at rasterDpi in vector files, and report the size of each file and the time taken.
+
+    Returns:
+        fig
+    """
+    if outputFile is None and not outputs:
+        showFigure(fig)
+        return fig
+
+    import matplotlib
+    dpi = kwargs.get('dpi', matplotlib.rcParams['savefig.dpi'])
+    if dpi == 'figure':
+        dpi = fig.dpi
+    targets = parseOutputs(outputs, dpi = dpi) if outputs else []
+    if outputFile is not None:
+        targets.insert(0, (outputFile, os.path.splitext(outputFile)[1][1:].lower(), float(dpi)))
+
+    with stage('save', figure = fig):
+        if rasterThreshold is not None:
+            rasterized, points = rasterizeHeavyArtists(fig, rasterThreshold)
+            print ("Rasterizing %d artists (%d points) in vector files at %s dpi" % (rasterized, points, rasterDpi or dpi))
+
+        start = time.perf_counter()
+        if outputs:
+            saveOutputs(fig, targets, bbox_inches = kwargs.get('bbox_inches'), pad_inches = kwargs.get('pad_inches', 0.1), vectorDpi = rasterDpi)
+        else:
+            if rasterDpi is not None and targets[0][1] in VECTOR_FORMATS:
+                kwargs = dict(kwargs, dpi = rasterDpi)
+            fig.savefig(outputFile, **kwargs)
+
+        if rasterThreshold is not None:
+            waitForOutputs()
+            elapsed = time.perf_counter() - start
+            for filename, fmt, targetDpi in targets:
+                print ("Wrote %s (%s)" % (filename, formatSize(os.path.getsize(filename))))
+            print ("Saved in %.2fs" % elapsed)
+    return fig
@@ -0,0 +1,215 @@
+"""Build and manipulate ATLAS detector heatmap matrices.
+
+These replace gkutils.commonutils.calculateHeatMap for large inputs. Rather than
+holding every detection as a row dict, the x, y and obs columns are streamed in
+chunks and binned with numpy.bincount, so peak memory depends only on the chunk
+size and the heatmap resolution, not on the number of detections.
+"""
+import numpy as n
+from dataReader import readColumnChunks, readColumns, DEFAULT_CHUNK_SIZE
+
+ATLAS_CHIP_SIZE = 10560
+HEATMAP_RESOLUTIONS = [8, 16, 32, 64, 128, 256, 512]
+
+
+def binDetections(x, y, resolution = 128, chipSize = ATLAS_CHIP_SIZE):
+    """Count detector x, y positions in a resolution x resolution matrix.
+
+    Uses the same pixel -> bin mapping as calculateHeatMap, i.e. int(x/(chipSize - 1) * resolution),
+    and ignores positions that fall outside the matrix.
+
+    Args:
+        x: array of x pixel positions.
+        y: array of y pixel positions.
+        resolution:
+        chipSize:
+    """
+    # astype(int) truncates towards zero, exactly as int() does
+    xbin = (n.asarray(x, dtype=float) / (chipSize - 1) * resolution).astype(n.int64)
+    ybin = (n.asarray(y, dtype=float) / (chipSize - 1) * resolution).astype(n.int64)
+
+    ok = (xbin >= 0) & (ybin >= 0) & (xbin < resolution) & (ybin < resolution)
+
+    return n.bincount(ybin[ok] * resolution + xbin[ok], minlength = resolution * resolution).reshape(resolution, resolution)
+
+
+def buildHeatMap(filename, resolution = 128, chipSize = ATLAS_CHIP_SIZE, delimiter = '\t', chunkSize = DEFAULT_CHUNK_SIZE, xcol = 'x', ycol = 'y', obscol = 'obs'):
+    """Stream a file of detections and build the heatmap matrix.
+
+    Args:
+        filename: file with (at least) headed x, y and obs columns.
+        resolution: power of 2 between 8 and 512.
+        chipSize:
+        delimiter:
+        chunkSize: number of rows to hold in memory at once.
+        xcol:
+        ycol:
+        obscol: exposure name column, used to count the contributing exposures.
+
+    Returns:
+        {'matrix': the matrix (row index is y), 'exps': set of contributing exposures}.
+
+    Raises:
+        ValueError: if the resolution is not one of HEATMAP_RESOLUTIONS.
+    """
+    if resolution not in HEATMAP_RESOLUTIONS:
+        raise ValueError("Heatmap resolution should be 8, 16, 32, 64, 128, 256 or 512, not %s" % resolution)
+
+    matrix = n.zeros((resolution, resolution), dtype=n.int64)
+    exps = set()
+
+    for chunk in readColumnChunks(filename, columns = [xcol, ycol, obscol], delimiter = delimiter, chunkSize = chunkSize):
+        matrix += binDetections(chunk[xcol], chunk[ycol], resolution = resolution, chipSize = chipSize)
+        exps.update(n.unique(chunk[obscol]).tolist())
+
+    return {'matrix': matrix, 'exps': exps}
+
+
+def buildHeatMapPyramid(matrix):
+    """Derive every coarser power of 2 resolution from a heatmap matrix by summing blocks.
+
+    Because the bins nest, summing f x f blocks of the full resolution matrix gives the
+    same counts as binning the detections again at 1/f of the resolution. (The only
+    exception is positions just below zero, which binDetections truncates into the first
+    bin: the pyramid only keeps those within one full resolution bin of the edge.)
+
+    Args:
+        matrix: square heatmap matrix, e.g. at 512 x 512.
+
+    Returns:
+        dict of resolution -> matrix, for every valid resolution up to the matrix's own.
+    """
+    fullResolution = matrix.shape[0]
+    pyramid = {}
+    for resolution in HEATMAP_RESOLUTIONS:
+        if resolution > fullResolution or fullResolution % resolution:
+            continue
+        f = fullResolution // resolution
+        pyramid[resolution] = matrix.reshape(resolution, f, resolution, f).sum(axis=(1, 3))
+    return pyramid
+
+
+def saveHeatMapPyramid(filename, pyramid, nobs = None):
+    """Write all the levels of a heatmap pyramid to one compressed .npz file.
+
+    Args:
+        filename:
+        pyramid: dict of resolution -> matrix, as from buildHeatMapPyramid.
+        nobs: number of contributing exposures, kept for the plot title.
+    """
+    levels = {'resolution_%d' % resolution: matrix for resolution, matrix in pyramid.items()}
+    if nobs is not None:
+        levels['nobs'] = n.array(nobs)
+    n.savez_compressed(filename, **levels)
+
+
+def loadHeatMapPyramid(filename, resolution):
+    """Read a single level from a heatmap pyramid file.
+
+    Args:
+        filename:
+        resolution:
+
+    Returns:
+        (matrix, nobs) - nobs is None if it was not stored. The matrix is None if the
+        pyramid has no level at that resolution.
+    """
+    with n.load(filename) as pyramid:
+        key = 'resolution_%d' % resolution
+        matrix = pyramid[key] if key in pyramid.files else None
+        nobs = int(pyramid['nobs']) if 'nobs' in pyramid.files else None
+    return matrix, nobs
+
+
+def readMatrixFile(filename, resolution = None, delimiter = '\t'):
+    """Read a precomputed heatmap matrix.
+
+    Three formats are understood:
+      .npy - the matrix itself (its shape is the resolution), memory-mapped rather than read.
+      .npz - a heatmap pyramid; the level at the requested resolution is returned.
+      anything else - a text table with an ndet column holding the matrix in row order.
+
+    Args:
+        filename:
+        resolution: level to read from a pyramid (ignored for the other formats).
+        delimiter: delimiter of the text format.
+
+    Returns:
+        (matrix, nobs) - nobs is None unless stored in a pyramid. The matrix is None if
+        a pyramid has no level at that resolution.
+    """
+    if filename.endswith('.npz'):
+        return loadHeatMapPyramid(filename, resolution)
+
+    if filename.endswith('.npy'):
+        return n.load(filename, mmap_mode = 'r'), None
+
+    ndet = readColumns(filename, columns = ['ndet'], delimiter = delimiter)['ndet'].astype(n.int64)
+    resolution = int(n.sqrt(len(ndet)))
+    if resolution not in HEATMAP_RESOLUTIONS:
+        print ("Invalid map resolution of %d" % (resolution))
+    return ndet.reshape(resolution, resolution), None
+
+
+def writeMatrixFile(filename, matrix, delimiter = '\t'):
+    """Write a heatmap matrix in the format implied by the filename (see readMatrixFile).
+
+    Args:
+        filename: .npy for the binary format, anything else for the ndet text table.
+        matrix:
+        delimiter: delimiter of the text format.
+    """
+    if filename.endswith('.npy'):
+        n.save(filename, n.ascontiguousarray(matrix))
+    else:
+        n.savetxt(filename, n.asarray(matrix).ravel(), fmt = '%d', header = 'ndet', comments = '', delimiter = delimiter)
+
+
+def heatMapStatistics(matrices, multiplier = 1.6):
+    """The median/MAD statistics plotATLASHeatMap prints, for a whole stack of matrices at once.
+
+    Args:
+        matrices: array of shape (nmaps, resolution, resolution).
+        multiplier: multiplier for the median giving the colour bar span and mask threshold.
+
+    Returns:
+        dict of arrays, one value per matrix: median, mad, stddev, colorBarSpan, maskPercentage.
+    """
+    matrices = n.asarray(matrices)
+    median = n.median(matrices, axis=(1, 2))
+    colorBarSpan = float(multiplier) * median
+
+    return {'median': median,
+            # Same as astropy.stats.median_absolute_deviation, without importing astropy
+            'mad': n.median(n.abs(matrices - median[:, None, None]), axis=(1, 2)),
+            'stddev': n.std(matrices, axis=(1, 2)),
+            'colorBarSpan': colorBarSpan,
+            'maskPercentage': n.mean(matrices > colorBarSpan[:, None, None], axis=(1, 2)) * 100.0}
+
+
+def runningStackDifferences(matrices):
+    """Running stacks of a sequence of (e.g. nightly) matrices and each one's difference from its history.
+
+    The difference map for matrix i is matrix i minus the stack of all the matrices
+    before it, scaled to the same total number of detections. Positive pixels are
+    where matrix i has more detections than its history predicts. The first matrix
+    has no history, so its difference map is all zeros.
+
+    Args:
+        matrices: array of shape (nmaps, resolution, resolution), in time order.
+
+    Returns:
+        (stacks, differences) - stacks[i] is the sum of matrices 0..i.
+    """
+    matrices = n.asarray(matrices)
+    stacks = n.cumsum(matrices, axis=0)
+    previous = stacks - matrices
+
+    totals = matrices.sum(axis=(1, 2)).astype(float)
+    previousTotals = previous.sum(axis=(1, 2)).astype(float)
+    scale = n.divide(totals, previousTotals, out=n.zeros_like(totals), where=previousTotals > 0)
+
+    differences = matrices - previous * scale[:, None, None]
+    # Nothing to compare with
+    differences[previousTotals == 0] = 0
+    return stacks, differences
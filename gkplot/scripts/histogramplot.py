@@ -2,7 +2,7 @@
 """Plot histogram to show performance of the specified trained classifier.
 
 Usage:
-  %s <inputFile>... [--delimiter=<delimiter>] [--column=<column>] [--outputFile=<file>] [--binwidth=<binwidth>] [--threshold=<threshold>] [--log] [--xlabel=<xlabel>] [--ylabel=<ylabel>] [--binlower=<binlower>] [--binupper=<binupper>] [--majorticks=<majorticks>] [--minorticks=<minorticks>] [--plotlabel=<plotlabel>] [--panellabel=<panellabel>] [--ylimit=<ylimit>] [--alpha=<alpha>] [--colour=<colour>] [--leglabels=<leglabels>] [--normalise]
+  %s <inputFile>... [--delimiter=<delimiter>] [--column=<column>] [--outputFile=<file>] [--binwidth=<binwidth>] [--threshold=<threshold>] [--log] [--xlabel=<xlabel>] [--ylabel=<ylabel>] [--binlower=<binlower>] [--binupper=<binupper>] [--majorticks=<majorticks>] [--minorticks=<minorticks>] [--plotlabel=<plotlabel>] [--panellabel=<panellabel>] [--ylimit=<ylimit>] [--alpha=<alpha>] [--colour=<colour>] [--leglabels=<leglabels>] [--normalise] [--groupby=<groupby>] [--skipunchanged] [--profile=<profile>] [--cprofile=<cprofile>] [--maxmemory=<maxmemory>]
   %s (-h | --help)
   %s --version
 
@@ -28,37 +28,80 @@ Options:
   --log                        Plot log(y) instead of y.
   --leglabels=<leglabels>      Legend labels (alternative to using the columns).
   --normalise                  Normalise the histogram.
+  --groupby=<groupby>          Split the values by this category column (e.g. telescope or filter) and overlay one histogram per group.
+  --skipunchanged              Don't make the plot if the output files were made from the same input files, with the same options.
+  --profile=<profile>          Report the wall time, CPU time, peak memory and number of artists of each stage (read, parse, aggregate, draw, save): to stderr if -, otherwise to this JSON file.
+  --cprofile=<cprofile>        Also dump cProfile statistics for the whole run to this file.
+  --maxmemory=<maxmemory>      Try to stay within this much memory (e.g. 2G): if the files won't fit, read just the columns needed in chunks, and bin them as they are read. The choices are reported.
 
   e.g.:
 
   %s ~/Documents/atlas/transient_paper/ztf_supernovae_2019.tsv ~/Documents/atlas/transient_paper/atlas_supernovae_2019.tsv ~/Documents/atlas/transient_paper/asassn_supernovae_2019.tsv --delimiter=$'\\t' --column=z --xlabel="redshift (z)" --ylabel=Number --binwidth=0.01 --binlower=0.0 --binupper=0.4 --majorticks=0.1 --minorticks=0.01 --colour=orange,red,blue --alpha=0.3,0.4,0.6 --outputFile=/tmp/zcomparison_2019.pdf --leglabels=ZTF,ATLAS,ASAS-SN
   %s ~/atlas/tns/HKO-orange.csv --column=mag --xlabel="Discovery mag" --ylabel=Number --binwidth=0.25 --binlower=12 --binupper=21 --majorticks=1 --minorticks=0.25 --colour=orange --alpha=0.3 --leglabels="HKO orange"
+  %s ~/atlas/tns/atlas_discoveries.csv --column=mag --groupby=telescope --xlabel="Discovery mag" --ylabel=Number --binwidth=0.25 --binlower=12 --binupper=21 --majorticks=1 --minorticks=0.25 --colour=orange,cyan,red,blue --alpha=0.4
   
 """
 import sys
-__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
 import os, shutil, re, csv, subprocess
-from gkutils.commonutils import Struct, cleanOptions, readGenericDataFile
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MultipleLocator
+from gkutils.commonutils import Struct, cleanOptions
+from outputCache import OutputCache, outputFiles
+from profiling import profiled, stage
+from dataReader import readColumnChunks, readDataFile
+from memoryBudget import MemoryBudget, parseMemory, fileRows, LIST_FLOAT_BYTES
 import numpy as n
 
 SMALL_SIZE = 14
 MEDIUM_SIZE = 18
 BIGGER_SIZE = 25
 TINY_SIZE = 12
-plt.rc('font', size=SMALL_SIZE)                   # controls default text sizes
-plt.rc('axes', titlesize=MEDIUM_SIZE)            # fontsize of the axes title
-plt.rc('axes', labelsize=MEDIUM_SIZE)           # fontsize of the x and y labels
-plt.rc('xtick', labelsize=TINY_SIZE)            # fontsize of the tick labels
-plt.rc('ytick', labelsize=TINY_SIZE)            # fontsize of the tick labels
-plt.rc('legend', fontsize=SMALL_SIZE - 1)               # legend fontsize
-plt.rc('figure', titlesize=BIGGER_SIZE)   # fontsize of the figure title
-plt.rcParams["font.family"] = "serif"
-plt.rcParams['mathtext.fontset'] = 'dejavuserif'
-
-def plotHistogram(data, options):
+
+def setStyle():
+    """Set this script's matplotlib rc style."""
+    import matplotlib
+    matplotlib.rc('font', size=SMALL_SIZE)                   # controls default text sizes
+    matplotlib.rc('axes', titlesize=MEDIUM_SIZE)            # fontsize of the axes title
+    matplotlib.rc('axes', labelsize=MEDIUM_SIZE)           # fontsize of the x and y labels
+    matplotlib.rc('xtick', labelsize=TINY_SIZE)            # fontsize of the tick labels
+    matplotlib.rc('ytick', labelsize=TINY_SIZE)            # fontsize of the tick labels
+    matplotlib.rc('legend', fontsize=SMALL_SIZE - 1)               # legend fontsize
+    matplotlib.rc('figure', titlesize=BIGGER_SIZE)   # fontsize of the figure title
+    matplotlib.rcParams["font.family"] = "serif"
+    matplotlib.rcParams['mathtext.fontset'] = 'dejavuserif'
+
+def histogramBins(options):
+    return n.linspace(float(options.binlower), float(options.binupper), int((float(options.binupper) - float(options.binlower))/float(options.binwidth))+1)
+
+
+def groupedHistogram(values, groups, bins):
+    """Histogram the values separately for each distinct group in a single pass.
+
+    Args:
+        values: array of values to histogram.
+        groups: array of category labels, one per value.
+        bins: bin edges (as for numpy.histogram, the last bin is closed).
+
+    Returns:
+        (groupNames, counts) where counts has one row of len(bins)-1 per group.
+    """
+    groupNames, groupIndex = n.unique(groups, return_inverse=True)
+    nbins = len(bins) - 1
+
+    binIndex = n.searchsorted(bins, values, side='right') - 1
+    # Like numpy.histogram, include values sitting exactly on the upper edge.
+    binIndex[values == bins[-1]] = nbins - 1
+    inRange = (binIndex >= 0) & (binIndex < nbins)
+
+    flatIndex = groupIndex[inRange] * nbins + binIndex[inRange]
+    counts = n.bincount(flatIndex, minlength=len(groupNames) * nbins).reshape(len(groupNames), nbins)
+
+    return groupNames, counts
+
+
+def plotHistogram(data, options, groupLabels=None, binned=False):
+    from figures import newFigure, finishFigure
+    from matplotlib.ticker import MultipleLocator
 
     colours = options.colour.split(',')
     alphas = options.alpha.split(',')
@@ -66,32 +109,41 @@ def plotHistogram(data, options):
     leglabels = None
     if options.leglabels:
         leglabels = options.leglabels.split(',')
-    #fig = plt.figure(figsize=(6,3))
-    fig = plt.figure()
+    #fig = newFigure(figsize=(6,3))
+    fig = newFigure()
 
     ax1 = fig.add_subplot(111)
 
     #bins = n.linspace(round(float(options.binlower)), round(float(options.binupper)), int((float(options.binupper) - float(options.binlower))/float(options.binwidth))+1)
-    bins = n.linspace(float(options.binlower), float(options.binupper), int((float(options.binupper) - float(options.binlower))/float(options.binwidth))+1)
+    bins = histogramBins(options)
 
     ml = MultipleLocator(float(options.majorticks))
     ax1.xaxis.set_major_locator(ml)
 
-    # May have more than one histogram to plot
+    # May have more than one histogram to plot. If grouped (or binned), each element
+    # of data is a row of precomputed counts for that group (or file).
 
     i = 0
     for d in data:
-        if len(colours) == 1:
+        if len(colours) == 1 and groupLabels is None:
             colour = colours[0]
-        else:
+        elif i < len(colours):
             colour = colours[i]
+        else:
+            # More groups than colours - fall back to the default colour cycle.
+            colour = 'C%d' % (i % 10)
 
         if len(alphas) == 1:
             alpha = alphas[0]
         else:
-            alpha = alphas[i]
+            alpha = alphas[min(i, len(alphas) - 1)]
 
-        ax1.hist(n.array(d), bins=bins, color = colour, edgecolor='black', linewidth=0.5, alpha = float(alpha))
+        if groupLabels is not None:
+            ax1.hist(bins[:-1], bins=bins, weights=d, color = colour, edgecolor='black', linewidth=0.5, alpha = float(alpha), label = groupLabels[i])
+        elif binned:
+            ax1.hist(bins[:-1], bins=bins, weights=d, color = colour, edgecolor='black', linewidth=0.5, alpha = float(alpha))
+        else:
+            ax1.hist(n.array(d), bins=bins, color = colour, edgecolor='black', linewidth=0.5, alpha = float(alpha))
         i += 1
 
     ax1.set_ylabel(options.ylabel)
@@ -100,7 +152,9 @@ def plotHistogram(data, options):
 
     ax1.set_xlabel(options.xlabel)
     #ax1.set_title('Classifier performance.')
-    if len(columns) > 1:
+    if groupLabels is not None:
+        ax1.legend(loc=1, frameon=False)
+    elif len(columns) > 1:
         ax1.legend(columns, loc=1, frameon=False)
     elif leglabels is not None:
         ax1.legend(leglabels, loc=1, frameon=False)
@@ -123,34 +177,136 @@ def plotHistogram(data, options):
     if options.threshold is not None:
         ax1.axvline(x=float(options.threshold),color='k',linestyle='--')
 
-    plt.tight_layout()
+    with stage('layout'):
+        fig.tight_layout()
+
+    return finishFigure(fig, options.outputFile, dpi=600)
+
+
+def groupLegendLabels(options, groupNames):
+    """Legend label of each group: the --leglabels entry in its place, or the group name if there isn't one."""
+    leglabels = options.leglabels.split(',') if options.leglabels else []
+    return [leglabels[i] if i < len(leglabels) else str(g) for i, g in enumerate(groupNames)]
+
+
+def doGroupedPlots(options, reader = readDataFile):
+    # Pool the values and their group labels from all the input files, then bin them all at once
+    columns = options.column.split(',')
+    values = []
+    groups = []
+    i = 0
+    for datafile in options.inputFile:
+        if len(columns) == len(options.inputFile):
+            column = columns[i]
+        else:
+            column = options.column
+
+        with stage('read'):
+            dataRows = reader(datafile, delimiter=options.delimiter, columns=[column, options.groupby])
+
+        with stage('parse'):
+            values.append(n.array([row[column] for row in dataRows], dtype=float))
+            groups.append(n.array([row[options.groupby] for row in dataRows]))
+        i += 1
+
+    with stage('aggregate'):
+        values = n.concatenate(values)
+        groups = n.concatenate(groups)
 
-    if options.outputFile is not None:
-        plt.savefig(options.outputFile, dpi=600)
-    else:
-        plt.show()
+        bins = histogramBins(options)
+        groupNames, counts = groupedHistogram(values, groups, bins)
 
+    with stage('draw'):
+        plotHistogram(counts, options, groupLabels=groupLegendLabels(options, groupNames))
+
+
+def fitsWhole(options, budget):
+    """Whether the input files can be read whole, and plotted as usual, within the memory budget."""
+    wholeBytes = 0
+    totalRows = 0
+    for datafile in options.inputFile:
+        rows, columns = fileRows(datafile, options.delimiter)
+        if rows is None:
+            budget.decide("the size of %s can't be known in advance: reading in chunks" % datafile)
+            return False
+        wholeBytes += rows * (budget.dictRowBytes(columns) + LIST_FLOAT_BYTES)
+        totalRows += rows
+    return budget.fits(wholeBytes, "reading about %d rows whole" % totalRows)
+
+
+def doBinnedPlots(options, budget):
+    """Bin the values (per file, or per group) a chunk at a time, reading just the columns needed."""
+    columns = options.column.split(',')
+    bins = histogramBins(options)
+    chunkSize = budget.chunkSize(2 if options.groupby else 1)
+    budget.decide("reading in chunks of %d rows and binning as they are read" % chunkSize)
+
+    allCounts = []
+    groupCounts = {}
+    i = 0
+    # Reads the files as it goes
+    with stage('aggregate'):
+        for datafile in options.inputFile:
+            column = columns[i] if len(columns) == len(options.inputFile) else options.column
+            counts = n.zeros(len(bins) - 1, dtype = n.int64)
+            for chunk in readColumnChunks(datafile, columns = [column] + ([options.groupby] if options.groupby else []), delimiter = options.delimiter, chunkSize = chunkSize):
+                # float64, like the unbudgeted path, so that values on a bin edge land in the same bin
+                values = chunk[column].astype(float)
+                if options.groupby:
+                    groupNames, chunkCounts = groupedHistogram(values, chunk[options.groupby], bins)
+                    for name, c in zip(groupNames, chunkCounts):
+                        groupCounts[name] = groupCounts.get(name, 0) + c
+                else:
+                    counts += n.histogram(values, bins = bins)[0]
+            allCounts.append(counts)
+            i += 1
+
+    with stage('draw'):
+        if options.groupby:
+            groupNames = sorted(groupCounts)
+            plotHistogram([groupCounts[g] for g in groupNames], options, groupLabels = groupLegendLabels(options, groupNames))
+        else:
+            plotHistogram(allCounts, options, binned = True)
+
+
+def doPlots(options, reader = readDataFile):
+    """Read the input files and plot them.
+
+    Args:
+        options:
+        reader: function to read a file into a list of row dicts, e.g. a cached reader in the plot server.
+    """
+    if options.maxmemory:
+        budget = MemoryBudget(parseMemory(options.maxmemory), dpi = 600)
+        if not fitsWhole(options, budget):
+            doBinnedPlots(options, budget)
+            return
+
+    if options.groupby:
+        doGroupedPlots(options, reader = reader)
+        return
 
-def doPlots(options):
     # There may be more than one inputFile
     allData = []
     columns = options.column.split(',')
     i = 0
     for datafile in options.inputFile:
         data = []
-        dataRows = readGenericDataFile(datafile, delimiter=options.delimiter)
-
-        for row in dataRows:
-            if len(columns) == len(options.inputFile):
-                datum = float(row[columns[i]])
-            else:
-                datum = float(row[options.column])
-            #if datum > 0:
-            data.append(datum)
+        column = columns[i] if len(columns) == len(options.inputFile) else options.column
+        with stage('read'):
+            dataRows = reader(datafile, delimiter=options.delimiter, columns=[column])
+
+        with stage('parse'):
+            for row in dataRows:
+                datum = float(row[column])
+                #if datum > 0:
+                data.append(datum)
         allData.append(data)
         i += 1
 
-    plotHistogram(allData, options)
+    # Binned as it is drawn, by Axes.hist
+    with stage('draw'):
+        plotHistogram(allData, options)
 
 
 def main():
@@ -158,7 +314,16 @@ def main():
     opts = cleanOptions(opts)
     options = Struct(**opts)
 
-    doPlots(options)
+    cache, upToDate = OutputCache.skip(options, options.inputFile, outputFiles(options.outputFile))
+    if upToDate:
+        return
+
+    setStyle()
+
+    with profiled(options.profile, options.cprofile):
+        doPlots(options)
+    if cache:
+        cache.record()
 
 
 if __name__=='__main__':
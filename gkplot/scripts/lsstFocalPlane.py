@@ -0,0 +1,212 @@
+"""
+Geometry of the 189 LSST science detectors, shared by the detector map and
+heatmap plotters.
+
+Rafts are 3×3 groups of detectors arranged as:
+- Row 1 (bottom): 3 groups
+- Rows 2-4: 5 groups, centered over the row below
+- Row 5 (top): 3 groups aligned with the *middle three* of Row 4
+
+Detectors within a group are labeled:
+6 7 8
+3 4 5
+0 1 2
+
+and numbering proceeds by groups left→right in each row, bottom→top.
+
+The layout is computed once per set of spacing parameters (see `get_layout`)
+and held as NumPy arrays, so every plot draws the whole focal plane with a
+single polygon collection instead of one Rectangle per detector.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from matplotlib.collections import PathCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.path import Path
+
+NUM_DETECTORS = 189
+
+# Number of rafts per row, bottom→top
+ROW_GROUPS = (3, 5, 5, 5, 3)
+
+
+class FocalPlaneLayout:
+    """Detector rectangles for the whole focal plane.
+
+    Attributes:
+        x0, y0 (ndarray[189]): lower left corner of each detector, indexed by detector id.
+        xc, yc (ndarray[189]): centre of each detector.
+        vertices (ndarray[189, 4, 2]): corners of each detector.
+        paths (list[Path]): closed outline of each detector.
+        extent (tuple): (xmin, xmax, ymin, ymax) including a one square margin.
+    """
+
+    def __init__(self, square_size=1.0, intra_gap=0.12, inter_gap_x=0.6, inter_gap_y=0.6):
+        self.square_size = square_size
+        self.intra_gap = intra_gap
+        self.inter_gap_x = inter_gap_x
+        self.inter_gap_y = inter_gap_y
+
+        group_w = 3 * square_size + 2 * intra_gap
+        group_h = 3 * square_size + 2 * intra_gap
+        stride_x = group_w + inter_gap_x
+        stride_y = group_h + inter_gap_y
+
+        # Raft centres. Rows 1-3 are centred over the previous row's centre,
+        # row 4 is aligned with the middle three rafts of row 3.
+        row_x_positions = []
+        k = ROW_GROUPS[0]
+        row_x_positions.append((np.arange(k) - (k - 1) / 2) * stride_x)
+        for r in [1, 2, 3]:
+            k = ROW_GROUPS[r]
+            prev_center = row_x_positions[r - 1].mean()
+            row_x_positions.append(prev_center + (np.arange(k) - (k - 1) / 2) * stride_x)
+        row_x_positions.append(row_x_positions[3][1:4])
+
+        group_xc = np.concatenate(row_x_positions)
+        group_yc = np.concatenate([np.full(len(xs), r * stride_y) for r, xs in enumerate(row_x_positions)])
+
+        # Detector offsets within a raft, in label order 0..8
+        iy, ix = np.divmod(np.arange(9), 3)
+        pitch = square_size + intra_gap
+
+        self.x0 = ((group_xc - group_w / 2)[:, None] + ix * pitch).ravel()
+        self.y0 = ((group_yc - group_h / 2)[:, None] + iy * pitch).ravel()
+        self.xc = self.x0 + square_size / 2
+        self.yc = self.y0 + square_size / 2
+
+        corners = np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]]) * square_size
+        self.vertices = np.stack([self.x0, self.y0], axis=1)[:, None, :] + corners
+
+        pad = square_size
+        self.extent = (group_xc.min() - (group_w / 2 + pad),
+                       group_xc.max() + (group_w / 2 + pad),
+                       -(group_h / 2 + pad),
+                       group_yc.max() + group_h / 2 + pad)
+
+        # Treat the cached arrays as constants - they are shared between plots.
+        for a in (self.x0, self.y0, self.xc, self.yc, self.vertices):
+            a.flags.writeable = False
+
+        # Closed detector outlines, built once and shared by every collection we hand out
+        self.paths = [Path(np.vstack([v, v[:1]]), closed=True) for v in self.vertices]
+
+        self._meshes = {}
+        self._pixel_indices = {}
+
+    def values_array(self, values, fill=np.nan):
+        """Convert a {detector_id: value} dict (or an array indexed by detector id)
+        into a float array of length 189. Detectors with no value get `fill`.
+        """
+        if isinstance(values, dict):
+            out = np.full(NUM_DETECTORS, fill, dtype=float)
+            if values:
+                ids = np.fromiter(values.keys(), dtype=int, count=len(values))
+                vals = np.fromiter(values.values(), dtype=float, count=len(values))
+                ok = (ids >= 0) & (ids < NUM_DETECTORS)
+                out[ids[ok]] = vals[ok]
+            return out
+        return np.asarray(values, dtype=float)[:NUM_DETECTORS]
+
+    def collection(self, facecolors, edgecolor="black", linewidth=1.0, **kwargs):
+        """One collection holding all 189 detector polygons.
+
+        The detector outlines are shared with every other collection from this
+        layout, so making one per panel only costs the face colour array.
+        """
+        return PathCollection(self.paths, facecolors=facecolors, edgecolors=edgecolor,
+                              linewidths=linewidth, **kwargs)
+
+    def mesh(self, nx, ny):
+        """Quadrilateral mesh covering the focal plane with every detector split into nx × ny cells.
+
+        Detectors line up in 15 columns and 15 rows, so the whole focal plane is
+        one rectilinear grid whose cells are either detector sub-cells or gaps
+        (between detectors, or where there is no raft). Gap cells are never
+        assigned and should be masked.
+
+        Returns:
+            X, Y: cell edges for pcolormesh.
+            index: (rows, cols) integer arrays of shape (189, ny, nx) locating each
+                   detector sub-cell in the grid, i.e. grid[index] = cells.
+            shape: shape of the grid of cell values.
+        """
+        if (nx, ny) not in self._meshes:
+            cols, col_idx = np.unique(np.round(self.x0, 9), return_inverse=True)
+            rows, row_idx = np.unique(np.round(self.y0, 9), return_inverse=True)
+
+            # Each detector column contributes nx+1 edges; the cell between the last edge of
+            # one column and the first edge of the next is the gap between them.
+            X = (cols[:, None] + np.arange(nx + 1) / nx * self.square_size).ravel()
+            Y = (rows[:, None] + np.arange(ny + 1) / ny * self.square_size).ravel()
+
+            grid_rows = row_idx[:, None, None] * (ny + 1) + np.arange(ny)[None, :, None]
+            grid_cols = col_idx[:, None, None] * (nx + 1) + np.arange(nx)[None, None, :]
+            index = (np.broadcast_to(grid_rows, (NUM_DETECTORS, ny, nx)),
+                     np.broadcast_to(grid_cols, (NUM_DETECTORS, ny, nx)))
+            shape = (len(Y) - 1, len(X) - 1)
+            self._meshes[(nx, ny)] = (X, Y, index, shape)
+        return self._meshes[(nx, ny)]
+
+    def pixel_index(self, pixels_per_square=8):
+        """Image of detector ids covering the focal plane extent, for drawing without matplotlib.
+
+        Each detector is pixels_per_square pixels across. Row 0 is the top of the
+        focal plane, and pixels outside every detector are -1, so an RGB image of
+        per-detector colours is just colors[index] (with the gaps filled in afterwards).
+        """
+        if pixels_per_square not in self._pixel_indices:
+            xmin, xmax, ymin, ymax = self.extent
+            scale = pixels_per_square / self.square_size
+            px = xmin + (np.arange(int(np.ceil((xmax - xmin) * scale))) + 0.5) / scale
+            py = ymax - (np.arange(int(np.ceil((ymax - ymin) * scale))) + 0.5) / scale
+
+            # Detectors line up in columns and rows (see mesh), so look up each pixel's
+            # column and row and then the detector, if any, at that column and row.
+            cols, col_idx = np.unique(np.round(self.x0, 9), return_inverse=True)
+            rows, row_idx = np.unique(np.round(self.y0, 9), return_inverse=True)
+            detector_at = np.full((len(rows) + 1, len(cols) + 1), -1, dtype=np.int16)
+            detector_at[row_idx, col_idx] = np.arange(NUM_DETECTORS)
+
+            def locate(p, edges):
+                i = np.searchsorted(edges, p, side="right") - 1
+                inside = (i >= 0) & (p < edges[np.maximum(i, 0)] + self.square_size)
+                # Pixels in a gap point at the spare last row/column, which is all -1
+                return np.where(inside, i, len(edges))
+
+            index = detector_at[locate(py, rows)[:, None], locate(px, cols)[None, :]]
+            index.flags.writeable = False
+            self._pixel_indices[pixels_per_square] = index
+        return self._pixel_indices[pixels_per_square]
+
+    def label(self, ax, texts, colors, fontsize):
+        """Write a text label in the centre of each detector. `texts` may contain None to skip a detector."""
+        for x, y, txt, c in zip(self.xc, self.yc, texts, colors):
+            if txt is not None:
+                ax.text(x, y, txt, ha="center", va="center", fontsize=fontsize, color=c)
+
+    def set_limits(self, ax):
+        """Equal aspect, no axes, and limits that just enclose the focal plane."""
+        ax.set_aspect("equal", adjustable="box")
+        ax.axis("off")
+        xmin, xmax, ymin, ymax = self.extent
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+
+
+@lru_cache(maxsize=None)
+def get_layout(square_size=1.0, intra_gap=0.12, inter_gap_x=0.6, inter_gap_y=0.6):
+    """Return the (cached) FocalPlaneLayout for these spacing parameters."""
+    return FocalPlaneLayout(square_size, intra_gap, inter_gap_x, inter_gap_y)
+
+
+def contrast_colors(facecolors):
+    """Pick black/white label colours based on fill luminance for readability.
+
+    Fully transparent fills (i.e. no fill) get black labels.
+    """
+    rgba = to_rgba_array(facecolors)
+    L = 0.2126 * rgba[:, 0] + 0.7152 * rgba[:, 1] + 0.0722 * rgba[:, 2]
+    return np.where((L > 0.6) | (rgba[:, 3] == 0.0), "black", "white")
@@ -0,0 +1,127 @@
+"""Keep a plot within a memory budget (--maxmemory), by choosing how its input is read and drawn.
+
+Reading a file with readGenericDataFile keeps every row as a dict, which takes far
+more memory than the numbers in it. Given a budget, a script can instead read just
+the columns it needs, a chunk at a time, and, when what it keeps still won't fit,
+bin the data as it is read and draw the counts rather than every point or
+footprint. skyplot also keeps its positions as float32 where that is precise
+enough (histogramplot bins every chunk as float64, so that values on a bin edge
+land in the same bin as without a budget). MemoryBudget estimates what each
+of those costs, and reports each choice made:
+
+    budget = MemoryBudget(parseMemory('2G'), dpi = 600)
+    if budget.fits(rows * budget.dictRowBytes(columns), 'reading %d rows whole' % rows):
+        ...
+
+The sizes below are rough, measured with --profile on the benchmark data (see
+benchmarks/benchmarkPlots.py), and err on the large side.
+"""
+import os
+import numpy as n
+from dataReader import columnNames, estimateRows, DEFAULT_CHUNK_SIZE, STDIN
+from profiling import peakRSS, formatSize
+
+# Per row of a readGenericDataFile dict, and per value in it
+DICT_ROW_BYTES = 100
+DICT_VALUE_BYTES = 100
+# Per value of a readColumnChunks chunk, while it is being read and converted
+TEXT_VALUE_BYTES = 120
+# Per value appended to a list of floats
+LIST_FLOAT_BYTES = 32
+# Per point drawn with scatter: its float64 offsets, and their transformed copies when drawn
+POINT_BYTES = 80
+# Per Circle or Rectangle patch
+PATCH_BYTES = 6000
+# Agg canvases, and copies of them, alive while a figure is saved with a tight bounding box
+CANVAS_COPIES = 7
+
+MIN_CHUNK_SIZE = 10000
+
+UNITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+
+
+def parseMemory(text):
+    """A memory size, e.g. 512M or 4G (with an optional B), in bytes."""
+    size = text.strip().upper().rstrip('B')
+    unit = size[-1] if size and size[-1] in 'KMGT' else ''
+    try:
+        return int(float(size[:len(size) - len(unit)]) * UNITS[unit])
+    except ValueError:
+        raise ValueError("Memory size must be a number with an optional K, M, G or T, e.g. 4G, not %s" % text)
+
+
+def currentRSS():
+    """Resident set size of this process now, in bytes (the peak so far if that can't be found)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peakRSS() or 0
+
+
+def canvasBytes(figsize = None, dpi = None):
+    """Roughly what saving a figure of this size (inches) at this dpi takes."""
+    import matplotlib
+    width, height = figsize or matplotlib.rcParams['figure.figsize']
+    dpi = dpi or matplotlib.rcParams['figure.dpi']
+    return int(width * dpi * height * dpi * 4 * CANVAS_COPIES)
+
+
+def fileRows(filename, delimiter):
+    """(estimated number of rows, number of columns) of a headed, delimited file or a binary table.
+
+    Both are None for stdin, which can't be looked at without using it up.
+    """
+    if filename == STDIN:
+        return None, None
+    return estimateRows(filename), len(columnNames(filename, delimiter))
+
+
+class MemoryBudget:
+    """How much memory is left for a plot's data, and the choices made to stay within it."""
+
+    def __init__(self, limit, figsize = None, dpi = None):
+        """__init__.
+
+        Args:
+            limit: the most memory the process should use, in bytes.
+            figsize: size of the figure in inches (default the matplotlib default).
+            dpi: resolution it will be saved at.
+        """
+        self.limit = limit
+        self.decisions = []
+        inUse = currentRSS()
+        drawing = canvasBytes(figsize, dpi)
+        self.available = limit - inUse - drawing
+        self.decide("%s in use, about %s to save the figure, %s left for the data" % (formatSize(inUse), formatSize(drawing), formatSize(max(self.available, 0))))
+        if self.available <= 0:
+            self.decide("the budget is too small for the figure alone: reading in the smallest chunks and drawing binned counts")
+
+    def decide(self, decision):
+        """Report a choice."""
+        print ("Memory budget %s: %s" % (formatSize(self.limit), decision))
+        self.decisions.append(decision)
+
+    def fits(self, nbytes, what = None, share = 1.0):
+        """Whether nbytes fits in (a share of) the memory available. If what is given, report the choice either way."""
+        fits = nbytes <= self.available * share
+        if what:
+            self.decide("%s needs about %s: %s" % (what, formatSize(nbytes), 'fits' if fits else 'does not fit'))
+        return fits
+
+    def dictRowBytes(self, columns):
+        """Memory for each row read with readGenericDataFile."""
+        return DICT_ROW_BYTES + columns * DICT_VALUE_BYTES
+
+    def chunkSize(self, columns, share = 0.25):
+        """Rows per readColumnChunks chunk of this many columns, so that a chunk takes at most a share of the budget."""
+        rows = int(max(self.available, 0) * share / (columns * TEXT_VALUE_BYTES))
+        return max(MIN_CHUNK_SIZE, min(DEFAULT_CHUNK_SIZE, rows))
+
+    def floatType(self, maxValue, resolution, what):
+        """float32 if it can hold values up to maxValue to better than 1/100 of resolution, otherwise float64."""
+        if n.spacing(n.float32(maxValue)) * 100 <= resolution:
+            self.decide("%s as float32 (to %.2g, for a resolution of %.2g)" % (what, n.spacing(n.float32(maxValue)), resolution))
+            return n.float32
+        self.decide("%s as float64: float32 is not precise enough" % what)
+        return n.float64
@@ -0,0 +1,167 @@
+"""Skip making plots whose input files and options have not changed since they were last made.
+
+For each set of output files, the cache (in $GKPLOT_CACHE, or ~/.cache/gkplot) keeps
+a record of what made them: the gkplot version, a hash of the script's options, and
+the path, size, modification time and SHA-256 digest of every input file. A plot is
+up to date if its output files are all still there, as they were written, and the
+inputs and options match. An input file that has been touched or copied again, but
+whose content is the same, still counts as unchanged: its digest is only worked out
+when its size is the same but its modification time is not.
+
+    cache, upToDate = OutputCache.skip(options, options.inputFile, [options.outputFile])
+    if upToDate:
+        return
+    doPlots(options)
+    if cache:
+        cache.record()
+"""
+import os, json, hashlib, tempfile
+from version import getVersion
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gkplot')
+
+# Options that make no difference to the plot
+IGNORED_OPTIONS = ('help', 'version', 'skipunchanged', 'profile', 'cprofile')
+
+
+def cacheDir():
+    return os.environ.get('GKPLOT_CACHE', DEFAULT_CACHE_DIR)
+
+
+def fileDigest(filename, blockSize = 1 << 20):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def optionsHash(options):
+    """Hash of a script's options (a Struct or dict), leaving out those that don't change the plot."""
+    opts = options if isinstance(options, dict) else vars(options)
+    opts = {k: v for k, v in opts.items() if k not in IGNORED_OPTIONS}
+    return hashlib.sha256(json.dumps(opts, sort_keys = True, default = str).encode('utf-8')).hexdigest()
+
+
+def outputFiles(*names):
+    """The output files named in the arguments: None (not set), file names, and --outputs style lists."""
+    files = []
+    for name in names:
+        if not name:
+            continue
+        for output in name.split(','):
+            output = output.strip().partition('@')[0]
+            if output:
+                files.append(output)
+    return files
+
+
+class OutputCache:
+    """Decides whether a plot needs to be made again, and records it when it has been."""
+
+    def __init__(self, inputs, outputs, options, directory = None):
+        """__init__.
+
+        Args:
+            inputs: input file names.
+            outputs: output file names.
+            options: the script's options.
+            directory: cache directory (default $GKPLOT_CACHE or ~/.cache/gkplot).
+        """
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        # A plot from stdin can't be known to be unchanged
+        self.stdin = '-' in inputs
+        self.inputs = [os.path.abspath(f) for f in inputs]
+        self.outputs = sorted(set(os.path.abspath(f) for f in outputs))
+        self.options = optionsHash(options)
+        self.version = getVersion()
+        key = hashlib.sha256('\n'.join(self.outputs).encode('utf-8')).hexdigest()
+        self.recordFile = os.path.join(directory or cacheDir(), 'outputs', key + '.json')
+
+    @classmethod
+    def skip(cls, options, inputs, outputs):
+        """Check a script's outputs against the cache if it was run with --skipunchanged.
+
+        Args:
+            options: the script's options.
+            inputs: input file names.
+            outputs: output file names.
+
+        Returns:
+            (cache, upToDate): the cache to record() once the outputs have been written
+            (None without --skipunchanged), and whether the outputs are already up to
+            date, so that the plot can be skipped.
+        """
+        if not getattr(options, 'skipunchanged', False):
+            return None, False
+        cache = cls(inputs, outputs, options)
+        if cache.unchanged():
+            print ("Output is up to date - skipping")
+            return cache, True
+        return cache, False
+
+    def _read(self):
+        try:
+            with open(self.recordFile) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def unchanged(self):
+        """True if the outputs exist and were made by this version, with these options, from these inputs."""
+        if not self.outputs or self.stdin:
+            return False
+        previous = self._read()
+        if previous is None or previous.get('version') != self.version or previous.get('options') != self.options:
+            return False
+
+        for filename in self.outputs:
+            recorded = previous['outputs'].get(filename)
+            if recorded is None or not os.path.exists(filename):
+                return False
+            stat = os.stat(filename)
+            if [stat.st_size, stat.st_mtime_ns] != [recorded['size'], recorded['mtime']]:
+                return False
+
+        if [i['path'] for i in previous['inputs']] != self.inputs:
+            return False
+        for recorded in previous['inputs']:
+            if not os.path.exists(recorded['path']):
+                return False
+            stat = os.stat(recorded['path'])
+            if stat.st_size != recorded['size']:
+                return False
+            if stat.st_mtime_ns != recorded['mtime'] and fileDigest(recorded['path']) != recorded['sha256']:
+                return False
+        return True
+
+    def record(self):
+        """Remember the current outputs, inputs and options. Call once the outputs have been written."""
+        if not self.outputs or self.stdin:
+            return
+        previous = {i['path']: i for i in (self._read() or {}).get('inputs', [])}
+        inputs = []
+        for filename in self.inputs:
+            stat = os.stat(filename)
+            old = previous.get(filename)
+            if old and [old['size'], old['mtime']] == [stat.st_size, stat.st_mtime_ns]:
+                digest = old['sha256']
+            else:
+                digest = fileDigest(filename)
+            inputs.append({'path': filename, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest})
+
+        outputs = {}
+        for filename in self.outputs:
+            if not os.path.exists(filename):
+                # Nothing (complete) to remember
+                return
+            stat = os.stat(filename)
+            outputs[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+        os.makedirs(os.path.dirname(self.recordFile), exist_ok = True)
+        fd, tempFile = tempfile.mkstemp(dir = os.path.dirname(self.recordFile), suffix = '.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': self.version, 'options': self.options, 'inputs': inputs, 'outputs': outputs}, f, indent = 1)
+        os.replace(tempFile, self.recordFile)
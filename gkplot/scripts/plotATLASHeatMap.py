@@ -2,7 +2,7 @@
 """Plot an ATLAS detector heatmap from an input file - or import the plotHeatMap function. Input file needs headed rows called x and y.
 
 Usage:
-  %s <filename> [--outputFile=<file>] [--title=<title>] [--heatmapresolution=<heatmapresolution>] [--delimiter=<delimiter>] [--multiplier=<multiplier>] [--grid] [--colorbar] [--mask] [--horizontal] [--matrixfile]
+  %s <filename> [--outputFile=<file>] [--title=<title>] [--heatmapresolution=<heatmapresolution>] [--delimiter=<delimiter>] [--multiplier=<multiplier>] [--grid] [--colorbar] [--mask] [--horizontal] [--matrixfile] [--chunksize=<chunksize>] [--pyramidfile=<pyramidfile>] [--savematrix=<savematrix>] [--rawpng] [--pixelscale=<pixelscale>] [--outputs=<outputs>] [--skipunchanged] [--profile=<profile>] [--cprofile=<cprofile>]
   %s (-h | --help)
   %s --version
 
@@ -10,6 +10,10 @@ Options:
   -h --help                                 Show this screen.
   --version                                 Show version.
   --outputFile=<file>                       Output file. If not defined, show plot.
+  --outputs=<outputs>                       Also write the plot to these files, drawing it only once: comma separated, each with an optional @<dpi> (e.g. heatmap.png,heatmap.pdf,heatmap_thumb.png@50).
+  --skipunchanged                           Don't make the plot if the output files were made from the same input files, with the same options.
+  --profile=<profile>                       Report the wall time, CPU time, peak memory and number of artists of each stage (read, aggregate, draw, save): to stderr if -, otherwise to this JSON file.
+  --cprofile=<cprofile>                     Also dump cProfile statistics for the whole run to this file.
   --title=<title>                           Plot title.
   --heatmapresolution=<heatmapresolution>   Heatmap resolution as a power of 2 between 8 and 512 [default: 128].
   --delimiter=<delimiter>                   Delimiter to use [default: \\t].
@@ -18,39 +22,185 @@ Options:
   --colorbar                                Display a colour bar.
   --horizontal                              Show the colour bar horizontally (ignored if colourbar not displayed).
   --mask                                    Set the display above the threshold value to be zero.
-  --matrixfile                              Assume the input file is a pre-caculated matrix. In this case the heatmapresolution option will be ignored.
+  --matrixfile                              Assume the input file is a pre-caculated matrix: an ndet text table, a binary .npy matrix, or a heatmap pyramid (.npz). The heatmapresolution option is ignored, except to select the level to plot from a pyramid.
+  --chunksize=<chunksize>                   Number of detections to read at a time when building the heatmap [default: 1000000].
+  --pyramidfile=<pyramidfile>               Bin the detections once at 512x512 and save every resolution from 8 to 512 to this .npz file (plot it later with --matrixfile).
+  --savematrix=<savematrix>                 Save the heatmap matrix to this file, as a binary matrix if it ends in .npy, otherwise as an ndet text table.
+  --rawpng                                  Write the output file directly as a PNG thumbnail, one pixel per matrix element, without matplotlib (no title, grid or colour bar).
+  --pixelscale=<pixelscale>                 With --rawpng, the number of image pixels per matrix element in each direction [default: 1].
 """
 import sys
 __doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
-import os, MySQLdb, shutil, re, csv, subprocess
-from gkutils.commonutils import Struct, cleanOptions, readGenericDataFile, transform, J2000toGalactic, calculateHeatMap
-from math import sqrt
+import os, shutil, re, csv, subprocess
+from gkutils.commonutils import Struct, cleanOptions, transform, J2000toGalactic
+from heatMapUtils import HEATMAP_RESOLUTIONS, buildHeatMap, buildHeatMapPyramid, saveHeatMapPyramid, readMatrixFile, writeMatrixFile
+from rasterImages import heatMapPNG
 import numpy as n
-import matplotlib.pyplot as plt
-import matplotlib.ticker as plticker
-import matplotlib.colors as colors
+from outputCache import OutputCache, outputFiles
+from profiling import profiled, stage
 import datetime
 import os
-import matplotlib.patheffects as path_effects
 import copy
-from astropy.stats import median_absolute_deviation
 
 SMALL_SIZE = 14
 MEDIUM_SIZE = 18
 BIGGER_SIZE = 25
 TINY_SIZE = 6
-plt.rc('font', size=SMALL_SIZE)                   # controls default text sizes
-plt.rc('axes', labelsize=TINY_SIZE)           # fontsize of the x and y labels
-plt.rc('xtick', labelsize=TINY_SIZE)            # fontsize of the tick labels
-plt.rc('ytick', labelsize=TINY_SIZE)            # fontsize of the tick labels
-plt.rc('legend', fontsize=SMALL_SIZE - 1)               # legend fontsize
-plt.rc('figure', titlesize=BIGGER_SIZE)   # fontsize of the figure title
-plt.rcParams["font.family"] = "serif"
-plt.rcParams['mathtext.fontset'] = 'dejavuserif'
-
-def plotHeatMap(title, matrix, galacticCoords, obj, outputFile = None, heatMapResolution = 8, colorBarSpan = 2000.0, showGrid = False, showColorBar = False, median = None, showMask = False):
-    """plotHeatMap.
+
+def setStyle():
+    """Set this script's matplotlib rc style."""
+    import matplotlib
+    matplotlib.rc('font', size=SMALL_SIZE)                   # controls default text sizes
+    matplotlib.rc('axes', labelsize=TINY_SIZE)           # fontsize of the x and y labels
+    matplotlib.rc('xtick', labelsize=TINY_SIZE)            # fontsize of the tick labels
+    matplotlib.rc('ytick', labelsize=TINY_SIZE)            # fontsize of the tick labels
+    matplotlib.rc('legend', fontsize=SMALL_SIZE - 1)               # legend fontsize
+    matplotlib.rc('figure', titlesize=BIGGER_SIZE)   # fontsize of the figure title
+    matplotlib.rcParams["font.family"] = "serif"
+    matplotlib.rcParams['mathtext.fontset'] = 'dejavuserif'
+
+class HeatMapRenderer:
+    """A heatmap figure that is set up once and then redrawn for any number of matrices.
+
+    The axes, ticks, text overlays and (optional) colour bar are created when the
+    renderer is, and update() only swaps in the new matrix, texts and colour limits,
+    so rendering a long sequence of heatmaps costs little more than the rasterization.
+    """
+
+    def __init__(self, heatMapResolution = 128, showGrid = False, showColorBar = False, showMask = False, colorMap = None):
+        """__init__.
+
+        Args:
+            heatMapResolution: initial matrix size (update() adapts to other sizes).
+            showGrid:
+            showColorBar:
+            showMask: show pixels above the colour bar span in black.
+            colorMap: matplotlib colour map name (default viridis), e.g. a diverging one for difference maps.
+        """
+        import matplotlib
+        from figures import newFigure
+
+        cmap = matplotlib.colormaps[colorMap or matplotlib.rcParams['image.cmap']]
+        if showMask:
+            cmap.set_over('black')
+
+        self.fig = newFigure()
+        self.ax = self.fig.add_subplot(111)
+        self.heatMapResolution = None
+
+        # Add the image
+        self.image = self.ax.imshow(n.zeros((heatMapResolution, heatMapResolution)), interpolation='none', cmap=cmap)
+        self.ax.set_aspect('equal')
+
+        # Add the grid on the major ticks
+        if showGrid:
+            self.ax.grid(which='major', axis='both', linestyle='-', color="white")
+
+        # Turn off the axis labels
+        self.ax.xaxis.set_ticklabels([])
+        self.ax.yaxis.set_ticklabels([])
+        self.ax.tick_params(axis='y', colors='white')
+        self.ax.tick_params(axis='x', colors='white')
+        self._setResolution(heatMapResolution)
+
+        self.lText = self._addText(.8)
+        self.bText = self._addText(.7)
+        self.objText = self._addText(.6)
+        self.medianText = self._addText(.1, stroke = True)
+        self.titleText = self._addText(.9, stroke = True)
+
+        self.cbar = None
+        if showColorBar:
+            self.cbar = self.fig.colorbar(self.image, ax = self.ax, orientation='horizontal')
+
+    def _addText(self, y, stroke = False):
+        t = self.ax.text(.5, y, '', horizontalalignment='center', transform=self.ax.transAxes, color='white', size=10)
+        if stroke:
+            import matplotlib.patheffects as path_effects
+            t.set_path_effects([path_effects.Stroke(linewidth=1.5,foreground='blue'), path_effects.Normal()])
+        return t
+
+    def _setResolution(self, heatMapResolution):
+        if heatMapResolution == self.heatMapResolution:
+            return
+        self.heatMapResolution = heatMapResolution
+        self.image.set_extent((-0.5, heatMapResolution - 0.5, heatMapResolution - 0.5, -0.5))
+        ticks = n.arange(0,heatMapResolution,heatMapResolution/8) - 0.5
+        self.ax.set_yticks(ticks)
+        self.ax.set_xticks(ticks)
+        self.ax.xaxis.set_ticklabels([])
+        self.ax.yaxis.set_ticklabels([])
+
+    def update(self, matrix, title, colorBarSpan = 2000.0, median = None, galacticCoords = None, obj = None, colorBarMin = 0.0):
+        """Show a new matrix.
+
+        Args:
+            matrix: the matrix, already flipped so that row 0 is the top of the detector.
+            title:
+            colorBarSpan: upper limit of the colour scale.
+            median: if set, shown at the bottom of the plot.
+            galacticCoords: (l, b) to show, or None.
+            obj: object name to show, or None.
+            colorBarMin: lower limit of the colour scale.
+        """
+        self._setResolution(matrix.shape[0])
+        self.image.set_data(matrix)
+        self.image.set_clim(colorBarMin, colorBarSpan)
+
+        self.lText.set_text("l = %.2f" % galacticCoords[0] if galacticCoords else '')
+        self.bText.set_text("b = %.2f" % galacticCoords[1] if galacticCoords else '')
+        self.objText.set_text(obj if obj else '')
+        self.medianText.set_text("median = %.1f" % median if median else '')
+        self.titleText.set_text(title if title else '')
+
+    def save(self, outputFile, dpi = 600):
+        with stage('save', figure = self.fig):
+            self.fig.savefig(outputFile, dpi=dpi, bbox_inches='tight')
+
+    def saveOutputs(self, outputs, dpi = 600):
+        """Save to several files (as for figures.parseOutputs), drawing only once for all the raster ones.
+
+        The raster files are written in the background (see figures.waitForOutputs), so
+        the renderer can go on to the next matrix straight away.
+        """
+        from figures import parseOutputs, saveOutputs
+        with stage('save', figure = self.fig):
+            return saveOutputs(self.fig, parseOutputs(outputs, dpi = dpi), bbox_inches='tight')
+
+    def show(self):
+        from figures import showFigure
+        showFigure(self.fig)
+
+    def close(self):
+        # The figure is not registered with pyplot, so just drop what it holds
+        self.fig.clear()
+
+    def animate(self, frames, outputFile = None, interval = 500, dpi = 150):
+        """Play (or save) a sequence of heatmaps in this figure.
+
+        Args:
+            frames: list of dicts of update() arguments, one per frame.
+            outputFile: e.g. nights.gif or nights.mp4. If not defined, show the animation.
+            interval: milliseconds between frames.
+            dpi: resolution of the saved animation.
+        """
+        from matplotlib.animation import FuncAnimation
+        from figures import pyplotFigure
+
+        if not outputFile:
+            # The animation's timer comes from the canvas, so it needs the GUI one
+            plt = pyplotFigure(self.fig)
+        anim = FuncAnimation(self.fig, lambda i: self.update(**frames[i]), frames = len(frames), interval = interval, repeat = False)
+        if outputFile:
+            anim.save(outputFile, writer = 'pillow' if outputFile.endswith('.gif') else None, dpi = dpi)
+        else:
+            plt.show()
+        return anim
+
+
+def plotHeatMap(title, matrix, galacticCoords, obj, outputFile = None, heatMapResolution = 8, colorBarSpan = 2000.0, showGrid = False, showColorBar = False, median = None, showMask = False, colorMap = None, colorBarMin = 0.0, outputs = None):
+    """plotHeatMap. Draw a single heatmap - use a HeatMapRenderer directly to draw many.
 
     Args:
         title:
@@ -64,108 +214,75 @@ def plotHeatMap(title, matrix, galacticCoords, obj, outputFile = None, heatMapRe
         showColorBar:
         median:
         showMask:
+        colorMap: matplotlib colour map name (default viridis), e.g. a diverging one for difference maps.
+        colorBarMin: lower limit of the colour scale.
+        outputs: also save to these files, as for figures.parseOutputs.
     """
-
-#    if showMask:
-#        # optional test - if array element > threshold/2, set it to zero.
-#        matrix[matrix > colorBarSpan] = 0
-
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-
-    # Set the gridding interval: here we use the major tick interval
-    if showGrid:
-        myInterval=8.
-        loc = plticker.MultipleLocator(base=myInterval)
-        ax.xaxis.set_major_locator(loc)
-        ax.yaxis.set_major_locator(loc)
-
-        # Add the grid
-        ax.grid(which='major', axis='both', linestyle='-', color="white")
-        # Find number of gridsquares in x and y direction
-        nx=abs(int(float(ax.get_xlim()[1]-ax.get_xlim()[0])/float(myInterval)))
-        ny=abs(int(float(ax.get_ylim()[1]-ax.get_ylim()[0])/float(myInterval)))
-
-    # Add the image
-    plt.imshow(matrix, interpolation='none')
-    ax.set_aspect('equal')
-
-    ticks = n.arange(0,heatMapResolution,heatMapResolution/8) - 0.5
-    ax.set_yticks(ticks)
-    ax.set_xticks(ticks)
-
-    # Turn off the axis labels
-    ax.xaxis.set_ticklabels([])
-    ax.yaxis.set_ticklabels([])
-    ax.tick_params(axis='y', colors='white')
-    ax.tick_params(axis='x', colors='white')
-
-    plt.imshow(matrix, interpolation='none')
-    ax.set_aspect('equal')
-
-    if galacticCoords:
-        t=ax.text(.5, .8, "l = %.2f" % galacticCoords[0], horizontalalignment='center', transform=ax.transAxes, color='white', size=10)
-        t=ax.text(.5, .7, "b = %.2f" % galacticCoords[1], horizontalalignment='center', transform=ax.transAxes, color='white', size=10)
-    if obj:
-        t=ax.text(.5, .6, obj, horizontalalignment='center', transform=ax.transAxes, color='white', size=10)
-    if median:
-        t=ax.text(.5, .1, "median = %.1f" % median, horizontalalignment='center', transform=ax.transAxes, color='white', size=10)
-        t.set_path_effects([path_effects.Stroke(linewidth=1.5,foreground='blue'), path_effects.Normal()])
-
-    t=ax.text(.5, .9, title, horizontalalignment='center', transform=ax.transAxes, color='white', size=10)
-    t.set_path_effects([path_effects.Stroke(linewidth=1.5,foreground='blue'), path_effects.Normal()])
-
-    # This doesn't work yet!
-    if showMask:
-        #cmap = copy.copy(plt.cm.get_cmap("viridis"))
-        my_cmap = plt.cm.get_cmap("viridis")
-        my_cmap.set_over('black')
-
-    #cbar = plt.colorbar(orientation='vertical', norm=colors.Normalize(vmin=0, vmax=10000))
-    cbar = plt.colorbar(orientation='horizontal')
-    cbar.mappable.set_clim(0, colorBarSpan)
-    if not showColorBar:
-        cbar.remove()
-    if outputFile:
-        plt.savefig(outputFile, dpi=600, bbox_inches='tight')
-        plt.clf()
-        plt.close()
+    with stage('draw'):
+        renderer = HeatMapRenderer(heatMapResolution = heatMapResolution, showGrid = showGrid, showColorBar = showColorBar, showMask = showMask, colorMap = colorMap)
+        renderer.update(matrix, title, colorBarSpan = colorBarSpan, median = median, galacticCoords = galacticCoords, obj = obj, colorBarMin = colorBarMin)
+
+    if outputs:
+        renderer.saveOutputs(outputFile + ',' + outputs if outputFile else outputs)
+        renderer.close()
+    elif outputFile:
+        renderer.save(outputFile)
+        renderer.close()
     else:
-        plt.show()
+        renderer.show()
 
     return
 
 
 
-def main():
-    """main.
-    """
-    opts = docopt(__doc__, version='0.1')
-    opts = cleanOptions(opts)
-    options = Struct(**opts)
+def doPlots(options):
+    """Build (or read) the heatmap matrix and plot it.
 
-    dataRows = readGenericDataFile(options.filename, delimiter='\t')
+    Args:
+        options:
+    """
     mat = {}
+    nobs = None
     if options.matrixfile:
-        resolution = int(sqrt(len(dataRows)))
-        if resolution not in [8, 16, 32, 64, 128, 256, 512]:
-            print ("Invalid map resolution of %d" % (resolution))
-        mat['matrix'] = n.array([int(x['ndet']) for x in dataRows]).reshape(resolution, resolution)
+        with stage('read'):
+            mat['matrix'], nobs = readMatrixFile(options.filename, resolution = int(options.heatmapresolution))
+        if mat['matrix'] is None:
+            print ("No level of resolution %s in %s" % (options.heatmapresolution, options.filename))
+            return
+    elif options.pyramidfile:
+        # Bin once at the highest resolution and derive all the others from that
+        with stage('aggregate'):
+            mat = buildHeatMap(options.filename, resolution = 512, delimiter='\t', chunkSize = int(options.chunksize))
+            pyramid = buildHeatMapPyramid(mat['matrix'])
+        with stage('save'):
+            saveHeatMapPyramid(options.pyramidfile, pyramid, nobs = len(mat['exps']))
+        mat['matrix'] = pyramid.get(int(options.heatmapresolution))
+        if mat['matrix'] is None:
+            print ("No level of resolution %s in %s" % (options.heatmapresolution, options.pyramidfile))
+            return
     else:
-        mat = calculateHeatMap(dataRows, resolution = int(options.heatmapresolution))
+        # Reads the file as it goes
+        with stage('aggregate'):
+            mat = buildHeatMap(options.filename, resolution = int(options.heatmapresolution), delimiter='\t', chunkSize = int(options.chunksize))
 
     matrix = mat['matrix']
 
+    if options.savematrix:
+        with stage('save'):
+            writeMatrixFile(options.savematrix, matrix)
+
     # Flip the matrix up/down, because we are in pixel space now and y zero is top left.
     matrixFlipped = n.flip(matrix, 0)
 
-    median = n.median(matrix)
-    #median = median_absolute_deviation(matrix)
-    stddev = n.std(matrix)
-    mad = median_absolute_deviation(matrix)
-    colorBarSpan = float(options.multiplier) * median
-    count = n.count_nonzero(matrix > colorBarSpan)
-    proportionPercentage = count/(matrix.shape[0]*matrix.shape[1]) * 100.0
+    with stage('aggregate'):
+        median = n.median(matrix)
+        #median = median_absolute_deviation(matrix)
+        stddev = n.std(matrix)
+        # Same as astropy.stats.median_absolute_deviation, without importing astropy
+        mad = n.median(n.abs(matrix - median))
+        colorBarSpan = float(options.multiplier) * median
+        count = n.count_nonzero(matrix > colorBarSpan)
+        proportionPercentage = count/(matrix.shape[0]*matrix.shape[1]) * 100.0
 
     print (mad, median, stddev, median / stddev, colorBarSpan, float(options.multiplier) * stddev)
 
@@ -174,14 +291,46 @@ def main():
     name = options.title
     if name is None and not options.matrixfile:
         name = os.path.basename(options.filename).split('.')[0] + ' (nobs = %d)' % len(mat['exps'])
+    elif name is None and nobs is not None:
+        # Read from a pyramid, which keeps the number of exposures
+        name = os.path.basename(options.filename).split('.')[0] + ' (nobs = %d)' % nobs
     elif name is None and options.matrixfile and options.mask:
         name = "Mask = %.2f%%" % (proportionPercentage)
 
-    plotHeatMap(name, matrixFlipped, None, None, outputFile = options.outputFile, heatMapResolution = int(options.heatmapresolution) , colorBarSpan = colorBarSpan, median = median, showGrid = options.grid, showColorBar = options.colorbar, showMask = options.mask)
+    if options.rawpng:
+        if not options.outputFile:
+            print ("--rawpng needs an --outputFile")
+            return
+        with stage('save'):
+            heatMapPNG(options.outputFile, matrixFlipped, colorBarSpan, showMask = options.mask, pixelScale = int(options.pixelscale))
+        return
+
+    plotHeatMap(name, matrixFlipped, None, None, outputFile = options.outputFile, heatMapResolution = matrix.shape[0], colorBarSpan = colorBarSpan, median = median, showGrid = options.grid, showColorBar = options.colorbar, showMask = options.mask, outputs = options.outputs)
+
+
+def main():
+    """main.
+    """
+    opts = docopt(__doc__, version='0.1')
+    opts = cleanOptions(opts)
+    options = Struct(**opts)
 
+    if options.heatmapresolution not in [str(r) for r in HEATMAP_RESOLUTIONS]:
+        sys.exit("Heatmap resolution should be 8, 16, 32, 64, 128, 256 or 512")
 
+    cache, upToDate = OutputCache.skip(options, options.filename, outputFiles(options.outputFile, options.outputs, options.savematrix, options.pyramidfile))
+    if upToDate:
+        return
 
+    setStyle()
+    from figures import waitForOutputs
 
+    with profiled(options.profile, options.cprofile):
+        doPlots(options)
+        with stage('write'):
+            waitForOutputs()
+    if cache:
+        cache.record()
 
 
 if __name__=='__main__':
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""Build ATLAS detector heatmaps for a directory of nightly detection files, using a pool of processes.
+
+For each night this writes the night's matrix, the running stack of all the nights
+up to and including it, and the difference between the night and the stack of the
+nights before it (scaled to the same number of detections), so that new chip
+defects stand out. The files are processed in sorted filename order, so name them
+by night (e.g. 01a60123.tsv). The median/MAD statistics of all the matrices are
+written to <outputDir>/heatmap_stats.tsv.
+
+Usage:
+  %s <directory> --outputDir=<outputDir> [--pattern=<pattern>] [--processes=<processes>] [--heatmapresolution=<heatmapresolution>] [--multiplier=<multiplier>] [--chunksize=<chunksize>] [--grid] [--colorbar] [--noplots] [--animation=<animation>] [--rawpng] [--pixelscale=<pixelscale>] [--skipunchanged] [--profile=<profile>] [--cprofile=<cprofile>]
+  %s (-h | --help)
+  %s --version
+
+Options:
+  -h --help                                 Show this screen.
+  --version                                 Show version.
+  --outputDir=<outputDir>                   Directory for the matrices (.npy), plots and statistics.
+  --pattern=<pattern>                       Glob pattern for the nightly detection files [default: *.tsv].
+  --processes=<processes>                   Number of processes to use. Default is the number of CPUs.
+  --heatmapresolution=<heatmapresolution>   Heatmap resolution as a power of 2 between 8 and 512 [default: 128].
+  --multiplier=<multiplier>                 Multiplier for the Median for the colorbar and cuts [default: 1.6].
+  --chunksize=<chunksize>                   Number of detections to read at a time when building a heatmap [default: 1000000].
+  --grid                                    Display a grid.
+  --colorbar                                Display a colour bar.
+  --noplots                                 Only write the matrices and statistics (and the animation, if requested).
+  --animation=<animation>                   Also write an animation of the nightly heatmaps to this file (e.g. nights.gif).
+  --rawpng                                  Write the plots as PNG thumbnails, one pixel per matrix element, without matplotlib (no title, grid or colour bar).
+  --pixelscale=<pixelscale>                 With --rawpng, the number of image pixels per matrix element in each direction [default: 1].
+  --skipunchanged                           Don't do anything if the output files were made from the same nightly files, with the same options. Otherwise still only redraw the plots whose nights (those up to and including their own) have changed.
+  --profile=<profile>                       Report the wall time, CPU time and peak memory of each stage (aggregate, save, draw, animate): to stderr if -, otherwise to this JSON file. The CPU time and memory are the main process's: the workers' work only shows in the wall time.
+  --cprofile=<cprofile>                     Also dump cProfile statistics for the main process to this file.
+
+E.g.:
+  %s /atlas/diff/02a/heatmaps --outputDir=/tmp/heatmaps --pattern='02a*.tsv' --processes=8 --colorbar
+"""
+import sys
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+from docopt import docopt
+import os, glob
+from multiprocessing import Pool
+from gkutils.commonutils import Struct, cleanOptions
+import numpy as n
+from heatMapUtils import HEATMAP_RESOLUTIONS, buildHeatMap, writeMatrixFile, heatMapStatistics, runningStackDifferences
+from rasterImages import heatMapPNG
+from outputCache import OutputCache
+from profiling import profiled, stage
+
+# Options that make no difference to a single night's plot
+NIGHT_IGNORED_OPTIONS = ('pattern', 'processes', 'chunksize', 'noplots', 'animation')
+
+
+def buildNightlyHeatMap(args):
+    """Pool worker: build one night's heatmap. Returns (matrix, nobs)."""
+    filename, resolution, delimiter, chunkSize = args
+    mat = buildHeatMap(filename, resolution = resolution, delimiter = delimiter, chunkSize = chunkSize)
+    return mat['matrix'], len(mat['exps'])
+
+
+# One renderer per plot style in each worker process, reused for every matrix the worker draws
+renderers = {}
+
+
+def plotNightlyHeatMap(args):
+    """Pool worker: render one matrix with a plotATLASHeatMap.HeatMapRenderer."""
+    # Import here so that only the plotting workers pay for matplotlib
+    from plotATLASHeatMap import HeatMapRenderer, setStyle
+    title, matrix, outputFile, style, plotOptions = args
+    if not renderers:
+        setStyle()
+    if style not in renderers:
+        renderers[style] = HeatMapRenderer(heatMapResolution = matrix.shape[0], **dict(style))
+    renderer = renderers[style]
+    # Flip the matrix up/down, because we are in pixel space now and y zero is top left.
+    renderer.update(n.flip(matrix, 0), title, **plotOptions)
+    renderer.save(outputFile)
+
+
+def writeNightlyPNG(args):
+    """Pool worker: write one matrix as a PNG thumbnail with rasterImages.heatMapPNG."""
+    title, matrix, outputFile, style, plotOptions = args
+    plotOptions = dict(plotOptions)
+    plotOptions.pop('median', None)
+    heatMapPNG(outputFile, n.flip(matrix, 0), colorMap = dict(style).get('colorMap'), **plotOptions)
+
+
+def writeStatistics(filename, names, nobs, stats):
+    """Write one row of heatmap statistics per matrix."""
+    columns = ['median', 'mad', 'stddev', 'colorBarSpan', 'maskPercentage']
+    with open(filename, 'w') as f:
+        f.write('\t'.join(['name', 'nobs'] + columns) + '\n')
+        for i, name in enumerate(names):
+            f.write('\t'.join([name, str(nobs[i])] + ['%.3f' % stats[c][i] for c in columns]) + '\n')
+
+
+def nightlyFiles(options):
+    """The nightly detection files, in night order."""
+    return sorted(glob.glob(os.path.join(options.directory, options.pattern)))
+
+
+def batchOutputFiles(options, files):
+    """All the files a run writes for these nightly files."""
+    outputs = [os.path.join(options.outputDir, 'heatmap_stats.tsv')]
+    for i, f in enumerate(files):
+        night = os.path.basename(f).split('.')[0]
+        for name in [night, '%s_stack' % night] + (['%s_diff' % night] if i > 0 else []):
+            outputs.append(os.path.join(options.outputDir, '%s.npy' % name))
+            if not options.noplots:
+                outputs.append(os.path.join(options.outputDir, '%s.png' % name))
+    if options.animation:
+        outputs.append(options.animation)
+    return outputs
+
+
+def unchangedPlots(options, jobs, jobNights, files):
+    """With --skipunchanged, leave out the plots whose nights haven't changed.
+
+    Args:
+        options:
+        jobs: plot jobs, as for plotNightlyHeatMap.
+        jobNights: index of the night of each job. Its plot depends on the files of
+            that night and all the nights before it.
+        files: the nightly files.
+
+    Returns:
+        (jobs still to do, the OutputCache of each of them to record() once it is done)
+    """
+    plotOptions = {k: v for k, v in vars(options).items() if k not in NIGHT_IGNORED_OPTIONS}
+    todo = []
+    caches = []
+    for job, i in zip(jobs, jobNights):
+        cache = OutputCache(files[:i + 1], [job[2]], plotOptions)
+        if not cache.unchanged():
+            todo.append(job)
+            caches.append(cache)
+    print ("%d of %d plots are up to date - skipping them" % (len(jobs) - len(todo), len(jobs)))
+    return todo, caches
+
+
+def doPlots(options):
+    files = nightlyFiles(options)
+    if not files:
+        print ("No files matching %s in %s" % (options.pattern, options.directory))
+        return
+
+    resolution = int(options.heatmapresolution)
+    processes = int(options.processes) if options.processes else None
+    multiplier = float(options.multiplier)
+    os.makedirs(options.outputDir, exist_ok = True)
+
+    nights = [os.path.basename(f).split('.')[0] for f in files]
+
+    with Pool(processes) as pool:
+        with stage('aggregate'):
+            results = pool.map(buildNightlyHeatMap, [(f, resolution, '\t', int(options.chunksize)) for f in files])
+
+            nightly = n.stack([matrix for matrix, nobs in results])
+            nobs = n.array([nobs for matrix, nobs in results])
+            stacks, differences = runningStackDifferences(nightly)
+            stackNobs = n.cumsum(nobs)
+
+            # All the statistics in one go for every night and every stack
+            nightlyStats = heatMapStatistics(nightly, multiplier)
+            stackStats = heatMapStatistics(stacks, multiplier)
+
+        with stage('save'):
+            writeStatistics(os.path.join(options.outputDir, 'heatmap_stats.tsv'),
+                            nights + ['%s_stack' % night for night in nights],
+                            n.concatenate([nobs, stackNobs]),
+                            {k: n.concatenate([nightlyStats[k], stackStats[k]]) for k in nightlyStats})
+
+            for i, night in enumerate(nights):
+                writeMatrixFile(os.path.join(options.outputDir, '%s.npy' % night), nightly[i])
+                writeMatrixFile(os.path.join(options.outputDir, '%s_stack.npy' % night), stacks[i])
+                if i > 0:
+                    writeMatrixFile(os.path.join(options.outputDir, '%s_diff.npy' % night), differences[i])
+
+        # Plot styles are hashable so that the workers can key their renderers on them
+        style = (('showGrid', options.grid), ('showColorBar', options.colorbar))
+        diffStyle = style + (('colorMap', 'RdBu_r'),)
+
+        jobs = []
+        jobNights = []
+        for i, night in enumerate(nights):
+            jobNights += [i, i] + ([i] if i > 0 else [])
+            jobs.append(('%s (nobs = %d)' % (night, nobs[i]), nightly[i], os.path.join(options.outputDir, '%s.png' % night), style,
+                         dict(colorBarSpan = nightlyStats['colorBarSpan'][i], median = nightlyStats['median'][i])))
+            jobs.append(('%s stack (nobs = %d)' % (night, stackNobs[i]), stacks[i], os.path.join(options.outputDir, '%s_stack.png' % night), style,
+                         dict(colorBarSpan = stackStats['colorBarSpan'][i], median = stackStats['median'][i])))
+            if i > 0:
+                # Symmetric diverging colour scale, with the same span relative to the night's median as the night itself
+                span = (multiplier - 1.0) * nightlyStats['median'][i]
+                if span <= 0:
+                    span = max(n.abs(differences[i]).max(), 1.0)
+                jobs.append(('%s - stack' % night, differences[i], os.path.join(options.outputDir, '%s_diff.png' % night), diffStyle,
+                             dict(colorBarSpan = span, colorBarMin = -span)))
+
+        caches = []
+        if options.skipunchanged and not options.noplots:
+            jobs, caches = unchangedPlots(options, jobs, jobNights, files)
+
+        with stage('draw'):
+            if options.noplots:
+                pass
+            elif options.rawpng:
+                pixelScale = int(options.pixelscale)
+                pool.map(writeNightlyPNG, [job[:4] + (dict(job[4], pixelScale = pixelScale),) for job in jobs])
+            else:
+                pool.map(plotNightlyHeatMap, jobs)
+        for cache in caches:
+            cache.record()
+
+    if options.animation:
+        with stage('animate'):
+            from plotATLASHeatMap import HeatMapRenderer, setStyle
+            setStyle()
+            renderer = HeatMapRenderer(heatMapResolution = resolution, **dict(style))
+            frames = [dict(matrix = n.flip(nightly[i], 0), title = '%s (nobs = %d)' % (night, nobs[i]),
+                           colorBarSpan = nightlyStats['colorBarSpan'][i], median = nightlyStats['median'][i]) for i, night in enumerate(nights)]
+            renderer.animate(frames, outputFile = options.animation)
+            renderer.close()
+
+
+def main():
+    opts = docopt(__doc__, version='0.1')
+    opts = cleanOptions(opts)
+    options = Struct(**opts)
+
+    # Checked here, before the workers are started, rather than by every worker
+    if options.heatmapresolution not in [str(r) for r in HEATMAP_RESOLUTIONS]:
+        sys.exit("Heatmap resolution should be 8, 16, 32, 64, 128, 256 or 512")
+
+    files = nightlyFiles(options)
+    cache, upToDate = OutputCache.skip(options, files, batchOutputFiles(options, files))
+    if upToDate:
+        return
+
+    with profiled(options.profile, options.cprofile):
+        doPlots(options)
+    if cache:
+        cache.record()
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""Make many scatter, sky and histogram plots from a manifest, using a pool of processes.
+
+Each worker imports matplotlib and the plot scripts once, and keeps the input files it
+has read in a cache, so jobs that share an input file only parse it once per worker.
+Jobs with the same first input file are sent to the same worker where possible.
+
+The manifest is JSON (or YAML, if PyYAML is installed) with a list of jobs. Each job
+is either the script's command line, or its input files and options, using the
+script's own option names. Options set to true are flags, and options set to false
+or null are left out. Lists are joined with commas. Per command defaults can be
+given, and relative file names are relative to the manifest's directory.
+
+  {"defaults": {"scatter": {"x": "mjd", "y": "mag", "yerror": "magerr", "error": true}},
+   "jobs": [
+     {"command": "scatter", "inputs": ["ATLAS20ymv.csv"], "options": {"outputFile": "ATLAS20ymv.png"}},
+     {"command": "sky", "args": ["positions.txt", "--outfile=sky.png", "--usepatches"]},
+     {"command": "histogram", "inputs": ["discoveries.csv"], "options": {"column": "mag", "groupby": "telescope", "outputFile": "mags.pdf"}}
+   ]}
+
+Usage:
+  %s <manifest> [--processes=<processes>] [--report=<report>] [--cachesize=<cachesize>] [--skipunchanged] [--profile=<profile>] [--cprofile=<cprofile>]
+  %s (-h | --help)
+  %s --version
+
+Options:
+  -h --help                         Show this screen.
+  --version                         Show version.
+  --processes=<processes>           Number of processes to use. Default is the number of CPUs.
+  --report=<report>                 Write the timing and result of each job to this JSON file.
+  --cachesize=<cachesize>           Number of parsed input files each worker keeps [default: 8].
+  --skipunchanged                   Don't make the plots whose output files were made from the same input files, with the same options (as if every job had --skipunchanged).
+  --profile=<profile>               Report the wall time, CPU time and peak memory of each stage (read, draw, report): to stderr if -, otherwise to this JSON file. The CPU time and memory are the main process's: the workers' plots only show in the wall time (each job's own time is in --report).
+  --cprofile=<cprofile>             Also dump cProfile statistics for the main process to this file.
+
+E.g.:
+  %s /tmp/lightcurves.json --processes=8 --report=/tmp/lightcurves_report.json
+"""
+import sys
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+from docopt import docopt
+import os, json, time, math
+from multiprocessing import Pool, cpu_count
+from gkutils.commonutils import Struct, cleanOptions
+from plotRenderer import PLOT_COMMANDS
+from profiling import profiled, stage
+
+# One renderer (and so one input file cache) per worker process
+renderer = None
+
+
+def readManifest(filename):
+    """Read a JSON or YAML manifest."""
+    with open(filename) as f:
+        if os.path.splitext(filename)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                sys.exit("Reading YAML manifests needs PyYAML (pip install pyyaml). Use a JSON manifest instead.")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    # A bare list of jobs is fine too
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    return manifest
+
+
+def jobArgs(job, defaults = None):
+    """The command line arguments for a manifest job."""
+    if 'args' in job:
+        return [str(a) for a in job['args']]
+
+    options = dict((defaults or {}).get(job.get('command'), {}))
+    options.update(job.get('options', {}))
+
+    inputs = job.get('inputs', [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    args = [str(i) for i in inputs]
+
+    for name, value in options.items():
+        if value is True:
+            args.append('--%s' % name)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, (list, tuple)):
+            args.append('--%s=%s' % (name, ','.join(str(v) for v in value)))
+        else:
+            args.append('--%s=%s' % (name, value))
+    return args
+
+
+def firstInput(args, cwd):
+    """The first input file in the arguments, used to send jobs that share it to the same worker."""
+    for arg in args:
+        if not arg.startswith('-'):
+            return os.path.abspath(os.path.join(cwd, arg))
+    return None
+
+
+def makeTasks(jobs, processes):
+    """Group the jobs by their first input file, splitting big groups between the workers."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(firstInput(job['args'], job['cwd']), []).append(job)
+
+    tasks = []
+    for group in groups.values():
+        size = max(1, math.ceil(len(group) / processes))
+        for i in range(0, len(group), size):
+            tasks.append(group[i:i + size])
+
+    # Biggest first, so that a long task isn't left until last
+    tasks.sort(key = len, reverse = True)
+    return tasks
+
+
+def initWorker(cacheSize):
+    global renderer
+    from plotRenderer import PlotRenderer
+    renderer = PlotRenderer(cacheSize = cacheSize)
+
+
+def runJobs(jobs):
+    """Pool worker: make the plots for a list of jobs. Returns a result for each job."""
+    results = []
+    for job in jobs:
+        result = {'index': job['index'], 'command': job['command'], 'output': None, 'status': 'ok', 'error': None, 'pid': os.getpid()}
+        start = time.perf_counter()
+        try:
+            result['output'] = os.path.join(job['cwd'], renderer.plot(job['command'], job['args'], cwd = job['cwd']))
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = '%s: %s' % (type(e).__name__, str(e).strip())
+        result['seconds'] = time.perf_counter() - start
+        results.append(result)
+    return results
+
+
+def doPlots(options):
+    with stage('read'):
+        manifest = readManifest(options.manifest)
+    cwd = os.path.dirname(os.path.abspath(options.manifest))
+    defaults = manifest.get('defaults', {})
+
+    jobs = []
+    for i, job in enumerate(manifest.get('jobs', [])):
+        command = job.get('command')
+        if command not in PLOT_COMMANDS:
+            sys.exit("Job %d: unknown command %s. Use one of: %s" % (i, command, ', '.join(PLOT_COMMANDS)))
+        args = jobArgs(job, defaults)
+        if options.skipunchanged and '--skipunchanged' not in args:
+            args.append('--skipunchanged')
+        jobs.append({'index': i, 'command': command, 'args': args, 'cwd': cwd})
+
+    if not jobs:
+        print ("No jobs in %s" % options.manifest)
+        return []
+
+    processes = int(options.processes) if options.processes else cpu_count()
+    processes = min(processes, len(jobs))
+    tasks = makeTasks(jobs, processes)
+
+    results = []
+    start = time.perf_counter()
+    with stage('draw'), Pool(processes, initializer = initWorker, initargs = (int(options.cachesize),)) as pool:
+        for taskResults in pool.imap_unordered(runJobs, tasks):
+            for result in taskResults:
+                if result['status'] == 'ok':
+                    print ("%4d  ok      %7.2fs  %-9s %s" % (result['index'], result['seconds'], result['command'], result['output']))
+                else:
+                    print ("%4d  FAILED  %7.2fs  %-9s %s" % (result['index'], result['seconds'], result['command'], result['error']))
+            results += taskResults
+    elapsed = time.perf_counter() - start
+
+    results.sort(key = lambda r: r['index'])
+    failures = [r for r in results if r['status'] != 'ok']
+    plotSeconds = sum(r['seconds'] for r in results)
+
+    print ("%d plots in %.2fs with %d processes (%.2fs plotting), %d failed" % (len(results), elapsed, processes, plotSeconds, len(failures)))
+    for r in failures:
+        print ("  job %d (%s): %s" % (r['index'], r['command'], r['error']))
+
+    if options.report:
+        with stage('report'), open(options.report, 'w') as f:
+            json.dump({'manifest': os.path.abspath(options.manifest),
+                       'processes': processes,
+                       'seconds': elapsed,
+                       'jobs': len(results),
+                       'failed': len(failures),
+                       'results': results}, f, indent = 2)
+
+    return results
+
+
+def main():
+    opts = docopt(__doc__, version='0.1')
+    opts = cleanOptions(opts)
+    options = Struct(**opts)
+
+    with profiled(options.profile, options.cprofile):
+        results = doPlots(options)
+    if any(r['status'] != 'ok' for r in results):
+        sys.exit(1)
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Make a plot with a running plot server (plotServer.py), in place of running the script.
+
+The command and its arguments are exactly those of the script, e.g. scatter for
+scatterplot.py and sky for skyplot.py, and the plot is written to the script's usual
+output file.
+
+Usage:
+  %s [--server=<server>] [--fallback] <command> [<args>...]
+  %s (-h | --help)
+  %s --version
+
+Options:
+  -h --help                         Show this screen.
+  --version                         Show version.
+  --server=<server>                 Server address: http://127.0.0.1:<port> or unix:<socket>. Default is $GKPLOT_SERVER, or else http://127.0.0.1:8765.
+  --fallback                        If the server is not running, make the plot here instead.
+
+E.g.:
+  %s --server=unix:/tmp/gkplot.sock scatter ATLAS20ymv_dophot_o.txt --x=mjd --y=mag --outputFile=/tmp/ATLAS20ymv_lc.png
+"""
+import sys
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+from docopt import docopt
+import os, json, socket
+import http.client
+from urllib.parse import urlparse
+
+DEFAULT_SERVER = 'http://127.0.0.1:8765'
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix socket."""
+
+    def __init__(self, socketPath, timeout = 300):
+        super().__init__('localhost', timeout = timeout)
+        self.socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+
+
+def connect(server, timeout = 300):
+    if server.startswith('unix:'):
+        return UnixHTTPConnection(server[len('unix:'):], timeout = timeout)
+    url = urlparse(server)
+    return http.client.HTTPConnection(url.hostname, url.port, timeout = timeout)
+
+
+def requestPlot(server, command, args, cwd = None):
+    """Ask the server for a plot.
+
+    Returns:
+        (image bytes, name of the output file given in args)
+
+    Raises:
+        RuntimeError with the server's message if it could not make the plot, and
+        OSError (e.g. ConnectionRefusedError) if the server is not running.
+    """
+    body = json.dumps({'command': command, 'args': list(args), 'cwd': cwd or os.getcwd()})
+    connection = connect(server)
+    try:
+        connection.request('POST', '/plot', body = body, headers = {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RuntimeError(data.decode('utf-8', errors = 'replace'))
+        return data, response.getheader('X-Gkplot-Output')
+    finally:
+        connection.close()
+
+
+def main():
+    opts = docopt(__doc__, version='0.1', options_first = True)
+    server = opts['--server'] or os.environ.get('GKPLOT_SERVER', DEFAULT_SERVER)
+
+    try:
+        image, outputFile = requestPlot(server, opts['<command>'], opts['<args>'])
+    except OSError as e:
+        if not opts['--fallback']:
+            sys.exit("Cannot reach the plot server at %s: %s" % (server, e))
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from cli import runCommand
+        runCommand(opts['<command>'], opts['<args>'])
+        return
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+    with open(outputFile, 'wb') as f:
+        f.write(image)
+
+
+if __name__=='__main__':
+    main()
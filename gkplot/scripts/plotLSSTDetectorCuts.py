@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""Plot LSST focal plane heatmaps for several cuts from a single read of raw DIASource rows.
+
+Usage:
+  %s <filename> [--cuts=<cuts>] [--detectorcol=<detectorcol>] [--delimiter=<delimiter>] [--outputPrefix=<outputPrefix>] [--cmap=<cmap>] [--annotate] [--chunksize=<chunksize>] [--panels] [--ncols=<ncols>] [--panelnorm] [--subgrid=<subgrid>] [--xcol=<xcol>] [--ycol=<ycol>] [--rawpng] [--pixelsize=<pixelsize>] [--skipunchanged] [--profile=<profile>] [--cprofile=<cprofile>]
+  %s (-h | --help)
+  %s --version
+
+Options:
+  -h --help                         Show this screen.
+  --version                         Show version.
+  --cuts=<cuts>                     Named cuts, separated by semicolons. Each is name:condition&condition... where a condition is column op value and op is one of == != >= <= > <. An empty condition list selects all rows. Default: all:;minus_diaobjectid0:diaObjectId!=0;reliability_gt_99:diaObjectId!=0&reliability>0.99, with minus_singletons:diaObjectId!=0&nDiaSources>1 as well if the file has an nDiaSources column (not looked for in stdin).
+  --detectorcol=<detectorcol>       Column that represents the detector. [default: detector]
+  --delimiter=<delimiter>           Delimiter to use [default: ,].
+  --outputPrefix=<outputPrefix>     Write one heatmap per cut to <outputPrefix>_<cut>.png. If not defined, show the plots.
+  --cmap=<cmap>                     Colour map (matplotlib name or friendly name, e.g. warm). [default: warm]
+  --annotate                        Print the counts inside the detectors.
+  --chunksize=<chunksize>           Number of rows to read at a time. [default: 1000000]
+  --panels                          Draw all the cuts as panels of one figure (written to <outputPrefix>_panels.png).
+  --ncols=<ncols>                   Number of panel columns. Default is a roughly square grid.
+  --panelnorm                       Normalise each panel separately instead of using one colour scale for all panels.
+  --subgrid=<subgrid>               Split each detector into nx,ny cells using the pixel positions, e.g. 8,2 for the 16 amplifiers. Not available with --panels.
+  --xcol=<xcol>                     Column that represents the detector x pixel position (used with --subgrid). [default: x]
+  --ycol=<ycol>                     Column that represents the detector y pixel position (used with --subgrid). [default: y]
+  --rawpng                          Write each cut directly as a PNG thumbnail, without matplotlib (no labels or colour bar). Needs --outputPrefix.
+  --pixelsize=<pixelsize>           With --rawpng, the width of each detector in pixels. [default: 8]
+  --skipunchanged                   Don't make the plot if the output files were made from the same input files, with the same options.
+  --profile=<profile>               Report the wall time, CPU time, peak memory and number of artists of each stage (aggregate, draw, save): to stderr if -, otherwise to this JSON file.
+  --cprofile=<cprofile>             Also dump cProfile statistics for the whole run to this file.
+
+E.g.:
+  %s ~/lasair/lsst/run_20251009/diasources.csv --cuts='all:;minus_singletons:diaObjectId!=0&nDiaSources>1;ddf_only:diaObjectId!=0&field==DDF' --outputPrefix=/tmp/heatmap
+"""
+import sys
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+from docopt import docopt
+from gkutils.commonutils import Struct, cleanOptions
+import numpy as n
+from dataReader import columnNames, STDIN
+from outputCache import OutputCache
+from profiling import profiled, stage
+
+DEFAULT_CUTS = 'all:;minus_diaobjectid0:diaObjectId!=0;reliability_gt_99:diaObjectId!=0&reliability>0.99'
+# Only added to the default cuts if the file has the column
+SINGLETONS_CUT = 'minus_singletons:diaObjectId!=0&nDiaSources>1'
+
+
+def defaultCuts(filename, delimiter):
+    """The cuts to make when none are given: minus_singletons too if the file has an nDiaSources column."""
+    if filename != STDIN and 'nDiaSources' in columnNames(filename, delimiter):
+        return DEFAULT_CUTS + ';' + SINGLETONS_CUT
+    return DEFAULT_CUTS
+
+
+def cutOutputFiles(options):
+    """The files doPlots will write."""
+    from plotLSSTDetectorHeatMap import parse_cuts
+    if not options.outputPrefix:
+        return []
+    if options.panels:
+        return ['%s_panels.png' % options.outputPrefix]
+    return ['%s_%s.png' % (options.outputPrefix, name) for name in parse_cuts(options.cuts)]
+
+
+def doPlots(options):
+    from figures import showFigure
+    from plotLSSTDetectorHeatMap import aggregate_detector_cuts, draw_grid_heatmap, draw_grid_heatmaps, draw_subdetector_heatmap, write_grid_heatmap_png
+
+    subgrid = None
+    if options.subgrid:
+        if options.panels:
+            print ("--subgrid cannot be combined with --panels")
+            return
+        subgrid = tuple(int(x) for x in options.subgrid.split(','))
+
+    if options.rawpng and (subgrid or options.panels or not options.outputPrefix):
+        print ("--rawpng needs --outputPrefix and cannot be combined with --subgrid or --panels")
+        return
+
+    # Reads the file as it goes
+    with stage('aggregate'):
+        counts = aggregate_detector_cuts(options.filename, options.cuts, detector_col = options.detectorcol, delimiter = options.delimiter, chunk_size = int(options.chunksize), subgrid = subgrid, x_col = options.xcol, y_col = options.ycol)
+
+    if options.panels:
+        panels = {'%s (%s)' % (name, format(int(c.sum()), ',')): n.where(c > 0, c, n.nan) for name, c in counts.items()}
+        savePath = None
+        if options.outputPrefix:
+            savePath = '%s_panels.png' % options.outputPrefix
+        ncols = int(options.ncols) if options.ncols else None
+        with stage('draw'):
+            fig, axes = draw_grid_heatmaps(panels, ncols = ncols, cmap = options.cmap, shared_norm = not options.panelnorm, save_path = savePath)
+        if not savePath:
+            showFigure(fig)
+        return
+
+    figs = []
+    for name, detectorCounts in counts.items():
+        # Detectors with no detections are shown as missing, as they would be from a GROUP BY query
+        values = n.where(detectorCounts > 0, detectorCounts, n.nan)
+        savePath = None
+        if options.outputPrefix:
+            savePath = '%s_%s.png' % (options.outputPrefix, name)
+
+        if options.rawpng:
+            with stage('save'):
+                write_grid_heatmap_png(values, savePath, cmap = options.cmap, pixels_per_square = int(options.pixelsize))
+            continue
+
+        with stage('draw'):
+            if subgrid:
+                fig, ax = draw_subdetector_heatmap(detectorCounts, cmap = options.cmap)
+            else:
+                fig, ax = draw_grid_heatmap(values, cmap = options.cmap, annotate_values = options.annotate)
+            ax.set_title('%s (%s)' % (name, format(int(detectorCounts.sum()), ',')))
+        with stage('layout'):
+            fig.tight_layout()
+
+        if savePath:
+            with stage('save', figure = fig):
+                fig.savefig(savePath, dpi=200, bbox_inches="tight")
+        else:
+            figs.append(fig)
+
+    showFigure(*figs)
+
+
+def main():
+    opts = docopt(__doc__, version='0.1')
+    opts = cleanOptions(opts)
+    options = Struct(**opts)
+
+    if options.cuts is None:
+        options.cuts = defaultCuts(options.filename, options.delimiter)
+
+    cache, upToDate = OutputCache.skip(options, options.filename, cutOutputFiles(options))
+    if upToDate:
+        return
+
+    with profiled(options.profile, options.cprofile):
+        doPlots(options)
+    if cache:
+        cache.record()
+
+
+if __name__=='__main__':
+    main()
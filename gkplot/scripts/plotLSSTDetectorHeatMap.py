@@ -1,9 +1,15 @@
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-from matplotlib.patches import Patch
-from matplotlib.colors import Normalize, to_rgb
+import re
+import operator
+import numpy as np
+import matplotlib
+from figures import newSubplots, showFigure
+from profiling import stage
+from matplotlib.colors import Normalize, to_rgba
 import matplotlib.cm as cm
 from gkutils.commonutils import readGenericDataFile
+from lsstFocalPlane import NUM_DETECTORS, get_layout, contrast_colors
+from rasterImages import applyColorMap, writePNG
+from dataReader import readColumnChunks
 
 # ---------- Helpers ----------
 
@@ -25,14 +31,6 @@ def parse_detector_table(raw: str) -> dict[int, float]:
             out[int(toks[0])] = float(toks[1])
     return out
 
-def _contrast_for(facecolor):
-    try:
-        r, g, b = to_rgb(facecolor)
-        L = 0.2126*r + 0.7152*g + 0.0722*b
-        return "black" if L > 0.6 else "white"
-    except Exception:
-        return "black"
-
 # Friendly names for colormaps (use whatever names you prefer)
 FRIENDLY_CMAP = {
     "warm": "inferno",
@@ -46,8 +44,137 @@ FRIENDLY_CMAP = {
 def resolve_cmap(name: str):
     return FRIENDLY_CMAP.get(str(name).lower(), name)
 
+# ---------- Aggregation of raw detections ----------
+
+# LSST science sensors are 4072 × 4000 pixels (ITL; e2v are 4096 × 4004), read out
+# through 16 amplifiers arranged as 8 across by 2 down.
+DETECTOR_SIZE = (4072, 4000)
+AMPLIFIER_GRID = (8, 2)
+
+def aggregate_subdetector_counts(detector, x, y, *, subgrid=AMPLIFIER_GRID,
+                                 detector_size=DETECTOR_SIZE) -> np.ndarray:
+    """
+    Count detections in an nx × ny grid of cells on each detector, e.g. per amplifier.
+    `detector`, `x` and `y` are arrays of detector id and pixel position per detection.
+    Positions off the detector are ignored.
+    Returns: int array of shape (189, ny, nx).
+    """
+    nx, ny = subgrid
+    detector = np.asarray(detector, dtype=int)
+    ix = np.floor(np.asarray(x, dtype=float) / detector_size[0] * nx).astype(int)
+    iy = np.floor(np.asarray(y, dtype=float) / detector_size[1] * ny).astype(int)
+    ok = ((detector >= 0) & (detector < NUM_DETECTORS) &
+          (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny))
+    flat = (detector[ok] * ny + iy[ok]) * nx + ix[ok]
+    return np.bincount(flat, minlength=NUM_DETECTORS * ny * nx).reshape(NUM_DETECTORS, ny, nx)
+
+_CONDITION = re.compile(r"^\s*([^<>=!]+?)\s*(==|!=|>=|<=|>|<)\s*(.+?)\s*$")
+_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+def parse_cuts(spec: str) -> dict[str, list[tuple]]:
+    """
+    Parse named cuts like:
+        "all:;nonzero:diaObjectId!=0;reliable:diaObjectId!=0&reliability>0.99"
+    Cuts are separated by ';', the name by ':' and conditions by '&' (all must hold).
+    An empty condition list selects every row.
+    Returns: {name: [(column, operator, value), ...], ...} in the order given.
+    """
+    cuts = {}
+    for item in spec.split(";"):
+        if not item.strip():
+            continue
+        name, _, expr = item.partition(":")
+        conditions = []
+        for cond in expr.split("&"):
+            if not cond.strip():
+                continue
+            m = _CONDITION.match(cond)
+            if m is None:
+                raise ValueError(f"Cannot parse condition '{cond}' in cut '{name}'")
+            conditions.append(m.groups())
+        cuts[name.strip()] = conditions
+    return cuts
+
+def _float_column(column, col, use="be cut on a number"):
+    """A column as floats, with blank values as NaN (so only != passes them in a cut)."""
+    if column.dtype.kind in 'biuf':
+        return column.astype(float)
+    try:
+        return np.where(column == '', 'nan', column).astype(float)
+    except ValueError:
+        raise ValueError(f"Column {col} has non-numeric values, so it can't {use}")
+
+def _cut_mask(chunk, conditions, as_float):
+    """Vectorized boolean mask of the rows in `chunk` passing all `conditions`."""
+    mask = np.ones(len(next(iter(chunk.values()))), dtype=bool)
+    for col, op, value in conditions:
+        try:
+            value = float(value)
+        except ValueError:
+            # A non-numeric value (e.g. field=WFD) is compared as a string
+            mask &= _OPERATORS[op](chunk[col].astype(str), value)
+            continue
+        if col not in as_float:
+            as_float[col] = _float_column(chunk[col], col)
+        mask &= _OPERATORS[op](as_float[col], value)
+    return mask
+
+def aggregate_detector_cuts(filename, cuts, *, detector_col="detector", delimiter=",",
+                            chunk_size=1000000, subgrid=None, x_col="x", y_col="y",
+                            detector_size=DETECTOR_SIZE) -> dict[str, np.ndarray]:
+    """
+    Stream raw detection rows once and count detections per detector for every cut.
+    `cuts` is the output of parse_cuts (or the spec string itself).
+    If `subgrid` (nx, ny) is given, count per detector sub-cell instead, using the
+    `x_col` and `y_col` pixel positions (see aggregate_subdetector_counts).
+    Returns: {cut name: int array of 189 detector counts (or of shape (189, ny, nx)), ...}
+    """
+    if isinstance(cuts, str):
+        cuts = parse_cuts(cuts)
+
+    columns = [detector_col]
+    if subgrid is not None:
+        columns += [x_col, y_col]
+    for conditions in cuts.values():
+        columns += [col for col, op, value in conditions if col not in columns]
+
+    shape = (NUM_DETECTORS,) if subgrid is None else (NUM_DETECTORS, subgrid[1], subgrid[0])
+    counts = {name: np.zeros(shape, dtype=np.int64) for name in cuts}
+    for chunk in readColumnChunks(filename, columns=columns, delimiter=delimiter, chunkSize=chunk_size):
+        # Rows with a blank detector (or pixel position) are left out
+        detectors = _float_column(chunk[detector_col], detector_col, "be read as detector numbers")
+        valid = np.isfinite(detectors) & (detectors >= 0) & (detectors < NUM_DETECTORS)
+        detectors = np.where(valid, detectors, 0).astype(int)
+        as_float = {}
+        if subgrid is not None:
+            x = _float_column(chunk[x_col], x_col, "be read as pixel positions")
+            y = _float_column(chunk[y_col], y_col, "be read as pixel positions")
+            valid &= np.isfinite(x) & np.isfinite(y)
+        for name, conditions in cuts.items():
+            mask = valid & _cut_mask(chunk, conditions, as_float)
+            if subgrid is None:
+                counts[name] += np.bincount(detectors[mask], minlength=NUM_DETECTORS)
+            else:
+                counts[name] += aggregate_subdetector_counts(detectors[mask], x[mask], y[mask],
+                                                             subgrid=subgrid, detector_size=detector_size)
+    return counts
+
 # ---------- Main drawing routine (heatmap) ----------
 
+def _face_colors(vals, cmap, norm, missing_color):
+    """RGBA face colours for the 189 detectors; NaN values get `missing_color`."""
+    present = ~np.isnan(vals)
+    faces = np.tile(to_rgba(missing_color), (NUM_DETECTORS, 1))
+    faces[present] = cmap(norm(vals[present]))
+    return faces
+
 def draw_grid_heatmap(
     values: dict[int, float],
     *,
@@ -67,106 +194,224 @@ def draw_grid_heatmap(
 ):
     """
     Render the 189 detectors as a heatmap using your 3×3 group layout.
-    `values` maps detector_id -> detection count.
+    `values` maps detector_id -> detection count, or is an array indexed by detector_id
+    (NaN for no value).
     """
-    # --- geometry identical to your previous version ---
-    group_w = 3 * square_size + 2 * intra_gap
-    group_h = 3 * square_size + 2 * intra_gap
-    stride_x = group_w + inter_gap_x
-    stride_y = group_h + inter_gap_y
-    row_groups = [3, 5, 5, 5, 3]
-
-    row_x_positions = []
-    k = row_groups[0]
-    row0 = [(i - (k - 1)/2) * stride_x for i in range(k)]
-    row_x_positions.append(row0)
-
-    for r in [1, 2, 3]:
-        k = row_groups[r]
-        prev_center = sum(row_x_positions[r-1]) / len(row_x_positions[r-1])
-        xs = [prev_center + (i - (k - 1)/2) * stride_x for i in range(k)]
-        row_x_positions.append(xs)
-
-    row4 = [row_x_positions[3][1], row_x_positions[3][2], row_x_positions[3][3]]
-    row_x_positions.append(row4)
-
-    row_y_positions = [r * stride_y for r in range(len(row_groups))]
+    layout = get_layout(square_size, intra_gap, inter_gap_x, inter_gap_y)
+    vals = layout.values_array(values)
+    present = ~np.isnan(vals)
 
     # --- heatmap setup ---
-    cmap = cm.get_cmap(resolve_cmap(cmap))
-    present_vals = list(values.values()) if values else []
-    if vmin is None: vmin = min(present_vals) if present_vals else 0.0
-    if vmax is None: vmax = max(present_vals) if present_vals else 1.0
+    cmap = matplotlib.colormaps[resolve_cmap(cmap)]
+    if vmin is None: vmin = vals[present].min() if present.any() else 0.0
+    if vmax is None: vmax = vals[present].max() if present.any() else 1.0
     norm = Normalize(vmin=vmin, vmax=vmax, clip=True)
 
-    fig, ax = plt.subplots(figsize=(9, 11))
-    group_idx = 0
-    total = 0
+    faces = _face_colors(vals, cmap, norm, missing_color)
 
-    for y_center, xs in zip(row_y_positions, row_x_positions):
-        for x_center in xs:
-            base = 9 * group_idx
-            group_idx += 1
+    fig, ax = newSubplots(figsize=(9, 11))
+    ax.add_collection(layout.collection(faces))
 
-            gx0 = x_center - group_w/2
-            gy0 = y_center - group_h/2
+    # choose label text
+    if annotate_values or show_detector_ids:
+        counts = [f"{int(v)}" if ok else "–" for v, ok in zip(vals, present)]
+        if annotate_values and show_detector_ids:
+            texts = [f"{det_id}\n{c}" for det_id, c in enumerate(counts)]
+        elif annotate_values:
+            texts = counts
+        else:
+            texts = [f"{det_id}" for det_id in range(NUM_DETECTORS)]
+        layout.label(ax, texts, contrast_colors(faces), label_fs)
 
-            for iy in range(3):
-                for ix in range(3):
-                    det_id = base + iy*3 + ix  # 0..188 with your pattern
+    total = NUM_DETECTORS
 
-                    x = gx0 + ix*(square_size + intra_gap)
-                    y = gy0 + iy*(square_size + intra_gap)
+    # Frame and colorbar
+    layout.set_limits(ax)
 
-                    if det_id in values:
-                        face = cmap(norm(values[det_id]))
-                    else:
-                        face = missing_color
+    if show_colorbar and present.any():
+        sm = cm.ScalarMappable(norm=norm, cmap=cmap)
+        cbar = fig.colorbar(sm, ax=ax, fraction=0.030, pad=0.02)
+        cbar.set_label("Detections")
 
-                    rect = Rectangle((x, y), square_size, square_size,
-                                     edgecolor="black", facecolor=face, linewidth=1.0)
-                    ax.add_patch(rect)
+    if save_path:
+        with stage("save", figure=fig):
+            fig.savefig(save_path, dpi=200, bbox_inches="tight")
 
-                    # choose label text
-                    txt = None
-                    if annotate_values and show_detector_ids:
-                        txt = f"{det_id}\n{int(values[det_id]) if det_id in values else '–'}"
-                    elif annotate_values:
-                        txt = f"{int(values[det_id])}" if det_id in values else "–"
-                    elif show_detector_ids:
-                        txt = f"{det_id}"
+    print(f"Drawn {total} squares (0..188). vmin={vmin}, vmax={vmax}")
+    return fig, ax
 
-                    if txt is not None:
-                        ax.text(x + square_size/2, y + square_size/2, txt,
-                                ha="center", va="center", fontsize=label_fs,
-                                color=_contrast_for(face))
+def draw_grid_heatmaps(
+    panels,
+    *,
+    titles=None,
+    ncols=None,
+    panel_size=(3.0, 3.4),
+    square_size=1.0,
+    intra_gap=0.12,
+    inter_gap_x=0.6,
+    inter_gap_y=0.6,
+    cmap="viridis",
+    vmin=None,
+    vmax=None,
+    shared_norm=True,
+    show_colorbar=True,
+    show_detector_ids=False,
+    label_fs=3.0,
+    linewidth=0.3,
+    missing_color="#eeeeee",
+    save_path=None,
+):
+    """
+    Render several focal plane heatmaps as small multiples in one figure.
+    `panels` is a dict {title: values} or a list of values, where each values is
+    anything draw_grid_heatmap accepts. All panels share one precomputed detector
+    geometry; only the face colours differ from panel to panel.
+    With `shared_norm` every panel (and the single colorbar) uses the same colour
+    scale, otherwise each panel is normalised separately and gets its own colorbar.
+    """
+    if isinstance(panels, dict):
+        if titles is None:
+            titles = list(panels.keys())
+        panels = list(panels.values())
+    if titles is None:
+        titles = [None] * len(panels)
+
+    layout = get_layout(square_size, intra_gap, inter_gap_x, inter_gap_y)
+    vals = np.vstack([layout.values_array(v) for v in panels]) if panels else np.empty((0, NUM_DETECTORS))
+    present = ~np.isnan(vals)
+
+    cmap = matplotlib.colormaps[resolve_cmap(cmap)]
+
+    def make_norm(v, ok):
+        lo = vmin if vmin is not None else (v[ok].min() if ok.any() else 0.0)
+        hi = vmax if vmax is not None else (v[ok].max() if ok.any() else 1.0)
+        return Normalize(vmin=lo, vmax=hi, clip=True)
+
+    if shared_norm:
+        norms = [make_norm(vals, present)] * len(vals)
+    else:
+        norms = [make_norm(v, ok) for v, ok in zip(vals, present)]
+
+    npanels = len(vals)
+    if ncols is None:
+        ncols = max(1, int(np.ceil(np.sqrt(npanels))))
+    nrows = max(1, int(np.ceil(npanels / ncols)))
+
+    fig, axes = newSubplots(nrows, ncols, figsize=(panel_size[0] * ncols, panel_size[1] * nrows), squeeze=False)
+    axes = axes.ravel()
+
+    for ax, v, norm, title in zip(axes, vals, norms, titles):
+        faces = _face_colors(v, cmap, norm, missing_color)
+        ax.add_collection(layout.collection(faces, linewidth=linewidth))
+        if show_detector_ids:
+            layout.label(ax, [f"{det_id}" for det_id in range(NUM_DETECTORS)], contrast_colors(faces), label_fs)
+        layout.set_limits(ax)
+        if title is not None:
+            ax.set_title(title, fontsize=8)
+        if show_colorbar and not shared_norm:
+            fig.colorbar(cm.ScalarMappable(norm=norm, cmap=cmap), ax=ax, fraction=0.040, pad=0.02)
+
+    # Switch off any unused panels
+    for ax in axes[npanels:]:
+        ax.axis("off")
+
+    if show_colorbar and shared_norm and npanels:
+        sm = cm.ScalarMappable(norm=norms[0], cmap=cmap)
+        cbar = fig.colorbar(sm, ax=axes.tolist(), fraction=0.030, pad=0.02)
+        cbar.set_label("Detections")
 
-                    total += 1
+    if save_path:
+        with stage("save", figure=fig):
+            fig.savefig(save_path, dpi=200, bbox_inches="tight")
 
-    # Frame and colorbar
-    ax.set_aspect("equal", adjustable="box")
-    ax.axis("off")
+    print(f"Drawn {npanels} focal plane panels ({nrows}x{ncols}).")
+    return fig, axes[:npanels]
 
-    if show_colorbar and present_vals:
-        sm = cm.ScalarMappable(norm=norm, cmap=cmap)
-        cbar = fig.colorbar(sm, ax=ax, fraction=0.030, pad=0.02)
-        cbar.set_label("Detections")
+def draw_subdetector_heatmap(
+    cells,
+    *,
+    square_size=1.0,
+    intra_gap=0.12,
+    inter_gap_x=0.6,
+    inter_gap_y=0.6,
+    cmap="viridis",
+    vmin=None,
+    vmax=None,
+    show_colorbar=True,
+    show_outlines=True,
+    save_path=None,
+):
+    """
+    Render the focal plane with every detector subdivided into cells (e.g. amplifiers).
+    `cells` is an array of shape (189, ny, nx) as returned by aggregate_subdetector_counts,
+    with row 0 at the bottom of the detector; NaN cells are left blank.
+    All the cells are drawn as one QuadMesh, so thousands of cells cost about the same as one.
+    """
+    cells = np.asarray(cells, dtype=float)
+    ny, nx = cells.shape[1:]
+    layout = get_layout(square_size, intra_gap, inter_gap_x, inter_gap_y)
+    X, Y, index, shape = layout.mesh(nx, ny)
+
+    grid = np.full(shape, np.nan)
+    grid[index] = cells
+    grid = np.ma.masked_invalid(grid)
+
+    cmap = matplotlib.colormaps[resolve_cmap(cmap)]
+    if vmin is None: vmin = grid.min() if grid.count() else 0.0
+    if vmax is None: vmax = grid.max() if grid.count() else 1.0
+    norm = Normalize(vmin=vmin, vmax=vmax, clip=True)
 
-    # margins
-    pad = square_size
-    xmin = min(min(xs) for xs in row_x_positions) - (group_w/2 + pad)
-    xmax = max(max(xs) for xs in row_x_positions) + (group_w/2 + pad)
-    ymin = - (group_h/2 + pad)
-    ymax = row_y_positions[-1] + group_h/2 + pad
-    ax.set_xlim(xmin, xmax)
-    ax.set_ylim(ymin, ymax)
+    fig, ax = newSubplots(figsize=(9, 11))
+    mesh = ax.pcolormesh(X, Y, grid, cmap=cmap, norm=norm)
+    if show_outlines:
+        ax.add_collection(layout.collection("none", linewidth=0.5))
+    layout.set_limits(ax)
+
+    if show_colorbar:
+        cbar = fig.colorbar(mesh, ax=ax, fraction=0.030, pad=0.02)
+        cbar.set_label("Detections")
 
     if save_path:
-        fig.savefig(save_path, dpi=200, bbox_inches="tight")
+        with stage("save", figure=fig):
+            fig.savefig(save_path, dpi=200, bbox_inches="tight")
 
-    print(f"Drawn {total} squares (0..188). vmin={vmin}, vmax={vmax}")
+    print(f"Drawn {cells.size} cells ({nx}x{ny} per detector). vmin={vmin}, vmax={vmax}")
     return fig, ax
 
+def write_grid_heatmap_png(
+    values,
+    save_path,
+    *,
+    square_size=1.0,
+    intra_gap=0.12,
+    inter_gap_x=0.6,
+    inter_gap_y=0.6,
+    cmap="viridis",
+    vmin=None,
+    vmax=None,
+    pixels_per_square=8,
+    missing_color="#eeeeee",
+    background_color="white",
+):
+    """
+    Write the detector heatmap straight to a PNG thumbnail, without a matplotlib figure.
+    Colours are the same as draw_grid_heatmap's; there are no labels, outlines or colorbar.
+    Each detector is pixels_per_square pixels across.
+    """
+    layout = get_layout(square_size, intra_gap, inter_gap_x, inter_gap_y)
+    vals = layout.values_array(values)
+    present = ~np.isnan(vals)
+
+    if vmin is None: vmin = vals[present].min() if present.any() else 0.0
+    if vmax is None: vmax = vals[present].max() if present.any() else 1.0
+
+    to_rgb = lambda c: (np.array(to_rgba(c)[:3]) * 255).round().astype(np.uint8)
+    colors = applyColorMap(vals[None, :], vmin, vmax, colorMap=resolve_cmap(cmap),
+                           missingColor=to_rgb(missing_color))[0]
+    # One extra colour for the gaps, which the pixel index marks with -1
+    colors = np.vstack([colors, to_rgb(background_color)])
+    writePNG(save_path, colors[layout.pixel_index(pixels_per_square)])
+
 # ---------- Example usage ----------
 if __name__ == "__main__":
     # Paste your two-column table here (detector | number)
@@ -369,13 +614,13 @@ if __name__ == "__main__":
         show_detector_ids=True, # show detector ids (0..188)
         save_path="detector_heatmap.png",
     )
-#    plt.title("All Detections (463,396)")
-#    plt.title("All Detections minus diaObjectId = 0 (419,462)")
-#    plt.title("All Detections minus diaObjectId = 0 and minus all singletons (62,424)")
-#    plt.title("All Detections minus diaObjectId = 0 and minus all singletons and reliability > 0.99 (2,709)")
-#    plt.title("All Detections minus diaObjectId = 0 and reliability > 0.99 (35,240)")
-#    plt.title("All Detections minus diaObjectId = 0 DDF only (175,410)")
-    plt.title("All Detections minus diaObjectId = 0 Ecliptic only (244,052)")
-    plt.tight_layout()
-    plt.show()
+#    ax.set_title("All Detections (463,396)")
+#    ax.set_title("All Detections minus diaObjectId = 0 (419,462)")
+#    ax.set_title("All Detections minus diaObjectId = 0 and minus all singletons (62,424)")
+#    ax.set_title("All Detections minus diaObjectId = 0 and minus all singletons and reliability > 0.99 (2,709)")
+#    ax.set_title("All Detections minus diaObjectId = 0 and reliability > 0.99 (35,240)")
+#    ax.set_title("All Detections minus diaObjectId = 0 DDF only (175,410)")
+    ax.set_title("All Detections minus diaObjectId = 0 Ecliptic only (244,052)")
+    fig.tight_layout()
+    showFigure(fig)
 
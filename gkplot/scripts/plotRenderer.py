@@ -0,0 +1,132 @@
+"""Make plots with the plot scripts from inside one long running process.
+
+The plot server and the batch runner both import matplotlib and the plot scripts
+once and then make many plots, each described by the script's own command line
+arguments. PlotRenderer does that, reading the input files through a CachedReader
+so that a file shared by several plots is only parsed once.
+"""
+import sys
+import os, io, time, importlib, contextlib
+from docopt import docopt, DocoptExit
+from gkutils.commonutils import Struct, cleanOptions
+from readerCache import CachedReader
+from outputCache import OutputCache, outputFiles
+
+# command -> (script module, name of its input files argument, name of its output file
+# option). The scripts must have a doPlots(options, reader = ...) function.
+PLOT_COMMANDS = {
+    'scatter':   ('scatterplot', 'inputFile', 'outputFile'),
+    'sky':       ('skyplot', 'filename', 'outfile'),
+    'histogram': ('histogramplot', 'inputFile', 'outputFile'),
+}
+
+
+class PlotError(Exception):
+    """A bad plot request, e.g. invalid options."""
+    pass
+
+
+class PlotRenderer:
+    """Holds the imported plot scripts, their matplotlib styles and the input file cache."""
+
+    def __init__(self, cacheSize = 32):
+        """__init__.
+
+        Args:
+            cacheSize: number of parsed input files to keep.
+        """
+        import matplotlib
+        matplotlib.use('Agg')
+        self.matplotlib = matplotlib
+        self.reader = CachedReader(maxsize = cacheSize)
+        self.plots = 0
+        self.started = time.time()
+
+        # Each script sets its own rc style with its setStyle(), so set them one at a
+        # time from the default style and remember what each one changed.
+        self.modules = {}
+        self.styles = {}
+        argv0 = sys.argv[0]
+        for command, (moduleName, inputArgument, outputOption) in PLOT_COMMANDS.items():
+            matplotlib.rc_file_defaults()
+            defaults = dict(matplotlib.rcParams)
+            sys.argv[0] = moduleName + '.py'
+            self.modules[command] = importlib.import_module(moduleName)
+            if hasattr(self.modules[command], 'setStyle'):
+                self.modules[command].setStyle()
+            self.styles[command] = {k: v for k, v in matplotlib.rcParams.items() if v != defaults[k]}
+        sys.argv[0] = argv0
+        matplotlib.rc_file_defaults()
+
+    def outputOption(self, command):
+        return PLOT_COMMANDS[command][2]
+
+    def parseOptions(self, command, args):
+        """Parse a script's command line arguments into its options, as its main() would."""
+        if command not in PLOT_COMMANDS:
+            raise PlotError("Unknown command %s. Use one of: %s" % (command, ', '.join(PLOT_COMMANDS)))
+        module = self.modules[command]
+
+        try:
+            opts = docopt(module.__doc__, argv = list(args), help = False)
+        except DocoptExit as e:
+            raise PlotError(str(e))
+        if opts['--help'] or opts['--version']:
+            raise PlotError(module.__doc__)
+        return Struct(**cleanOptions(opts))
+
+    def outputFile(self, command, args, cwd = None):
+        """The absolute path of the output file in the arguments, or None if there isn't one."""
+        outputFile = getattr(self.parseOptions(command, args), self.outputOption(command))
+        if outputFile:
+            outputFile = os.path.join(cwd or os.getcwd(), outputFile)
+        return outputFile
+
+    def plot(self, command, args, cwd = None, outputFile = None):
+        """Make one plot.
+
+        Args:
+            command: one of PLOT_COMMANDS.
+            args: the script's command line arguments, which must include an output file.
+            cwd: directory that relative file names are relative to.
+            outputFile: write the plot here instead of to the output file in args. If not
+                set, --skipunchanged in args is honoured.
+
+        Returns:
+            The name of the file written.
+        """
+        options = self.parseOptions(command, args)
+        outputOption = self.outputOption(command)
+        if outputFile:
+            setattr(options, outputOption, outputFile)
+        if not getattr(options, outputOption) and not getattr(options, 'outputs', None):
+            raise PlotError("Plots can only be made to files: specify --%s" % outputOption)
+
+        previousDir = os.getcwd()
+        try:
+            if cwd:
+                os.chdir(cwd)
+
+            cache = None
+            if getattr(options, 'skipunchanged', False) and not outputFile:
+                cache = OutputCache(getattr(options, PLOT_COMMANDS[command][1]), outputFiles(getattr(options, outputOption), getattr(options, 'outputs', None)), options)
+                if cache.unchanged():
+                    return getattr(options, outputOption)
+
+            # The scripts are chatty - keep their output out of the log
+            with self.matplotlib.rc_context(self.styles[command]), contextlib.redirect_stdout(io.StringIO()):
+                self.modules[command].doPlots(options, reader = self.reader)
+            from figures import waitForOutputs
+            waitForOutputs()
+            if cache:
+                cache.record()
+        finally:
+            os.chdir(previousDir)
+
+        self.plots += 1
+        return getattr(options, outputOption)
+
+    def status(self):
+        return {'plots': self.plots,
+                'uptime': time.time() - self.started,
+                'cache': self.reader.cacheInfo()._asdict()}
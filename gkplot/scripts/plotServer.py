@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""Resident plot server: make scatterplot, skyplot and histogramplot plots without paying for start up each time.
+
+The server imports matplotlib and the plot scripts once, keeps recently parsed input
+files in an LRU cache (and the sky plot's galactic and ecliptic curves, which are only
+worked out once), and renders plots on request. Requests take exactly the same options
+as the scripts themselves; send them with plotClient.py.
+
+Plots are rendered one at a time (matplotlib is not thread safe). The server listens on
+localhost only, or on a Unix socket.
+
+Protocol (HTTP):
+  POST /plot    JSON body {"command": "scatter", "args": [...], "cwd": "/current/dir"}.
+                Returns the image, with the requested output file name in the
+                X-Gkplot-Output header, or a 400 (usage) or 500 (error) with a message.
+  GET /status   JSON with the number of plots made and the cache statistics.
+
+Usage:
+  %s [--port=<port>] [--socket=<socket>] [--cachesize=<cachesize>]
+  %s (-h | --help)
+  %s --version
+
+Options:
+  -h --help                         Show this screen.
+  --version                         Show version.
+  --port=<port>                     Port to listen on, on localhost [default: 8765].
+  --socket=<socket>                 Listen on this Unix socket instead of a port.
+  --cachesize=<cachesize>           Number of parsed input files to keep [default: 32].
+
+E.g.:
+  %s --socket=/tmp/gkplot.sock
+"""
+import sys
+__doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
+from docopt import docopt
+import os, json, time, tempfile, mimetypes, traceback, socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from gkutils.commonutils import Struct, cleanOptions
+from plotRenderer import PlotRenderer, PlotError
+
+DEFAULT_PORT = 8765
+
+def renderImage(renderer, command, args, cwd = None):
+    """Make a plot, and return it rather than writing it to its output file.
+
+    Returns:
+        (image bytes, absolute path of the requested output file)
+    """
+    # Render to a temporary file of the same type, and hand back its contents
+    outputFile = renderer.outputFile(command, args, cwd = cwd)
+    if not outputFile:
+        raise PlotError("The server can only make plots to files: specify --%s" % renderer.outputOption(command))
+
+    fd, tempFile = tempfile.mkstemp(suffix = os.path.splitext(outputFile)[1])
+    os.close(fd)
+    try:
+        renderer.plot(command, args, cwd = cwd, outputFile = tempFile)
+        with open(tempFile, 'rb') as f:
+            image = f.read()
+    finally:
+        os.remove(tempFile)
+
+    return image, outputFile
+
+
+class PlotRequestHandler(BaseHTTPRequestHandler):
+    renderer = None
+
+    def sendResponse(self, code, body, contentType = 'text/plain; charset=utf-8', headers = None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.sendResponse(404, "Not found")
+            return
+        self.sendResponse(200, json.dumps(self.renderer.status()), 'application/json')
+
+    def do_POST(self):
+        if self.path != '/plot':
+            self.sendResponse(404, "Not found")
+            return
+
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            image, outputFile = renderImage(self.renderer, request['command'], request.get('args', []), cwd = request.get('cwd'))
+        except (PlotError, ValueError, KeyError) as e:
+            self.sendResponse(400, str(e))
+            return
+        except Exception:
+            self.sendResponse(500, traceback.format_exc())
+            return
+
+        contentType = mimetypes.guess_type(outputFile)[0] or 'application/octet-stream'
+        self.sendResponse(200, image, contentType, {'X-Gkplot-Output': outputFile,
+                                                    'X-Gkplot-Seconds': '%.3f' % (time.perf_counter() - start)})
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    """HTTPServer on a Unix socket."""
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        request, clientAddress = super().get_request()
+        return request, ('unix', 0)
+
+
+def serve(port = DEFAULT_PORT, socketPath = None, cacheSize = 32):
+    PlotRequestHandler.renderer = PlotRenderer(cacheSize = cacheSize)
+
+    if socketPath:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server = UnixHTTPServer(socketPath, PlotRequestHandler)
+        print ("Plot server listening on %s" % socketPath)
+    else:
+        server = HTTPServer(('127.0.0.1', port), PlotRequestHandler)
+        print ("Plot server listening on http://127.0.0.1:%d" % port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socketPath and os.path.exists(socketPath):
+            os.remove(socketPath)
+
+
+def main():
+    opts = docopt(__doc__, version='0.1')
+    opts = cleanOptions(opts)
+    options = Struct(**opts)
+
+    serve(port = int(options.port), socketPath = options.socket, cacheSize = int(options.cachesize))
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Where does the time go? Wall time, CPU time, memory and artist counts for each stage of a plot.
+
+The scripts mark their stages (read, parse, filter, aggregate, draw, save...) with
+
+    with stage('read'):
+        rows = readGenericDataFile(filename)
+
+which costs next to nothing unless profiling has been switched on for the run, with
+--profile in the scripts:
+
+    with profiled('-', cprofileFile = '/tmp/run.prof'):
+        doPlots(options)
+
+Stages can be nested: the wall and CPU times of a stage include those of the stages
+inside it, and its self time doesn't. A stage that runs more than once (e.g. read,
+for several input files) is reported once, with its totals. Peak RSS is the peak of the whole
+process so far, at the end of the stage; its growth in a stage shows which stage
+needed the memory. Set stage.figure to also report how many artists the figure had
+at the end of the stage.
+"""
+import sys, time, json
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:
+    # Not on Windows
+    resource = None
+
+_profiler = None
+
+
+def peakRSS():
+    """Peak resident set size of this process in bytes, or None if it can't be found."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def formatSize(size):
+    """A file size in bytes, kB, MB or GB."""
+    if size < 1000:
+        return '%d bytes' % size
+    for unit in ('kB', 'MB', 'GB'):
+        size /= 1000.0
+        if size < 1000.0 or unit == 'GB':
+            return '%.1f %s' % (size, unit)
+
+
+def countArtists(fig):
+    return len(fig.findobj())
+
+
+class Profiler:
+    """The stage records of one run."""
+
+    def __init__(self):
+        self.stages = {}
+        # Wall and CPU time of the finished stages inside each running stage
+        self.running = []
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.startRSS = peakRSS()
+
+    def start(self, name):
+        # Stages are listed in the order they first started
+        if name not in self.stages:
+            self.stages[name] = {'stage': name, 'depth': len(self.running), 'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'self': 0.0, 'peakRSS': None, 'rssGrowth': 0, 'artists': None}
+        self.running.append([0.0, 0.0])
+
+    def add(self, name, wall, cpu, selfWall, rss, rssGrowth, artists):
+        record = self.stages[name]
+        record['calls'] += 1
+        record['wall'] += wall
+        record['cpu'] += cpu
+        record['self'] += selfWall
+        record['peakRSS'] = rss
+        if rssGrowth is not None:
+            record['rssGrowth'] += rssGrowth
+        if artists is not None:
+            record['artists'] = artists
+
+    def results(self):
+        return {'stages': list(self.stages.values()),
+                'total': {'wall': time.perf_counter() - self.wall,
+                          'cpu': time.process_time() - self.cpu,
+                          'peakRSS': peakRSS()}}
+
+    def report(self, stream = sys.stderr):
+        results = self.results()
+        mb = lambda b: '%.1f' % (b / 1e6) if b is not None else '-'
+        print ("%-22s %6s %10s %10s %10s %14s %12s %9s" % ('stage', 'calls', 'wall (s)', 'self (s)', 'cpu (s)', 'peak RSS (MB)', 'growth (MB)', 'artists'), file = stream)
+        for s in results['stages']:
+            print ("%-22s %6d %10.3f %10.3f %10.3f %14s %12s %9s" % ('  ' * s['depth'] + s['stage'], s['calls'], s['wall'], s['self'], s['cpu'], mb(s['peakRSS']), mb(s['rssGrowth']), s['artists'] if s['artists'] is not None else '-'), file = stream)
+        total = results['total']
+        print ("%-22s %6s %10.3f %10s %10.3f %14s" % ('total', '', total['wall'], '', total['cpu'], mb(total['peakRSS'])), file = stream)
+
+
+class stage:
+    """Context manager that records a stage, if profiling is on."""
+
+    __slots__ = ('name', 'figure', 'profiler', 'wall', 'cpu', 'rss')
+
+    def __init__(self, name, figure = None):
+        self.name = name
+        self.figure = figure
+
+    def __enter__(self):
+        self.profiler = _profiler
+        if self.profiler is not None:
+            self.profiler.start(self.name)
+            self.rss = peakRSS()
+            self.cpu = time.process_time()
+            self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler = self.profiler
+        if profiler is None:
+            return False
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        rss = peakRSS()
+        childWall, childCpu = profiler.running.pop()
+        if profiler.running:
+            profiler.running[-1][0] += wall
+            profiler.running[-1][1] += cpu
+        profiler.add(self.name, wall, cpu, wall - childWall, rss, rss - self.rss if rss is not None else None,
+                     countArtists(self.figure) if self.figure is not None else None)
+        return False
+
+
+@contextmanager
+def profiled(output = None, cprofileFile = None):
+    """Profile the stages run inside this block.
+
+    Args:
+        output: '-' to print the stage table to stderr, or a JSON file name. If None
+            (and no cprofileFile), nothing is profiled.
+        cprofileFile: also run cProfile over the whole block and dump its statistics here
+            (read them with pstats or snakeviz).
+    """
+    global _profiler
+    if output is None and cprofileFile is None:
+        yield None
+        return
+
+    profiler = _profiler = Profiler()
+    cprofiler = None
+    if cprofileFile:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+    try:
+        yield profiler
+    finally:
+        if cprofiler is not None:
+            cprofiler.disable()
+            cprofiler.dump_stats(cprofileFile)
+        _profiler = None
+        if output == '-':
+            profiler.report()
+        elif output:
+            with open(output, 'w') as f:
+                json.dump(profiler.results(), f, indent = 2)
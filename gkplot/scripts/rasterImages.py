@@ -0,0 +1,113 @@
+"""Write heatmaps straight to PNG files, without building a matplotlib figure.
+
+Going through imshow and savefig is the right thing for a plot someone will look
+at, but it is slow for the thousands of small thumbnails a dashboard needs. Here
+the colour map is applied with a NumPy lookup table, using the same normalisation
+and clipping as matplotlib (so a pixel has exactly the colour imshow would give it),
+and the image is written with a minimal PNG encoder (zlib + struct). There are no
+titles, axes or colour bars - one matrix element becomes one (or pixelScale x
+pixelScale) image pixel.
+"""
+import struct
+import zlib
+from functools import lru_cache
+import numpy as n
+
+
+@lru_cache(maxsize=None)
+def colorMapLUT(colorMap = None):
+    """The colour map as an (N, 4) uint8 RGBA lookup table.
+
+    Args:
+        colorMap: matplotlib colour map name (default viridis).
+    """
+    # Only the colour map registry is needed, not pyplot
+    from matplotlib import colormaps
+    cmap = colormaps[colorMap or 'viridis']
+    lut = cmap(n.arange(cmap.N), bytes = True)
+    lut.flags.writeable = False
+    return lut
+
+
+def applyColorMap(matrix, vmin, vmax, colorMap = None, overColor = None, missingColor = (255, 255, 255)):
+    """Map a matrix to an RGB image exactly as matplotlib's Normalize + Colormap would.
+
+    Args:
+        matrix: 2D array of values.
+        vmin: value at the bottom of the colour map. Lower values get the first colour.
+        vmax: value at the top of the colour map. Higher values get the last colour, or overColor.
+        colorMap: matplotlib colour map name (default viridis).
+        overColor: RGB colour for values above vmax (e.g. (0, 0, 0) to mask them), or None.
+        missingColor: RGB colour for NaN values.
+
+    Returns:
+        (rows, cols, 3) uint8 array.
+    """
+    lut = colorMapLUT(colorMap)
+    ncolors = len(lut)
+    matrix = n.asarray(matrix, dtype = float)
+
+    if vmax > vmin:
+        x = (matrix - vmin) * (1.0 / (vmax - vmin))
+    else:
+        x = n.zeros_like(matrix)
+
+    missing = n.isnan(x)
+    # x == 1 falls in the last colour, just as in matplotlib
+    index = n.clip(n.floor(n.nan_to_num(x) * ncolors), 0, ncolors - 1).astype(n.intp)
+    image = lut[index, :3]
+
+    if overColor is not None:
+        image[x > 1.0] = overColor
+    image[missing] = missingColor
+    return image
+
+
+def scaleImage(image, pixelScale):
+    """Enlarge an image by repeating each pixel pixelScale times in each direction."""
+    if pixelScale == 1:
+        return image
+    return n.repeat(n.repeat(image, pixelScale, axis = 0), pixelScale, axis = 1)
+
+
+def _pngChunk(chunkType, data):
+    return struct.pack('>I', len(data)) + chunkType + data + struct.pack('>I', zlib.crc32(chunkType + data) & 0xffffffff)
+
+
+def writePNG(filename, image, compression = 6):
+    """Write an 8 bit RGB or RGBA image to a PNG file.
+
+    Args:
+        filename:
+        image: (rows, cols, 3 or 4) uint8 array. Row 0 is the top of the image.
+        compression: zlib compression level.
+    """
+    image = n.ascontiguousarray(image, dtype = n.uint8)
+    height, width, channels = image.shape
+    colorType = {3: 2, 4: 6}[channels]
+
+    # Each row is preceded by its filter type, which is always 0 (none)
+    raw = n.zeros((height, width * channels + 1), dtype = n.uint8)
+    raw[:, 1:] = image.reshape(height, -1)
+
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_pngChunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, colorType, 0, 0, 0)))
+        f.write(_pngChunk(b'IDAT', zlib.compress(raw.tobytes(), compression)))
+        f.write(_pngChunk(b'IEND', b''))
+
+
+def heatMapPNG(filename, matrix, colorBarSpan, colorBarMin = 0.0, colorMap = None, showMask = False, pixelScale = 1):
+    """Write an ATLAS heatmap as a PNG, with the same colour scaling as plotATLASHeatMap.plotHeatMap.
+
+    Args:
+        filename:
+        matrix: the matrix, already flipped so that row 0 is the top of the detector.
+        colorBarSpan: upper limit of the colour scale (e.g. multiplier x median).
+        colorBarMin: lower limit of the colour scale.
+        colorMap: matplotlib colour map name (default viridis).
+        showMask: show pixels above colorBarSpan in black.
+        pixelScale: image pixels per matrix element in each direction.
+    """
+    image = applyColorMap(matrix, colorBarMin, colorBarSpan, colorMap = colorMap, overColor = (0, 0, 0) if showMask else None)
+    writePNG(filename, scaleImage(image, pixelScale))
@@ -0,0 +1,47 @@
+"""An LRU cache of parsed input files, for long running plot processes.
+
+The plot scripts take a reader function (dataReader.readDataFile by default) in their
+doPlots(options, reader = ...). A process that makes many plots - the plot server,
+or a batch worker - can pass a CachedReader instead, so that a file used by several
+plots is only parsed once. A file is read again if its size or modification time
+changes. Compressed files are cached decompressed, and stdin is never cached.
+
+The cached rows are shared between plots, so callers must not modify them.
+"""
+import os
+from functools import lru_cache
+from dataReader import readDataFile, STDIN
+
+
+class CachedReader:
+    """Drop in replacement for readDataFile that remembers the last maxsize files it read."""
+
+    def __init__(self, maxsize = 32, reader = readDataFile):
+        """__init__.
+
+        Args:
+            maxsize: number of parsed files to keep.
+            reader: the function that actually reads a file.
+        """
+        self.reader = reader
+        self._read = lru_cache(maxsize = maxsize)(self._readFile)
+
+    def __call__(self, filename, delimiter = ' ', fieldnames = None, **kwargs):
+        if filename == STDIN:
+            # Only readable once, so never the same twice
+            return self.reader(filename, delimiter = delimiter, fieldnames = fieldnames, **kwargs)
+        stat = os.stat(filename)
+        return self._read(os.path.abspath(filename), stat.st_mtime_ns, stat.st_size, delimiter,
+                          tuple(fieldnames) if fieldnames else None,
+                          tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in kwargs.items())))
+
+    def _readFile(self, filename, mtime, size, delimiter, fieldnames, kwargs):
+        # mtime and size are only there to be part of the cache key
+        return self.reader(filename, delimiter = delimiter, fieldnames = list(fieldnames) if fieldnames else None, **dict(kwargs))
+
+    def cacheInfo(self):
+        """hits, misses, maxsize and currsize, as from functools.lru_cache."""
+        return self._read.cache_info()
+
+    def clear(self):
+        self._read.cache_clear()
@@ -2,7 +2,7 @@
 """Do a generic scatter plot.
 
 Usage:
-  %s <inputFile>... [--x=<x>] [--y=<y>] [--yerror=<yerror>] [--xlower=<xlower>] [--xupper=<xupper>] [--ylower=<ylower>] [--yupper=<yupper>] [--outputFile=<file>] [--threshold=<threshold>] [--log] [--xlabel=<xlabel>] [--ylabel=<ylabel>] [--xmajorticks=<xmajorticks>] [--xminorticks=<xminorticks>] [--ymajorticks=<ymajorticks>] [--yminorticks=<yminorticks>] [--plotlabel=<plotlabel>] [--plotlabelpos=<plotlabelpos>] [--panellabel=<panellabel>] [--panellabelpos=<panellabelpos>] [--alpha=<alpha>] [--pointsize=<pointsize>] [--mjdXaxis] [--addSecondaryTimeXAxis] [--grid] [--colour=<colour>] [--invert] [--tight] [--figsize=<figsize>] [--header=<header>] [--normalise] [--line] [--linewidth=<linewidth>] [--error] [--errorthick=<errorthick>] [--delimiter=<delimiter>] [--legend] [--legendlabels=<legendlabels>] [--equalaspect] [--title=<title>]
+  %s <inputFile>... [--x=<x>] [--y=<y>] [--yerror=<yerror>] [--xlower=<xlower>] [--xupper=<xupper>] [--ylower=<ylower>] [--yupper=<yupper>] [--outputFile=<file>] [--threshold=<threshold>] [--log] [--xlabel=<xlabel>] [--ylabel=<ylabel>] [--xmajorticks=<xmajorticks>] [--xminorticks=<xminorticks>] [--ymajorticks=<ymajorticks>] [--yminorticks=<yminorticks>] [--plotlabel=<plotlabel>] [--plotlabelpos=<plotlabelpos>] [--panellabel=<panellabel>] [--panellabelpos=<panellabelpos>] [--alpha=<alpha>] [--pointsize=<pointsize>] [--mjdXaxis] [--addSecondaryTimeXAxis] [--grid] [--colour=<colour>] [--invert] [--tight] [--figsize=<figsize>] [--header=<header>] [--normalise] [--line] [--linewidth=<linewidth>] [--error] [--errorthick=<errorthick>] [--delimiter=<delimiter>] [--legend] [--legendlabels=<legendlabels>] [--equalaspect] [--title=<title>] [--outputs=<outputs>] [--rasterthreshold=<rasterthreshold>] [--rasterdpi=<rasterdpi>] [--skipunchanged] [--profile=<profile>] [--cprofile=<cprofile>]
   %s (-h | --help)
   %s --version
 
@@ -17,6 +17,12 @@ Options:
   --ylower=<ylower>                 ylower limit
   --yupper=<yupper>                 yupper limit
   --outputFile=<file>               Output file. If not defined, show plot.
+  --outputs=<outputs>               Also write the plot to these files, drawing it only once: comma separated, each with an optional @<dpi> (e.g. lc.png,lc.pdf,lc_thumb.png@50).
+  --rasterthreshold=<rasterthreshold>  In vector files (pdf, svg, eps), draw the points and lines as an image if there are more than this many, and report the file sizes.
+  --rasterdpi=<rasterdpi>           Resolution of the points and lines drawn as an image in vector files [default: 300].
+  --skipunchanged                   Don't make the plot if the output files were made from the same input files, with the same options.
+  --profile=<profile>               Report the wall time, CPU time, peak memory and number of artists of each stage (read, parse, draw, save): to stderr if -, otherwise to this JSON file.
+  --cprofile=<cprofile>             Also dump cProfile statistics for the whole run to this file.
   --threshold=<threshold>           Plots a vertical dotted line.
   --xlabel=<xlabel>                 x label [default: ]
   --ylabel=<ylabel>                 y label [default: ]
@@ -65,19 +71,11 @@ import sys
 __doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
 import os, shutil, re, csv, subprocess
-from gkutils.commonutils import Struct, cleanOptions, readGenericDataFile
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MultipleLocator
-from matplotlib.ticker import AutoMinorLocator
+from gkutils.commonutils import Struct, cleanOptions
+from outputCache import OutputCache, outputFiles
+from profiling import profiled, stage
+from dataReader import readDataFile
 #from matplotlib.dates import epoch2num
-import matplotlib.dates as mdates
-
-
-years = mdates.YearLocator()   # every year
-months = mdates.MonthLocator()  # every month
-#months = mdates.MonthLocator(range(1, 13), bymonthday=1, interval=3)
-monthsFmt = mdates.DateFormatter("%b %Y")
-yearsFmt = mdates.DateFormatter('%Y')
 
 import numpy as n
 
@@ -87,15 +85,19 @@ SMALL_SIZE = 14
 MEDIUM_SIZE = 18
 BIGGER_SIZE = 25
 TINY_SIZE = 12
-plt.rc('font', size=SMALL_SIZE)                   # controls default text sizes
-plt.rc('axes', titlesize=TINY_SIZE)            # fontsize of the axes title
-plt.rc('axes', labelsize=TINY_SIZE)           # fontsize of the x and y labels
-plt.rc('xtick', labelsize=TINY_SIZE)            # fontsize of the tick labels
-plt.rc('ytick', labelsize=TINY_SIZE)            # fontsize of the tick labels
-plt.rc('legend', fontsize=TINY_SIZE)               # legend fontsize
-plt.rc('figure', titlesize=BIGGER_SIZE)   # fontsize of the figure title
-plt.rcParams["font.family"] = "serif"
-plt.rcParams['mathtext.fontset'] = 'dejavuserif'
+
+def setStyle():
+    """Set this script's matplotlib rc style."""
+    import matplotlib
+    matplotlib.rc('font', size=SMALL_SIZE)                   # controls default text sizes
+    matplotlib.rc('axes', titlesize=TINY_SIZE)            # fontsize of the axes title
+    matplotlib.rc('axes', labelsize=TINY_SIZE)           # fontsize of the x and y labels
+    matplotlib.rc('xtick', labelsize=TINY_SIZE)            # fontsize of the tick labels
+    matplotlib.rc('ytick', labelsize=TINY_SIZE)            # fontsize of the tick labels
+    matplotlib.rc('legend', fontsize=TINY_SIZE)               # legend fontsize
+    matplotlib.rc('figure', titlesize=BIGGER_SIZE)   # fontsize of the figure title
+    matplotlib.rcParams["font.family"] = "serif"
+    matplotlib.rcParams['mathtext.fontset'] = 'dejavuserif'
 
 def mjd2epoch(mjd):
     """
@@ -112,12 +114,14 @@ def convert_ax2_to_epoch(ax1, ax2):
     #ax2.figure.canvas.draw()
 
 def plotScatter(data, options):
+    from figures import newFigure, finishFigure, rasterOptions
+    from matplotlib.ticker import MultipleLocator, AutoMinorLocator
 
     colours = options.colour.split(',')
     alphas = options.alpha.split(',')
     figsize = options.figsize.split(',')
 
-    fig = plt.figure(figsize=(float(figsize[0]), float(figsize[1])))
+    fig = newFigure(figsize=(float(figsize[0]), float(figsize[1])))
 
     if options.legend:
         plotlabels = options.legendlabels.split(',')
@@ -161,11 +165,12 @@ def plotScatter(data, options):
 
         if options.mjdXaxis and options.addSecondaryTimeXAxis:
             # Assumes x axis is MJD
+            import matplotlib.dates as mdates
             ax2 = ax1.twiny()
             ax2.set_xlim(mjd2epoch(float(options.xlower)), mjd2epoch(float(options.xupper)))
-            ax2.xaxis.set_major_locator(years)
-            ax2.xaxis.set_major_formatter(yearsFmt)
-            ax2.xaxis.set_minor_locator(months)
+            ax2.xaxis.set_major_locator(mdates.YearLocator())   # every year
+            ax2.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
+            ax2.xaxis.set_minor_locator(mdates.MonthLocator())  # every month
             ax2.set_xlabel('Date')
             #ax2.xaxis.set_minor_formatter(monthsFmt)
 
@@ -231,43 +236,53 @@ def plotScatter(data, options):
 
 
     if options.grid:
-        plt.grid(which='major', linestyle=':')
-        plt.grid(which='minor', linestyle=':')
+        ax1.grid(which='major', linestyle=':')
+        ax1.grid(which='minor', linestyle=':')
 
     if options.tight:
-        plt.tight_layout()
+        with stage('layout'):
+            fig.tight_layout()
+
+    return finishFigure(fig, options.outputFile, outputs = getattr(options, 'outputs', None), bbox_inches='tight', pad_inches = 0.05, dpi=600, **rasterOptions(options))
 
-    if options.outputFile is not None:
-        plt.savefig(options.outputFile, bbox_inches='tight', pad_inches = 0.05, dpi=600)
-    else:
-        plt.show()
 
+def doPlots(options, reader = readDataFile):
+    """Read the input files and plot them.
 
-def doPlots(options):
+    Args:
+        options:
+        reader: function to read a file into a list of row dicts, e.g. a cached reader in the plot server.
+    """
     # There may be more than one inputFile
     allData = []
     fieldnames = None
     if options.header:
         fieldnames = options.header.split(options.delimiter)
+    columns = [options.x, options.y]
+    if options.error:
+        columns.append(options.yerror)
     for datafile in options.inputFile:
         data = {}
-        dataRows = readGenericDataFile(datafile, delimiter=options.delimiter, fieldnames=fieldnames)
+        with stage('read'):
+            dataRows = reader(datafile, delimiter=options.delimiter, fieldnames=fieldnames, columns=columns)
 
         x = []
         y = []
         yerror = []
-        for row in dataRows:
-            x.append(float(row[options.x]))
-            y.append(float(row[options.y]))
-            if options.error:
-                yerror.append(float(row[options.yerror]))
+        with stage('parse'):
+            for row in dataRows:
+                x.append(float(row[options.x]))
+                y.append(float(row[options.y]))
+                if options.error:
+                    yerror.append(float(row[options.yerror]))
         data['x'] = x
         data['y'] = y
         if options.error:
             data['yerror'] = yerror
         allData.append(data)
 
-    plotScatter(allData, options)
+    with stage('draw'):
+        plotScatter(allData, options)
 
 
 def main():
@@ -275,7 +290,19 @@ def main():
     opts = cleanOptions(opts)
     options = Struct(**opts)
 
-    doPlots(options)
+    cache, upToDate = OutputCache.skip(options, options.inputFile, outputFiles(options.outputFile, options.outputs))
+    if upToDate:
+        return
+
+    setStyle()
+    from figures import waitForOutputs
+
+    with profiled(options.profile, options.cprofile):
+        doPlots(options)
+        with stage('write'):
+            waitForOutputs()
+    if cache:
+        cache.record()
 
 
 if __name__=='__main__':
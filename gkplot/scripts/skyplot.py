@@ -2,7 +2,7 @@
 """Plot sky positions onto an Aitoff map of the sky.
 
 Usage:
-  %s <filename>... [--racol=<racol>] [--deccol=<deccol>] [--mjdcol=<mjdcol>] [--filtercol=<filtercol>] [--expnamecol=<expnamecol>] [--commentcol=<commentcol>] [--usepatches] [--alpha=<alpha>] [--outfile=<outfile>] [--tight] [--delimiter=<delimiter>] [--pointsize=<pointsize>] [--title=<title>] [--rectangular] [--fpshape=<fpshape>]
+  %s <filename>... [--racol=<racol>] [--deccol=<deccol>] [--mjdcol=<mjdcol>] [--filtercol=<filtercol>] [--expnamecol=<expnamecol>] [--commentcol=<commentcol>] [--usepatches] [--alpha=<alpha>] [--outfile=<outfile>] [--tight] [--delimiter=<delimiter>] [--pointsize=<pointsize>] [--title=<title>] [--rectangular] [--fpshape=<fpshape>] [--outputs=<outputs>] [--rasterthreshold=<rasterthreshold>] [--rasterdpi=<rasterdpi>] [--skipunchanged] [--profile=<profile>] [--cprofile=<cprofile>] [--maxmemory=<maxmemory>]
   %s (-h | --help)
   %s --version
 
@@ -18,6 +18,13 @@ Options:
   --usepatches                 Plot patches (defined shapes), not points, e.g. ATLAS square footprints or Pan-STARRS circles mapped onto the sky.
   --rectangular                Use a rectangular footprint (equatorial mount, which is always oriented north-up). Otherwise assume circular.
   --outfile=<outfile>          Output file.
+  --outputs=<outputs>          Also write the plot to these files, drawing it only once: comma separated, each with an optional @<dpi> (e.g. sky.png,sky.pdf,sky_thumb.png@50).
+  --rasterthreshold=<rasterthreshold>  In vector files (pdf, svg, eps), draw the points or patches as an image if there are more than this many, and report the file sizes. The galactic and ecliptic planes stay vector.
+  --rasterdpi=<rasterdpi>      Resolution of the points or patches drawn as an image in vector files [default: 300].
+  --skipunchanged              Don't make the plot if the output files were made from the same input files, with the same options.
+  --profile=<profile>          Report the wall time, CPU time, peak memory and number of artists of each stage (read, filter, draw, save): to stderr if -, otherwise to this JSON file.
+  --cprofile=<cprofile>        Also dump cProfile statistics for the whole run to this file.
+  --maxmemory=<maxmemory>      Try to stay within this much memory (e.g. 2G): if the file won't fit, read just the position, MJD and filter columns in chunks, as float32, and if the points still won't fit, draw a density map. The choices are reported.
   --alpha=<alpha>              Transparency. [default: 0.1]
   --tight                      Tight layout.
   --delimiter=<delimiter>      Delimiter to use [default:  ]
@@ -31,14 +38,16 @@ E.g.:
 import sys
 __doc__ = __doc__ % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
 from docopt import docopt
-from gkutils.commonutils import Struct, readGenericDataFile, cleanOptions, sexToDec, getMJDFromSqlDate, GalactictoJ2000, EcliptictoJ2000, getDateFromMJD, transform
+from gkutils.commonutils import Struct, cleanOptions, sexToDec, getMJDFromSqlDate, GalactictoJ2000, EcliptictoJ2000, getDateFromMJD, transform
 import csv
 
 import numpy as np
-import matplotlib.pyplot as pl
-from matplotlib import colors
-import matplotlib.patches as patches
+from outputCache import OutputCache, outputFiles
+from profiling import profiled, stage
+from dataReader import readColumnChunks, readDataFile
+from memoryBudget import MemoryBudget, parseMemory, fileRows, LIST_FLOAT_BYTES, POINT_BYTES, PATCH_BYTES
 import math
+from functools import lru_cache
 
 
 # ###########################################################################################
@@ -68,6 +77,44 @@ colors = ["#6A5ACD", #SlateBlue
           "#FA8072", #Salmon
           "#000000"]; #Black
 
+SKY_PLANES = {'galactic': GalactictoJ2000, 'ecliptic': EcliptictoJ2000}
+
+# Filters, in the order of their colours
+SKY_FILTERS = 'grizywco'
+
+# Bin size of the density map drawn when there are too many points to draw, in degrees
+DENSITY_BINSIZE = 1.0
+
+# dpi of the saved plot
+SKY_DPI = 600
+
+@lru_cache(maxsize=None)
+def skyPlaneCurve(plane):
+    """The galactic or ecliptic plane as (x, y) arrays in radians, in the same (flipped) RA convention as doPlot.
+
+    The curve is 36000 coordinate transformations, so it is only worked out once per process.
+    """
+    degtorad = math.pi/180.
+
+    ras = []
+    decs = []
+    for l in range(0, 36000, 1):
+        ra, dec = transform([l/100.0, 0.0], SKY_PLANES[plane])
+        if ra > 180.0:
+            ra = 360.0 - ra
+        else:
+            ra = (-1.0) * ra
+
+        ras.append(ra)
+        decs.append(dec)
+
+    ras = np.array(ras) * degtorad
+    decs = np.array(decs) * degtorad
+    ras.flags.writeable = False
+    decs.flags.writeable = False
+    return ras, decs
+
+
 def doPlot(options, objects, plotNumber = 111, alpha = 0.2, minMJD = 0.0, maxMJD = 60000.0, usePatches = False):
 
     gx = []
@@ -87,63 +134,64 @@ def doPlot(options, objects, plotNumber = 111, alpha = 0.2, minMJD = 0.0, maxMJD
     ox = []
     oy = []
 
-    for row in objects:
-        try:
-            ra = float(row[options.racol])
-        except ValueError as e:
-            ra = sexToDec(row[options.racol], ra=True)
+    with stage('filter'):
+        for row in objects:
+            try:
+                ra = float(row[options.racol])
+            except ValueError as e:
+                ra = sexToDec(row[options.racol], ra=True)
 
-        try:
-            dec = float(row[options.deccol])
-        except ValueError as e:
-            dec = sexToDec(row[options.deccol], ra=False)
-
-        if ra > 180.0:
-            ra = 360.0 - ra
-        else:
-            ra = (-1.0) * ra
+            try:
+                dec = float(row[options.deccol])
+            except ValueError as e:
+                dec = sexToDec(row[options.deccol], ra=False)
 
-        try:
-            mjd = float(row[options.mjdcol])
-            # Maybe we got JD, not MJD - check.
-            if mjd > 2400000.5:
-                mjd = mjd - 2400000.5
-        except ValueError as e:
-            mjd = getMJDFromSqlDate(row[options.mjdcol])
-
-        #if dec > -9.0 and dec < -8.0:
-        #if mjd > 57053: # January 31st
-        #if mjd > 57174: # June 1st
-        if mjd is not None and mjd > minMJD and mjd < maxMJD:
-            if row[options.filtercol][0] == 'g':
-                print('g')
-                gx.append(ra)
-                gy.append(dec)
-            elif row[options.filtercol][0] == 'r':
-                print('r')
-                rx.append(ra)
-                ry.append(dec)
-            elif row[options.filtercol][0] == 'i':
-                print('i')
-                ix.append(ra)
-                iy.append(dec)
-            elif row[options.filtercol][0] == 'z':
-                print('z')
-                zx.append(ra)
-                zy.append(dec)
-            elif row[options.filtercol][0] == 'y':
-                yx.append(ra)
-                yy.append(dec)
-            elif row[options.filtercol][0] == 'w':
-                wx.append(ra)
-                wy.append(dec)
-            elif row[options.filtercol][0] == 'c':
-                cx.append(ra)
-                cy.append(dec)
-            elif row[options.filtercol][0] == 'o':
-                ox.append(ra)
-                oy.append(dec)
-            #print (row[options.racol], row[options.deccol], row[options.expnamecol], row[options.commentcol], row[options.filtercol])
+            if ra > 180.0:
+                ra = 360.0 - ra
+            else:
+                ra = (-1.0) * ra
+
+            try:
+                mjd = float(row[options.mjdcol])
+                # Maybe we got JD, not MJD - check.
+                if mjd > 2400000.5:
+                    mjd = mjd - 2400000.5
+            except ValueError as e:
+                mjd = getMJDFromSqlDate(row[options.mjdcol])
+
+            #if dec > -9.0 and dec < -8.0:
+            #if mjd > 57053: # January 31st
+            #if mjd > 57174: # June 1st
+            if mjd is not None and mjd > minMJD and mjd < maxMJD:
+                if row[options.filtercol][0] == 'g':
+                    print('g')
+                    gx.append(ra)
+                    gy.append(dec)
+                elif row[options.filtercol][0] == 'r':
+                    print('r')
+                    rx.append(ra)
+                    ry.append(dec)
+                elif row[options.filtercol][0] == 'i':
+                    print('i')
+                    ix.append(ra)
+                    iy.append(dec)
+                elif row[options.filtercol][0] == 'z':
+                    print('z')
+                    zx.append(ra)
+                    zy.append(dec)
+                elif row[options.filtercol][0] == 'y':
+                    yx.append(ra)
+                    yy.append(dec)
+                elif row[options.filtercol][0] == 'w':
+                    wx.append(ra)
+                    wy.append(dec)
+                elif row[options.filtercol][0] == 'c':
+                    cx.append(ra)
+                    cy.append(dec)
+                elif row[options.filtercol][0] == 'o':
+                    ox.append(ra)
+                    oy.append(dec)
+                #print (row[options.racol], row[options.deccol], row[options.expnamecol], row[options.commentcol], row[options.filtercol])
 
     degtorad = math.pi/180.
 
@@ -171,9 +219,37 @@ def doPlot(options, objects, plotNumber = 111, alpha = 0.2, minMJD = 0.0, maxMJD
     ox = np.array(ox) * degtorad
     oy = np.array(oy) * degtorad
 
+    points = {'g': (gx, gy), 'r': (rx, ry), 'i': (ix, iy), 'z': (zx, zy), 'y': (yx, yy), 'w': (wx, wy), 'c': (cx, cy), 'o': (ox, oy)}
+    return drawSky(options, points, plotNumber = plotNumber, usePatches = usePatches)
+
+
+def drawSky(options, points, plotNumber = 111, usePatches = False, density = None):
+    """Draw the sky map.
 
-    fig2 = pl.figure(2)
-    ax1 = fig2.add_subplot(plotNumber, projection="hammer")
+    Args:
+        options:
+        points: dict of filter (one of SKY_FILTERS) -> (x, y) arrays in radians, with RA flipped as in doPlot.
+        plotNumber:
+        usePatches: draw the footprint of each exposure rather than a point.
+        density: if set, (counts, xedges, yedges) of binned positions to draw as a density map, instead of the points.
+    """
+    degtorad = math.pi/180.
+    empty = (np.zeros(0), np.zeros(0))
+    gx, gy = points.get('g', empty)
+    rx, ry = points.get('r', empty)
+    ix, iy = points.get('i', empty)
+    zx, zy = points.get('z', empty)
+    yx, yy = points.get('y', empty)
+    wx, wy = points.get('w', empty)
+    cx, cy = points.get('c', empty)
+    ox, oy = points.get('o', empty)
+
+    from figures import newFigure, keepVector
+    import matplotlib.patches as patches
+    from matplotlib.colors import LogNorm
+
+    fig = newFigure()
+    ax1 = fig.add_subplot(plotNumber, projection="hammer")
 
     s = 5.4 * degtorad
     if ',' in options.fpshape:
@@ -183,7 +259,11 @@ def doPlot(options, objects, plotNumber = 111, alpha = 0.2, minMJD = 0.0, maxMJD
 
     r = float(options.fpshape.split(',')[0]) * degtorad
 
-    if usePatches:
+    if density is not None:
+        counts, xedges, yedges = density
+        mesh = ax1.pcolormesh(xedges, yedges, np.ma.masked_equal(counts.T, 0), cmap = 'viridis', norm = LogNorm())
+        fig.colorbar(mesh, ax = ax1, orientation = 'horizontal', shrink = 0.6, pad = 0.08, label = 'Number per %g degree bin' % DENSITY_BINSIZE)
+    elif usePatches:
         # Square exposures for ATLAS, circular ones for PS1
         for x,y in zip(gx,gy):
             if options.rectangular:
@@ -264,57 +344,12 @@ def doPlot(options, objects, plotNumber = 111, alpha = 0.2, minMJD = 0.0, maxMJD
 
 
     # Plot the galactic plane
-
-    gp = []
-    for l in range(0, 36000, 1):
-        equatorialCoords = transform([l/100.0, 0.0], GalactictoJ2000)
-        gp.append(equatorialCoords)
-
-
-    ras = []
-    decs = []
-    for row in gp:
-        ra, dec = row
-        if ra > 180.0:
-            ra = 360.0 - ra
-        else:
-            ra = (-1.0) * ra
-
-        ras.append(ra)
-        decs.append(dec)
-
-
-    ras = np.array(ras) * degtorad
-    decs = np.array(decs) * degtorad
-
-    ax1.plot(ras,decs, 'k.', markersize=1.0)
+    ras, decs = skyPlaneCurve('galactic')
+    keepVector(*ax1.plot(ras,decs, 'k.', markersize=1.0))
 
     # Plot the ecliptic plane
-
-
-    ep = []
-    for l in range(0, 36000, 1):
-        equatorialCoords = transform([l/100.0, 0.0], EcliptictoJ2000)
-        ep.append(equatorialCoords)
-
-
-    ras = []
-    decs = []
-    for row in ep:
-        ra, dec = row
-        if ra > 180.0:
-            ra = 360.0 - ra
-        else:
-            ra = (-1.0) * ra
-
-        ras.append(ra)
-        decs.append(dec)
-
-
-    ras = np.array(ras) * degtorad
-    decs = np.array(decs) * degtorad
-
-    ax1.plot(ras,decs, 'b.', markersize=1.0)
+    ras, decs = skyPlaneCurve('ecliptic')
+    keepVector(*ax1.plot(ras,decs, 'b.', markersize=1.0))
 
 
     #ax1.axes.yaxis.set_ticklabels([])
@@ -325,30 +360,155 @@ def doPlot(options, objects, plotNumber = 111, alpha = 0.2, minMJD = 0.0, maxMJD
     #    ax1.text(xrad[i], yrad[i], lab[i])
 
     if options.title:
-        #pl.title("%s" % options.title, color='b', fontsize=12)
-        pl.title("%s" % getDateFromMJD(float(options.title)).split(' ')[0], color='b', fontsize=12)
-    pl.grid(True)
-    return pl
+        #ax1.set_title("%s" % options.title, color='b', fontsize=12)
+        ax1.set_title("%s" % getDateFromMJD(float(options.title)).split(' ')[0], color='b', fontsize=12)
+    ax1.grid(True)
+    return fig
 
 
 def plotHammerProjection(options, filename, objects, alpha = 0.2, minMJD = 0.0, maxMJD = 70000.0, usePatches = False):
 
     print (maxMJD -1, maxMJD)
     print (minMJD, maxMJD)
-#    pl = doPlot(options, objects, plotNumber = 212, alpha = alpha, minMJD = maxMJD - 1, maxMJD = maxMJD)
-    pl = doPlot(options, objects, plotNumber = 111, alpha = alpha, minMJD = minMJD, maxMJD = maxMJD, usePatches = usePatches)
-    #pl = doPlot(options, objects, plotNumber = 212, alpha = alpha, minMJD = 57168, maxMJD = 57169)
+#    fig = doPlot(options, objects, plotNumber = 212, alpha = alpha, minMJD = maxMJD - 1, maxMJD = maxMJD)
+    fig = doPlot(options, objects, plotNumber = 111, alpha = alpha, minMJD = minMJD, maxMJD = maxMJD, usePatches = usePatches)
+    #fig = doPlot(options, objects, plotNumber = 212, alpha = alpha, minMJD = 57168, maxMJD = 57169)
+
+    return finishSkyPlot(options, fig)
+    #fig.savefig(filename + '_%s' % str(maxMJD) + '.png', dpi=600)
+
 
+
+def finishSkyPlot(options, fig):
+    from figures import finishFigure, rasterOptions
     if options.tight:
-        pl.tight_layout()
+        with stage('layout'):
+            fig.tight_layout()
+
+    return finishFigure(fig, options.outfile or None, outputs = getattr(options, 'outputs', None), dpi=SKY_DPI, **rasterOptions(options))
 
-    if options.outfile:
-        pl.savefig(options.outfile, dpi=600)
-        pl.clf()
-    else:
-        pl.show()
-        #pl.savefig(filename + '_%s' % str(maxMJD) + '.png', dpi=600)
 
+def columnFloats(values, convert):
+    """A column of strings as floats, using convert for any value that isn't a plain number (e.g. sexagesimal)."""
+    try:
+        return values.astype(float)
+    except ValueError:
+        pass
+
+    def toFloat(value):
+        try:
+            return float(value)
+        except ValueError:
+            value = convert(value)
+            return np.nan if value is None else value
+
+    return np.array([toFloat(v) for v in values], dtype=float)
+
+
+def readSkyChunks(options, filename, chunkSize, dtype = np.float32, minMJD = 0.0, maxMJD = 70000.0, binned = False, maxPoints = None):
+    """Read the positions in a file a chunk at a time, selecting them by MJD and filter as doPlot does.
+
+    Args:
+        options:
+        filename:
+        chunkSize: rows per chunk.
+        dtype: type of the positions to keep.
+        minMJD:
+        maxMJD:
+        binned: count the positions in DENSITY_BINSIZE bins as they are read, rather than keeping them.
+        maxPoints: if set, keep the positions until there are more than this many, then
+            count those kept so far, and the rest as they are read, as if binned.
+
+    Returns:
+        (points, None), with points as for drawSky, or (None, density) if binned.
+    """
+    degtorad = math.pi/180.
+    columns = [options.racol, options.deccol, options.mjdcol, options.filtercol]
+    xedges = np.linspace(-math.pi, math.pi, int(round(360.0 / DENSITY_BINSIZE)) + 1)
+    yedges = np.linspace(-math.pi / 2, math.pi / 2, int(round(180.0 / DENSITY_BINSIZE)) + 1)
+    counts = np.zeros((len(xedges) - 1, len(yedges) - 1), dtype = np.int64)
+    points = {f: ([], []) for f in SKY_FILTERS}
+    kept = 0
+
+    for chunk in readColumnChunks(filename, columns = columns, delimiter = options.delimiter, chunkSize = chunkSize):
+        ra = columnFloats(chunk[options.racol], lambda v: sexToDec(v, ra=True))
+        dec = columnFloats(chunk[options.deccol], lambda v: sexToDec(v, ra=False))
+        mjd = columnFloats(chunk[options.mjdcol], getMJDFromSqlDate)
+        # Maybe we got JD, not MJD
+        mjd = np.where(mjd > 2400000.5, mjd - 2400000.5, mjd)
+        filters = chunk[options.filtercol].astype('U1')
+
+        x = np.where(ra > 180.0, 360.0 - ra, -ra) * degtorad
+        y = dec * degtorad
+        # NaN MJDs (dates that couldn't be read) are never in range
+        inRange = (mjd > minMJD) & (mjd < maxMJD)
+
+        if binned:
+            keep = inRange & np.isin(filters, list(SKY_FILTERS))
+            counts += np.histogram2d(x[keep], y[keep], bins = (xedges, yedges))[0].astype(np.int64)
+            continue
+        for f in SKY_FILTERS:
+            keep = inRange & (filters == f)
+            points[f][0].append(x[keep].astype(dtype))
+            points[f][1].append(y[keep].astype(dtype))
+            kept += np.count_nonzero(keep)
+
+        if maxPoints is not None and kept > maxPoints:
+            # Too many to draw after all: count the points kept so far, and bin from here on
+            for xs, ys in points.values():
+                for xf, yf in zip(xs, ys):
+                    counts += np.histogram2d(xf, yf, bins = (xedges, yedges))[0].astype(np.int64)
+            points = {f: ([], []) for f in SKY_FILTERS}
+            binned = True
+
+    if binned:
+        return None, (counts, xedges, yedges)
+    return {f: (np.concatenate(xs) if xs else np.zeros(0, dtype), np.concatenate(ys) if ys else np.zeros(0, dtype)) for f, (xs, ys) in points.items()}, None
+
+
+def fitsWhole(options, filename, budget):
+    """Whether a file can be read whole, and plotted as usual, within the memory budget."""
+    rows, columns = fileRows(filename, options.delimiter)
+    if rows is None:
+        budget.decide("the size of %s can't be known in advance: reading it in chunks" % filename)
+        return False
+    perRow = budget.dictRowBytes(columns) + 2 * LIST_FLOAT_BYTES + (PATCH_BYTES if options.usepatches else POINT_BYTES)
+    return budget.fits(rows * perRow, "reading about %d rows of %s whole" % (rows, filename))
+
+
+def plotSkyChunks(options, filename, budget, minMJD = 0.0, maxMJD = 70000.0, usePatches = False):
+    """Plot a file too big to read whole within the memory budget, reading just the columns needed, in chunks."""
+    rows, columns = fileRows(filename, options.delimiter)
+    chunkSize = budget.chunkSize(4)
+    budget.decide("reading the position, MJD and filter columns in chunks of %d rows" % chunkSize)
+
+    import matplotlib
+    width = matplotlib.rcParams['figure.figsize'][0]
+    dtype = budget.floatType(math.pi, 2 * math.pi / (width * SKY_DPI), "positions")
+    drawing = 'footprints' if usePatches else 'points'
+    pointBytes = 2 * np.dtype(dtype).itemsize + (PATCH_BYTES if usePatches else POINT_BYTES)
+    maxPoints = None
+    if rows is None:
+        # Keep the points while they fit, and only bin them once they don't
+        binned = False
+        maxPoints = int(max(budget.available, 0) // pointBytes)
+        budget.decide("the number of %s is unknown: drawing them if there are no more than about %d, otherwise a density map of %g degree bins" % (drawing, maxPoints, DENSITY_BINSIZE))
+    else:
+        binned = not budget.fits(rows * pointBytes, "drawing about %d %s" % (rows, drawing))
+        if binned:
+            budget.decide("drawing a density map of %g degree bins instead of the %s" % (DENSITY_BINSIZE, drawing))
+
+    # Reads, and selects by MJD and filter, as it goes
+    with stage('read'):
+        points, density = readSkyChunks(options, filename, chunkSize, dtype = dtype, minMJD = minMJD, maxMJD = maxMJD, binned = binned, maxPoints = maxPoints)
+    if maxPoints is not None:
+        if density is None:
+            budget.decide("%d %s fit: drawing them" % (sum(len(x) for x, y in points.values()), drawing))
+        else:
+            budget.decide("more than %d %s: drawing a density map of %g degree bins instead" % (maxPoints, drawing, DENSITY_BINSIZE))
+    with stage('draw'):
+        fig = drawSky(options, points or {}, usePatches = usePatches, density = density)
+        return finishSkyPlot(options, fig)
 
 
 def doStats(options, filename, objects):
@@ -388,12 +548,42 @@ def doStats(options, filename, objects):
 
 
 
+def doPlots(options, reader = readDataFile):
+    """Plot each of the input files.
+
+    Args:
+        options:
+        reader: function to read a file into a list of row dicts, e.g. a cached reader in the plot server.
+    """
+    print(options)
+    print("Delimiter = ", options.delimiter)
+    budget = None
+    if options.maxmemory:
+        budget = MemoryBudget(parseMemory(options.maxmemory), dpi = SKY_DPI)
+
+    for filename in options.filename:
+        if budget is not None and not fitsWhole(options, filename, budget):
+            # Has its own read and draw stages
+            plotSkyChunks(options, filename, budget, usePatches = options.usepatches)
+            continue
+        with stage('read'):
+            objectsList = reader(filename, delimiter=options.delimiter, columns=[options.racol, options.deccol, options.mjdcol, options.filtercol])
+        with stage('draw'):
+            plotHammerProjection(options, filename, objectsList, alpha=float(options.alpha), usePatches = options.usepatches)
+
+
 def main(argv = None):
     opts = docopt(__doc__, version='0.1')
     opts = cleanOptions(opts)
 
     options = Struct(**opts)
 
+    cache, upToDate = OutputCache.skip(options, options.filename, outputFiles(options.outfile, options.outputs))
+    if upToDate:
+        return
+
+    from figures import waitForOutputs
+
 
 
     # maxMJD = 57169 = 27th May 2015.  GPC1 out of sync after that.
@@ -435,12 +625,13 @@ def main(argv = None):
 #    plotHammerProjection(options, filename, objectsList, alpha=0.02, usePatches = True, minMJD = sep01, maxMJD = oct01)
     #alpha = 0.002
 
-    print(options)
-    print("Delimiter = ", options.delimiter)
-    for filename in options.filename:
-        objectsList = readGenericDataFile(filename, delimiter=options.delimiter)
-        plotHammerProjection(options, filename, objectsList, alpha=float(options.alpha), usePatches = options.usepatches)
-    
+    with profiled(options.profile, options.cprofile):
+        doPlots(options)
+        with stage('write'):
+            waitForOutputs()
+    if cache:
+        cache.record()
+
 
     #doStats(options, filename, objectsList)
 
@@ -0,0 +1,12 @@
+"""The gkplot version, for the scripts that need it (gkplot --version and the output cache)."""
+import os
+
+VERSION_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '__version__')
+
+
+def getVersion():
+    """The gkplot version, from gkplot/__version__."""
+    version = {}
+    with open(VERSION_FILE) as f:
+        exec(f.read(), version)
+    return version['__version__']
@@ -0,0 +1,39 @@
+import os
+from setuptools import setup, find_namespace_packages
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+with open(os.path.join(here, 'README.md')) as f:
+    long_description = f.read()
+
+version = {}
+with open(os.path.join(here, 'gkplot', '__version__')) as f:
+    exec(f.read(), version)
+
+setup(
+    name='gkplot',
+    version=version['__version__'],
+    description='A bunch of Matplotlib plotting scripts',
+    long_description=long_description,
+    long_description_content_type='text/markdown',
+    packages=find_namespace_packages(include=['gkplot', 'gkplot.*']),
+    package_data={'gkplot': ['__version__']},
+    python_requires='>=3.8',
+    install_requires=[
+        'docopt',
+        'numpy',
+        'matplotlib',
+        'gkutils',
+    ],
+    extras_require={
+        'fits': ['astropy'],
+        'columnar': ['pyarrow'],
+        'zstd': ['zstandard'],
+    },
+    entry_points={
+        'console_scripts': [
+            'gkplot=gkplot.scripts.cli:main',
+            'gkplot-client=gkplot.scripts.plotClient:main',
+        ],
+    },
+)
@@ -0,0 +1,5 @@
+"""The scripts import each other by module name, so put their directory on the path."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gkplot', 'scripts'))
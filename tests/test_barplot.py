@@ -0,0 +1,57 @@
+import numpy as n
+import pytest
+from barplot import aggregateBars, categoryColumn
+
+
+def writeRows(path, rows):
+    with open(path, 'w') as f:
+        f.write('detector,flux\n')
+        for detector, flux in rows:
+            f.write('%s,%s\n' % (detector, flux))
+    return str(path)
+
+
+def randomRows(count = 1000, seed = 4):
+    rng = n.random.default_rng(seed)
+    return list(zip(rng.integers(0, 189, count), n.round(rng.uniform(-5, 100, count), 3)))
+
+
+def perRowTotals(rows, method):
+    """The old way: a dict of totals per detector."""
+    totals = {}
+    for detector, flux in rows:
+        totals[int(detector)] = totals.get(int(detector), 0) + (1 if method == 'count' else float(flux))
+    return totals
+
+
+@pytest.mark.parametrize('method', ['count', 'sum'])
+@pytest.mark.parametrize('chunkSize', [10, 1000000])
+def test_aggregate_bars_matches_per_row_totals(tmp_path, method, chunkSize):
+    rows = randomRows()
+    totals = aggregateBars(writeRows(tmp_path / 'rows.csv', rows), 'detector', y = 'flux', method = method, chunkSize = chunkSize)
+    expected = perRowTotals(rows, method)
+
+    assert len(totals) == max(expected) + 1
+    for detector, total in enumerate(totals):
+        assert total == pytest.approx(expected.get(detector, 0))
+
+
+def test_aggregate_bars_method(tmp_path):
+    with pytest.raises(ValueError, match = 'count or sum'):
+        aggregateBars(writeRows(tmp_path / 'rows.csv', randomRows(10)), 'detector', method = 'mean')
+
+
+@pytest.mark.parametrize('bad', ['', '-3', '2.5', 'R22'])
+def test_bad_categories_name_their_row(tmp_path, bad):
+    # The bad value is in the second chunk, so its row number counts the first
+    rows = randomRows(25) + [(bad, 1.0)] + randomRows(5)
+    with pytest.raises(ValueError, match = "Row 26: detector should be an integer >= 0, not '%s'" % bad):
+        aggregateBars(writeRows(tmp_path / 'rows.csv', rows), 'detector', chunkSize = 10)
+
+
+def test_category_column():
+    assert categoryColumn(n.array(['0', '3', '188']), 'detector').tolist() == [0, 3, 188]
+    assert categoryColumn(n.array([0.0, 3.0]), 'detector').tolist() == [0, 3]
+    for values in (n.array([1.0, n.nan]), n.array([1.0, 0.5]), n.array([1, -1])):
+        with pytest.raises(ValueError, match = 'Row 2'):
+            categoryColumn(values, 'detector')
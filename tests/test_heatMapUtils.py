@@ -0,0 +1,94 @@
+import sys
+import numpy as n
+import pytest
+from heatMapUtils import ATLAS_CHIP_SIZE, HEATMAP_RESOLUTIONS, binDetections, buildHeatMap, buildHeatMapPyramid, saveHeatMapPyramid, readMatrixFile, writeMatrixFile
+import plotATLASHeatMap
+
+
+def perRowHeatMap(x, y, resolution, chipSize = ATLAS_CHIP_SIZE):
+    """The old way, as gkutils' calculateHeatMap did it."""
+    matrix = n.zeros((resolution, resolution), dtype = int)
+    for xi, yi in zip(x, y):
+        col = int(float(xi) / (chipSize - 1) * resolution)
+        row = int(float(yi) / (chipSize - 1) * resolution)
+        if col >= 0 and row >= 0 and col < resolution and row < resolution:
+            matrix[row][col] += 1
+    return matrix
+
+
+def detections(count = 2000, seed = 2):
+    rng = n.random.default_rng(seed)
+    # Including some off the chip, some just below zero, and some on the bin edges
+    x = n.concatenate([rng.uniform(-100, ATLAS_CHIP_SIZE + 100, count), [0.0, -0.5, ATLAS_CHIP_SIZE - 1, (ATLAS_CHIP_SIZE - 1) / 2]])
+    y = n.concatenate([rng.uniform(-100, ATLAS_CHIP_SIZE + 100, count), [-0.5, 0.0, (ATLAS_CHIP_SIZE - 1) / 4, ATLAS_CHIP_SIZE - 1]])
+    return x, y
+
+
+@pytest.mark.parametrize('resolution', [8, 128, 512])
+def test_bin_detections_matches_per_row_binning(resolution):
+    x, y = detections()
+    assert (binDetections(x, y, resolution = resolution) == perRowHeatMap(x, y, resolution)).all()
+
+
+@pytest.mark.parametrize('chunkSize', [7, 1000000])
+def test_build_heat_map(tmp_path, chunkSize):
+    x, y = detections(500)
+    filename = tmp_path / 'detections.tsv'
+    with open(filename, 'w') as f:
+        f.write('x\ty\tobs\n')
+        for i, (xi, yi) in enumerate(zip(x, y)):
+            f.write('%.17g\t%.17g\t01a6000%do%04d\n' % (xi, yi, i % 3, i % 3))
+
+    mat = buildHeatMap(str(filename), resolution = 64, chunkSize = chunkSize)
+    assert (mat['matrix'] == perRowHeatMap(x, y, 64)).all()
+    assert mat['exps'] == {'01a6000%do%04d' % (i, i) for i in range(3)}
+
+
+def test_pyramid_matches_binning_at_each_resolution():
+    x, y = detections()
+    # Positions just below zero are the exception (see buildHeatMapPyramid)
+    onChip = (x >= 0) & (y >= 0)
+    x, y = x[onChip], y[onChip]
+
+    pyramid = buildHeatMapPyramid(binDetections(x, y, resolution = 512))
+    assert sorted(pyramid) == HEATMAP_RESOLUTIONS
+    for resolution, matrix in pyramid.items():
+        assert (matrix == binDetections(x, y, resolution = resolution)).all(), resolution
+
+
+def test_pyramid_file(tmp_path):
+    x, y = detections()
+    pyramid = buildHeatMapPyramid(binDetections(x, y, resolution = 64))
+    filename = str(tmp_path / 'pyramid.npz')
+    saveHeatMapPyramid(filename, pyramid, nobs = 42)
+
+    matrix, nobs = readMatrixFile(filename, resolution = 16)
+    assert (matrix == pyramid[16]).all()
+    assert nobs == 42
+    # No level finer than the matrix it was made from
+    matrix, nobs = readMatrixFile(filename, resolution = 128)
+    assert matrix is None
+
+
+@pytest.mark.parametrize('name', ['matrix.npy', 'matrix.tsv'])
+def test_matrix_files(tmp_path, name):
+    x, y = detections()
+    matrix = binDetections(x, y, resolution = 32)
+    filename = str(tmp_path / name)
+    writeMatrixFile(filename, matrix)
+
+    read, nobs = readMatrixFile(filename)
+    assert (read == matrix).all()
+    assert nobs is None
+
+
+def test_build_heat_map_resolution():
+    with pytest.raises(ValueError):
+        buildHeatMap('unused.tsv', resolution = 100)
+
+
+def test_heat_map_script_resolution(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['plotATLASHeatMap.py', 'unused.tsv', '--heatmapresolution=100'])
+    with pytest.raises(SystemExit) as e:
+        plotATLASHeatMap.main()
+    assert 'Heatmap resolution should be' in str(e.value)
@@ -0,0 +1,41 @@
+import numpy as n
+from gkutils.commonutils import Struct
+from histogramplot import groupedHistogram, groupLegendLabels
+
+
+def perGroupHistograms(values, groups, bins):
+    """The old way: one numpy.histogram per group."""
+    names = sorted(set(groups))
+    return names, n.array([n.histogram([v for v, g in zip(values, groups) if g == name], bins = bins)[0] for name in names])
+
+
+def test_grouped_histogram_matches_per_group_histograms():
+    rng = n.random.default_rng(1)
+    values = rng.uniform(10, 22, 5000)
+    groups = rng.choice(['ATLAS', 'ZTF', 'Pan-STARRS'], 5000)
+    bins = n.linspace(12, 21, 37)
+
+    names, counts = groupedHistogram(values, groups, bins)
+    expectedNames, expectedCounts = perGroupHistograms(values, groups, bins)
+
+    assert list(names) == expectedNames
+    assert (counts == expectedCounts).all()
+
+
+def test_grouped_histogram_edges():
+    # Values on the upper edge are in the last bin, as with numpy.histogram, and
+    # values outside the bins aren't counted
+    values = n.array([0.0, 0.5, 1.0, 2.0, 2.0, -0.1, 2.1])
+    groups = n.array(['a', 'a', 'b', 'a', 'b', 'a', 'b'])
+    names, counts = groupedHistogram(values, groups, n.array([0.0, 1.0, 2.0]))
+
+    assert list(names) == ['a', 'b']
+    assert counts.tolist() == [[2, 1], [0, 2]]
+
+
+def test_group_legend_labels():
+    names = ['ATLAS', 'Pan-STARRS', 'ZTF']
+    assert groupLegendLabels(Struct(leglabels = None), names) == names
+    # Groups without a --leglabels entry keep their own name
+    assert groupLegendLabels(Struct(leglabels = 'A,P'), names) == ['A', 'P', 'ZTF']
+    assert groupLegendLabels(Struct(leglabels = 'A,P,Z,extra'), names) == ['A', 'P', 'Z']
@@ -0,0 +1,38 @@
+import numpy as n
+import pytest
+from memoryBudget import MemoryBudget, parseMemory, MIN_CHUNK_SIZE
+from dataReader import DEFAULT_CHUNK_SIZE
+
+
+@pytest.mark.parametrize('text, size', [
+    ('512M', 512 * 10**6),
+    ('4G', 4 * 10**9),
+    ('2gb', 2 * 10**9),
+    ('1.5K', 1500),
+    (' 100 ', 100),
+    ('1T', 10**12),
+])
+def test_parse_memory(text, size):
+    assert parseMemory(text) == size
+
+
+@pytest.mark.parametrize('text', ['', 'G', 'lots', '4X'])
+def test_parse_memory_errors(text):
+    with pytest.raises(ValueError, match = 'Memory size'):
+        parseMemory(text)
+
+
+def test_budget_choices(capsys):
+    budget = MemoryBudget(parseMemory('100T'), figsize = (8, 6), dpi = 100)
+    assert budget.fits(10**12, 'a lot')
+    assert not budget.fits(10**15)
+    assert budget.chunkSize(4) == DEFAULT_CHUNK_SIZE
+    assert budget.floatType(n.pi, 1e-3, 'positions') is n.float32
+    assert budget.floatType(1e6, 1e-3, 'values') is n.float64
+    # Each choice is reported
+    assert capsys.readouterr().out.count('Memory budget') == len(budget.decisions) == 4
+
+    tiny = MemoryBudget(1, figsize = (8, 6), dpi = 100)
+    assert tiny.available < 0
+    assert tiny.chunkSize(4) == MIN_CHUNK_SIZE
+    assert not tiny.fits(1)
@@ -0,0 +1,111 @@
+import os
+import sys
+import pytest
+from gkutils.commonutils import Struct
+import outputCache
+from outputCache import OutputCache, outputFiles, optionsHash
+from plotATLASHeatMapBatch import batchOutputFiles
+
+
+@pytest.fixture
+def plot(tmp_path):
+    """An input file, an output file made from it, and the cache directory."""
+    inputFile = tmp_path / 'input.csv'
+    inputFile.write_text('x,y\n1,2\n')
+    outputFile = tmp_path / 'plot.png'
+    outputFile.write_bytes(b'png')
+    return str(inputFile), str(outputFile), str(tmp_path / 'cache')
+
+
+def test_output_files():
+    assert outputFiles(None, 'a.png', '') == ['a.png']
+    assert outputFiles('a.png', 'b.pdf, thumb.png@50,', None) == ['a.png', 'b.pdf', 'thumb.png']
+
+
+def test_options_hash():
+    options = {'x': 'mjd', 'y': 'mag', 'skipunchanged': True, 'profile': '-'}
+    same = {'y': 'mag', 'x': 'mjd', 'skipunchanged': False, 'profile': None, 'cprofile': 'run.prof'}
+    assert optionsHash(options) == optionsHash(same) == optionsHash(Struct(**same))
+    assert optionsHash(options) != optionsHash(dict(options, y = 'flux'))
+
+
+def test_gkplot_command_is_not_hashed(monkeypatch):
+    """Run as "gkplot bar ...", barplot's options include 'bar': True, which mustn't change the hash."""
+    import cli
+    monkeypatch.setattr(outputCache, 'IGNORED_OPTIONS', outputCache.IGNORED_OPTIONS)
+    monkeypatch.setattr(sys, 'argv', ['gkplot'])
+    with pytest.raises(SystemExit):
+        cli.runCommand('bar', ['--help'])
+    assert optionsHash({'bar': True, 'x': 'detector'}) == optionsHash({'x': 'detector'})
+
+
+def test_unchanged_once_recorded(plot):
+    inputFile, outputFile, cacheDir = plot
+    options = Struct(x = 'x', y = 'y')
+    assert not OutputCache(inputFile, [outputFile], options, directory = cacheDir).unchanged()
+
+    OutputCache(inputFile, [outputFile], options, directory = cacheDir).record()
+    assert OutputCache(inputFile, [outputFile], options, directory = cacheDir).unchanged()
+    assert not OutputCache(inputFile, [outputFile], Struct(x = 'x', y = 'x'), directory = cacheDir).unchanged()
+
+
+def test_touched_input(plot):
+    inputFile, outputFile, cacheDir = plot
+    options = Struct(x = 'x')
+    OutputCache(inputFile, [outputFile], options, directory = cacheDir).record()
+
+    # The same content, written again, is still unchanged
+    stat = os.stat(inputFile)
+    with open(inputFile, 'w') as f:
+        f.write('x,y\n1,2\n')
+    os.utime(inputFile, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert OutputCache(inputFile, [outputFile], options, directory = cacheDir).unchanged()
+
+    with open(inputFile, 'w') as f:
+        f.write('x,y\n1,3\n')
+    os.utime(inputFile, ns = (stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert not OutputCache(inputFile, [outputFile], options, directory = cacheDir).unchanged()
+
+
+def test_changed_or_missing_output(plot):
+    inputFile, outputFile, cacheDir = plot
+    options = Struct(x = 'x')
+    OutputCache(inputFile, [outputFile], options, directory = cacheDir).record()
+
+    with open(outputFile, 'ab') as f:
+        f.write(b'more')
+    assert not OutputCache(inputFile, [outputFile], options, directory = cacheDir).unchanged()
+    os.remove(outputFile)
+    assert not OutputCache(inputFile, [outputFile], options, directory = cacheDir).unchanged()
+
+
+def test_stdin_is_never_unchanged(plot):
+    inputFile, outputFile, cacheDir = plot
+    cache = OutputCache('-', [outputFile], Struct(x = 'x'), directory = cacheDir)
+    cache.record()
+    assert not cache.unchanged()
+
+
+def test_skip(plot, monkeypatch, capsys):
+    inputFile, outputFile, cacheDir = plot
+    monkeypatch.setenv('GKPLOT_CACHE', cacheDir)
+
+    assert OutputCache.skip(Struct(x = 'x', skipunchanged = False), inputFile, [outputFile]) == (None, False)
+
+    options = Struct(x = 'x', skipunchanged = True)
+    cache, upToDate = OutputCache.skip(options, inputFile, [outputFile])
+    assert cache is not None and not upToDate
+    cache.record()
+
+    cache, upToDate = OutputCache.skip(options, inputFile, [outputFile])
+    assert upToDate
+    assert 'up to date' in capsys.readouterr().out
+
+
+def test_batch_output_files():
+    options = Struct(outputDir = '/out', noplots = False, animation = 'nights.gif')
+    outputs = batchOutputFiles(options, ['/in/01a60001.tsv', '/in/01a60002.tsv'])
+    # Statistics, 2 nights and 2 stacks, 1 difference (the first night has none), each .npy and .png, and the animation
+    assert len(outputs) == 1 + 5 * 2 + 1
+    assert '/out/01a60002_diff.png' in outputs and '/out/01a60001_diff.npy' not in outputs
+    assert not any(f.endswith('.png') for f in batchOutputFiles(Struct(outputDir = '/out', noplots = True, animation = None), ['/in/01a60001.tsv']))
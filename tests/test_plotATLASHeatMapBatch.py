@@ -0,0 +1,47 @@
+import sys
+import numpy as n
+import pytest
+from heatMapUtils import heatMapStatistics, runningStackDifferences
+import plotATLASHeatMapBatch
+
+
+def nightlyMatrices(nights = 4, resolution = 16, seed = 3):
+    rng = n.random.default_rng(seed)
+    matrices = rng.poisson(20, (nights, resolution, resolution))
+    # A night with no detections at all
+    matrices[1] = 0
+    return matrices
+
+
+def test_statistics_match_per_matrix_statistics():
+    matrices = nightlyMatrices()
+    stats = heatMapStatistics(matrices, multiplier = 1.6)
+    for i, matrix in enumerate(matrices):
+        median = n.median(matrix)
+        assert stats['median'][i] == median
+        assert stats['mad'][i] == n.median(n.abs(matrix - median))
+        assert stats['stddev'][i] == pytest.approx(n.std(matrix))
+        assert stats['colorBarSpan'][i] == pytest.approx(1.6 * median)
+        assert stats['maskPercentage'][i] == pytest.approx(100.0 * (matrix > 1.6 * median).sum() / matrix.size)
+
+
+def test_running_stacks_and_differences():
+    matrices = nightlyMatrices()
+    stacks, differences = runningStackDifferences(matrices)
+
+    history = n.zeros_like(matrices[0])
+    for i, matrix in enumerate(matrices):
+        if history.sum() > 0:
+            expected = matrix - history * (matrix.sum() / history.sum())
+        else:
+            expected = n.zeros_like(matrix, dtype = float)
+        history = history + matrix
+        assert (stacks[i] == history).all()
+        assert differences[i] == pytest.approx(expected)
+
+
+def test_batch_script_resolution(monkeypatch, tmp_path):
+    monkeypatch.setattr(sys, 'argv', ['plotATLASHeatMapBatch.py', str(tmp_path), '--outputDir=%s' % tmp_path, '--heatmapresolution=100'])
+    with pytest.raises(SystemExit) as e:
+        plotATLASHeatMapBatch.main()
+    assert 'Heatmap resolution should be' in str(e.value)
@@ -0,0 +1,28 @@
+import os
+from plotBatch import jobArgs, firstInput, makeTasks
+
+
+def test_job_args_from_options():
+    defaults = {'scatter': {'x': 'mjd', 'y': 'mag', 'error': True, 'grid': True}}
+    job = {'command': 'scatter', 'inputs': ['a.csv', 'b.csv'],
+           'options': {'y': 'flux', 'grid': False, 'title': None, 'legendlabels': ['A', 'B'], 'alpha': 0.5}}
+
+    assert jobArgs(job, defaults) == ['a.csv', 'b.csv', '--x=mjd', '--y=flux', '--error', '--legendlabels=A,B', '--alpha=0.5']
+
+
+def test_job_args():
+    # A command line is passed through as it is, without the defaults
+    assert jobArgs({'command': 'sky', 'args': ['positions.txt', '--outfile=sky.png', 1]}, {'sky': {'usepatches': True}}) == ['positions.txt', '--outfile=sky.png', '1']
+    # A single input file needn't be a list, and other commands' defaults don't apply
+    assert jobArgs({'command': 'histogram', 'inputs': 'mags.csv'}, {'scatter': {'x': 'mjd'}}) == ['mags.csv']
+
+
+def test_tasks_keep_jobs_with_the_same_input_together():
+    jobs = [{'index': i, 'args': [name, '--outputFile=%d.png' % i], 'cwd': '/data'} for i, name in enumerate(['a.csv'] * 4 + ['b.csv', 'c.csv'])]
+    assert firstInput(jobs[0]['args'], '/data') == os.path.abspath('/data/a.csv')
+
+    tasks = makeTasks(jobs, processes = 2)
+    # a.csv's jobs are split between the two workers, and b.csv and c.csv have a task each
+    assert sorted(len(task) for task in tasks) == [1, 1, 2, 2]
+    for task in tasks:
+        assert len({firstInput(job['args'], job['cwd']) for job in task}) == 1
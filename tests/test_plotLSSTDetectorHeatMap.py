@@ -0,0 +1,106 @@
+import csv
+import math
+import operator
+import numpy as n
+import pytest
+from lsstFocalPlane import NUM_DETECTORS
+from plotLSSTDetectorHeatMap import aggregate_detector_cuts, parse_cuts
+from plotLSSTDetectorCuts import defaultCuts, DEFAULT_CUTS, SINGLETONS_CUT
+
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '>=': operator.ge, '<=': operator.le, '>': operator.gt, '<': operator.lt}
+
+ROWS = [
+    # detector, diaObjectId, reliability, field
+    ('3', '0', '0.995', 'WFD'),
+    ('3', '5', '', 'WFD'),
+    ('3', '5', '0.999', 'DDF'),
+    ('4', '6', '0.2', 'DDF'),
+    ('', '7', '0.999', 'WFD'),
+    ('188', '8', '1.0', 'WFD'),
+    ('189', '9', '1.0', 'WFD'),
+    ('0', '', '0.5', ''),
+]
+
+
+def writeRows(path, rows = ROWS):
+    with open(path, 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(['detector', 'diaObjectId', 'reliability', 'field'])
+        writer.writerows(rows)
+    return str(path)
+
+
+def perRowCounts(rows, cuts):
+    """The old way: test each row against each cut, with blanks as NaN."""
+    counts = {name: n.zeros(NUM_DETECTORS, dtype = int) for name in cuts}
+    for detector, diaObjectId, reliability, field in rows:
+        if detector == '' or not 0 <= int(detector) < NUM_DETECTORS:
+            continue
+        row = {'diaObjectId': diaObjectId, 'reliability': reliability, 'field': field}
+        for name, conditions in cuts.items():
+            passed = True
+            for col, op, value in conditions:
+                try:
+                    value = float(value)
+                    have = float(row[col]) if row[col] != '' else math.nan
+                except ValueError:
+                    have = row[col]
+                passed = passed and OPERATORS[op](have, value)
+            if passed:
+                counts[name][int(detector)] += 1
+    return counts
+
+
+@pytest.mark.parametrize('chunkSize', [1, 3, 1000])
+def test_cut_counts_match_per_row_counts(tmp_path, chunkSize):
+    spec = 'all:;minus_diaobjectid0:diaObjectId!=0;reliability_gt_99:diaObjectId!=0&reliability>0.99;not_reliable:reliability!=0.2;ddf:field==DDF'
+    counts = aggregate_detector_cuts(writeRows(tmp_path / 'dia.csv'), spec, chunk_size = chunkSize)
+    expected = perRowCounts(ROWS, parse_cuts(spec))
+
+    assert list(counts) == list(expected)
+    for name in expected:
+        assert (counts[name] == expected[name]).all(), name
+
+
+def test_blank_cut_values(tmp_path):
+    counts = aggregate_detector_cuts(writeRows(tmp_path / 'dia.csv'), 'high:reliability>0.99;low:reliability<=0.99;not02:reliability!=0.2')
+    # Of detector 3's reliabilities (0.995, blank and 0.999), the blank one is
+    # neither high nor low, but is != 0.2
+    assert counts['high'][3] == 2
+    assert counts['low'][3] == 0
+    assert counts['not02'][3] == 3
+
+
+def test_blank_detectors_are_left_out(tmp_path):
+    counts = aggregate_detector_cuts(writeRows(tmp_path / 'dia.csv'), 'all:')
+    # The row with no detector, and detector 189, which doesn't exist
+    assert counts['all'].sum() == len(ROWS) - 2
+
+
+def test_non_numeric_columns(tmp_path):
+    filename = writeRows(tmp_path / 'dia.csv', ROWS + [('3', '10', 'high', 'WFD')])
+    with pytest.raises(ValueError, match = 'reliability'):
+        aggregate_detector_cuts(filename, 'reliable:reliability>0.99')
+
+    filename = writeRows(tmp_path / 'dia2.csv', ROWS + [('R22_S11', '10', '0.5', 'WFD')])
+    with pytest.raises(ValueError, match = 'detector'):
+        aggregate_detector_cuts(filename, 'all:')
+
+
+def test_parse_cuts():
+    assert parse_cuts('all:;nonzero:diaObjectId!=0;reliable:diaObjectId!=0&reliability>0.99') == {
+        'all': [],
+        'nonzero': [('diaObjectId', '!=', '0')],
+        'reliable': [('diaObjectId', '!=', '0'), ('reliability', '>', '0.99')],
+    }
+    with pytest.raises(ValueError):
+        parse_cuts('bad:reliability')
+
+
+def test_default_cuts(tmp_path):
+    assert defaultCuts(writeRows(tmp_path / 'dia.csv'), ',') == DEFAULT_CUTS
+
+    filename = tmp_path / 'singletons.csv'
+    filename.write_text('detector,diaObjectId,nDiaSources\n3,5,1\n')
+    assert defaultCuts(str(filename), ',') == DEFAULT_CUTS + ';' + SINGLETONS_CUT
+    assert 'minus_singletons' in parse_cuts(defaultCuts(str(filename), ','))
@@ -0,0 +1,60 @@
+import bz2
+import gzip
+import lzma
+import numpy as n
+import pytest
+from gkutils.commonutils import Struct
+from dataReader import readColumnChunks
+from skyplot import readSkyChunks, SKY_FILTERS
+
+OPTIONS = Struct(racol = 'ra', deccol = 'dec', mjdcol = 'mjd', filtercol = 'filter', delimiter = ' ')
+
+
+def skyText(count = 500, seed = 5):
+    rng = n.random.default_rng(seed)
+    lines = ['ra dec mjd filter']
+    for ra, dec, mjd, f in zip(rng.uniform(0, 360, count), rng.uniform(-90, 90, count), rng.uniform(57000, 60000, count), rng.choice(list('ocgrx'), count)):
+        lines.append('%.6f %.6f %.5f %s' % (ra, dec, mjd, f))
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture
+def skyFile(tmp_path):
+    filename = tmp_path / 'sky.txt'
+    filename.write_text(skyText())
+    return str(filename)
+
+
+def test_points_kept_while_they_fit(skyFile):
+    points, density = readSkyChunks(OPTIONS, skyFile, 100)
+    kept, keptDensity = readSkyChunks(OPTIONS, skyFile, 100, maxPoints = 10**6)
+    assert density is None and keptDensity is None
+    for f in SKY_FILTERS:
+        assert (kept[f][0] == points[f][0]).all() and (kept[f][1] == points[f][1]).all()
+
+
+@pytest.mark.parametrize('maxPoints', [0, 150])
+def test_switch_to_density_map(skyFile, maxPoints):
+    # Points on a bin edge can only land in the same bin if they are kept as float64
+    points, density = readSkyChunks(OPTIONS, skyFile, 100, dtype = n.float64, binned = True)
+    switched, switchedDensity = readSkyChunks(OPTIONS, skyFile, 100, dtype = n.float64, maxPoints = maxPoints)
+
+    assert points is None and switched is None
+    assert (switchedDensity[0] == density[0]).all()
+    # The rows whose filter isn't a sky filter (x) aren't counted
+    assert 0 < density[0].sum() < 500
+
+
+@pytest.mark.parametrize('suffix, compress', [('.gz', gzip.compress), ('.bz2', bz2.compress), ('.xz', lzma.compress)])
+def test_compressed_input(tmp_path, suffix, compress):
+    text = skyText()
+    plain = tmp_path / 'sky.txt'
+    plain.write_text(text)
+    compressed = tmp_path / ('sky.txt' + suffix)
+    compressed.write_bytes(compress(text.encode('utf-8')))
+
+    chunks = list(readColumnChunks(str(compressed), columns = ['ra', 'filter'], delimiter = ' ', chunkSize = 128))
+    expected = list(readColumnChunks(str(plain), columns = ['ra', 'filter'], delimiter = ' ', chunkSize = 128))
+    assert len(chunks) == len(expected) == 4
+    for chunk, expect in zip(chunks, expected):
+        assert (chunk['ra'] == expect['ra']).all() and (chunk['filter'] == expect['filter']).all()